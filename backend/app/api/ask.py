@@ -1,26 +1,183 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException, status
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
 
-from ..core.rag import retrieve_and_answer
-from ..core.settings import get_settings
-from ..models.schemas import AskRequest, AskResponse, ContextChunk
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from ..core.deadline import Deadline, DeadlineExceeded
+from ..core.profiling import annotate
+from ..core.rag import retrieve_and_answer, stream_retrieve_and_answer
+from ..core.scheduler import INTERACTIVE, get_scheduler, request_priority
+from ..core.settings import Settings, get_settings
+from ..core.singleflight import ask_flight, coalesce_key
+from ..models.schemas import AskRequest, AskResponse, ContextChunk, UsageInfo
 
 router = APIRouter(prefix="/ask", tags=["ask"])
+logger = logging.getLogger(__name__)
+
+
+def _can_coalesce(payload: AskRequest, cfg: Settings) -> bool:
+    # 会话模式的回答依赖各自的历史，不能合并
+    return cfg.coalesce_requests and not payload.session_id
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _error_event(exc: Exception) -> dict:
+    """流式响应已发送 200 状态头，错误以事件形式返回（状态码语义与 /ask 一致）。"""
+    if isinstance(exc, (FileNotFoundError, ValueError)):
+        code = status.HTTP_400_BAD_REQUEST
+    elif isinstance(exc, DeadlineExceeded):
+        code = status.HTTP_504_GATEWAY_TIMEOUT
+    elif isinstance(exc, RuntimeError):
+        code = status.HTTP_502_BAD_GATEWAY
+    else:
+        logger.exception("流式问答失败")
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    return {"type": "error", "status": code, "detail": str(exc)}
 
 
 @router.post("", response_model=AskResponse)
-async def ask_question(payload: AskRequest) -> AskResponse:
-    """问答接口：基于指定知识库索引进行 Top‑K 检索并调用生成模型返回答案与引用。"""
+async def ask_question(
+    payload: AskRequest, x_priority: Optional[str] = Header(default=None)
+) -> AskResponse:
+    """问答接口：基于指定知识库索引进行 Top‑K 检索并调用生成模型返回答案与引用。
+
+    同一知识库版本上进行中的相同问题只检索/生成一次，其余请求共享结果（只有执行的请求占用执行槽）。
+    请求经准入调度排队（默认交互优先级，`X-Priority: batch` 降为批量），繁忙时返回 429。
+    """
     cfg = get_settings()
+    top_k = payload.top_k or cfg.similarity_top_k
+    filters = payload.filters.as_dict() if payload.filters else None
+    # 截止时间从请求到达时起算，线程池排队时间也计算在内
+    deadline = Deadline(cfg.request_deadline_ms)
+
+    priority = request_priority(x_priority, INTERACTIVE)
+
+    async def answer():
+        # 只有实际执行检索与生成的请求占用执行槽；合并到它的请求只等待结果，不占槽
+        async with get_scheduler(cfg).slot(priority, deadline):
+            return await run_in_threadpool(
+                retrieve_and_answer,
+                payload.kb,
+                payload.question,
+                top_k,
+                cfg,
+                session_id=payload.session_id,
+                deadline=deadline,
+                filters=filters,
+            )
+
     try:
-        answer, contexts, latency = retrieve_and_answer(payload.kb, payload.question, payload.top_k, cfg)
+        if _can_coalesce(payload, cfg):
+            key = coalesce_key(payload.kb, cfg.index_dir / payload.kb, payload.question, top_k, filters)
+            (answer_text, contexts, latency, usage), shared = await ask_flight.do(key, answer)
+            annotate(coalesced=shared)
+        else:
+            answer_text, contexts, latency, usage = await answer()
     except FileNotFoundError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(exc)) from exc
     except RuntimeError as exc:
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(exc)) from exc
 
     context_models = [ContextChunk(**ctx) for ctx in contexts]
-    return AskResponse(answer=answer, contexts=context_models, latency_ms=latency)
+    return AskResponse(
+        answer=answer_text,
+        contexts=context_models,
+        latency_ms=latency,
+        session_id=payload.session_id,
+        usage=UsageInfo(**usage),
+    )
+
+
+class _SlotStreamingResponse(StreamingResponse):
+    """在响应结束时归还执行槽：无论正常结束、客户端断开，还是响应体从未开始迭代都会执行 on_close。"""
+
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._on_close()
+
+
+@router.post("/stream")
+async def ask_question_stream(
+    payload: AskRequest, x_priority: Optional[str] = Header(default=None)
+) -> StreamingResponse:
+    """流式问答（Server-Sent Events）：先返回 contexts 事件，再逐段返回 delta，最后 done 或 error。
+
+    进行中的相同问题共享同一路上游输出，后加入的请求会先回放已生成的部分，且不占用执行槽。
+    执行槽在事件流结束时才归还；排队已满时在建立事件流之前直接返回 429。
+    """
+    cfg = get_settings()
+    top_k = payload.top_k or cfg.similarity_top_k
+    filters = payload.filters.as_dict() if payload.filters else None
+    deadline = Deadline(cfg.request_deadline_ms)
+
+    def produce() -> Iterator[dict]:
+        return stream_retrieve_and_answer(
+            payload.kb,
+            payload.question,
+            top_k,
+            cfg,
+            session_id=payload.session_id,
+            deadline=deadline,
+            filters=filters,
+        )
+
+    scheduler = get_scheduler(cfg)
+    priority = request_priority(x_priority, INTERACTIVE)
+    headers = {"Cache-Control": "no-cache"}
+
+    if _can_coalesce(payload, cfg):
+        key = coalesce_key(payload.kb, cfg.index_dir / payload.kb, payload.question, top_k, filters)
+        # 执行槽由实际执行的请求在共享流内部持有到生成结束，后加入的请求直接订阅、不占槽
+        events, shared = await ask_flight.stream(key, produce, lambda: scheduler.slot(priority, deadline))
+        annotate(coalesced=shared)
+
+        async def body() -> AsyncIterator[str]:
+            try:
+                async for event in events:
+                    yield _sse(event)
+            except Exception as exc:
+                yield _sse(_error_event(exc))
+            finally:
+                await events.aclose()
+
+        # 响应体从未开始迭代（客户端提前断开）时也要退出共享流
+        return _SlotStreamingResponse(body(), events.aclose, media_type="text/event-stream", headers=headers)
+
+    acquired = await scheduler.acquire(priority, deadline)
+
+    async def release() -> None:
+        scheduler.release(priority, acquired)
+
+    try:
+
+        def body_sync() -> Iterator[str]:
+            try:
+                for event in produce():
+                    yield _sse(event)
+            except Exception as exc:
+                yield _sse(_error_event(exc))
+
+        # 同步迭代器放到线程池中执行
+        content = iterate_in_threadpool(body_sync())
+        return _SlotStreamingResponse(content, release, media_type="text/event-stream", headers=headers)
+    except BaseException:
+        await release()
+        raise
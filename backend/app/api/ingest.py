@@ -1,10 +1,13 @@
 from __future__ import annotations
 
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, status, UploadFile, File, Form, Path
+from starlette.concurrency import run_in_threadpool
 
+from ..core.catalog import get_catalog
 from ..core.rag import ingest_corpus
+from ..core.scheduler import INGEST, get_scheduler
 from ..core.settings import get_settings
 from ..models.schemas import IngestRequest, IngestResponse
 
@@ -13,14 +16,23 @@ router = APIRouter(tags=["ingest", "kb"])
 
 @router.post("/ingest", response_model=IngestResponse)
 async def ingest_endpoint(payload: IngestRequest) -> IngestResponse:
-    """构建/重建指定知识库的索引：从该知识库对应 RAW 目录读取所有文档。"""
+    """构建/重建指定知识库的索引：从该知识库对应 RAW 目录读取所有文档（入库优先级，在线程池中执行）。"""
     cfg = get_settings()
     try:
-        files, chunks = ingest_corpus(kb=payload.kb, rebuild=payload.rebuild, settings=cfg)
+        async with get_scheduler(cfg).slot(INGEST):
+            files, chunks, dedup_ratio = await run_in_threadpool(
+                ingest_corpus, kb=payload.kb, rebuild=payload.rebuild, settings=cfg, dimension=payload.dimension
+            )
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
-    return IngestResponse(ok=True, files=files, chunks=chunks, index_dir=str(cfg.index_dir / payload.kb))
+    return IngestResponse(
+        ok=True,
+        files=files,
+        chunks=chunks,
+        index_dir=str(cfg.index_dir / payload.kb),
+        dedup_ratio=dedup_ratio,
+    )
 
 
 @router.post("/kb/{kb}/upload", response_model=IngestResponse)
@@ -28,6 +40,7 @@ async def ingest_upload_endpoint(
     kb: str = Path(..., description="知识库名称"),
     files: List[UploadFile] = File(..., description="待入库的课程/知识库文档"),
     rebuild: bool = Form(True, description="是否全量重建索引，默认 true"),
+    dimension: Optional[int] = Form(None, description="嵌入维度，不指定时沿用知识库已有维度"),
 ) -> IngestResponse:
     """上传文件到指定知识库并构建/重建索引，对应前端 Ingest 页的上传入口。"""
     if not files:
@@ -56,9 +69,24 @@ async def ingest_upload_endpoint(
             ) from exc
 
     # 保存成功后，调用 ingest_corpus 进行索引构建
+    ingested = False
     try:
-        files_count, chunks = ingest_corpus(kb=kb, rebuild=rebuild, settings=cfg)
+        async with get_scheduler(cfg).slot(INGEST):
+            files_count, chunks, dedup_ratio = await run_in_threadpool(
+                ingest_corpus, kb=kb, rebuild=rebuild, settings=cfg, dimension=dimension
+            )
+        ingested = True
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    finally:
+        if not ingested:
+            # 文件已保存但未能入库（入库失败、排队被拒绝等），仍需同步目录中的文件统计
+            get_catalog(cfg).refresh(kb)
 
-    return IngestResponse(ok=True, files=files_count, chunks=chunks, index_dir=str(cfg.index_dir / kb))
+    return IngestResponse(
+        ok=True,
+        files=files_count,
+        chunks=chunks,
+        index_dir=str(cfg.index_dir / kb),
+        dedup_ratio=dedup_ratio,
+    )
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
-import json
 import os
 import re
+import tempfile
 from pathlib import Path
-from typing import Dict, List
+from typing import List
 
-from fastapi import APIRouter, HTTPException, Path as ApiPath, Body
+from fastapi import APIRouter, HTTPException, Path as ApiPath, Body, File, Query, UploadFile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
+from ..core.archive import export_kb, import_kb
+from ..core.catalog import get_catalog
 from ..core.settings import get_settings
 from ..core.rag import ingest_corpus
+from ..core.scheduler import INGEST, get_scheduler
+from ..core.shards import kb_lock, snapshot_cache
 from ..models.schemas import (
     KnowledgeBaseInfo,
     KnowledgeBaseListResponse,
@@ -18,34 +25,14 @@ from ..models.schemas import (
     KnowledgeBaseFileInfo,
     IngestResponse,
     KnowledgeBaseDeleteFilesRequest,
+    KnowledgeBaseImportResponse,
 )
 
 router = APIRouter(prefix="/kb", tags=["kb"])
 
-META_FILENAME = "_kb_meta.json"
 _KB_ID_PATTERN = re.compile(r"[^a-zA-Z0-9_-]+")
 
 
-def _load_meta(raw_root: Path) -> Dict[str, dict]:
-    path = raw_root / META_FILENAME
-    if not path.exists():
-        return {}
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-        kbs = data.get("kbs")
-        if isinstance(kbs, dict):
-            return kbs
-        return {}
-    except Exception:
-        return {}
-
-
-def _save_meta(raw_root: Path, meta: Dict[str, dict]) -> None:
-    path = raw_root / META_FILENAME
-    payload = {"kbs": meta}
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-
-
 def _generate_kb_id(display_name: str, existing_ids: set[str]) -> str:
     base = _KB_ID_PATTERN.sub("", display_name.replace(" ", "_")).lower() or "kb"
     base = base[:16]
@@ -59,22 +46,23 @@ def _generate_kb_id(display_name: str, existing_ids: set[str]) -> str:
 
 @router.get("", response_model=KnowledgeBaseListResponse)
 async def list_kbs() -> KnowledgeBaseListResponse:
-    """列出所有知识库及其文档数量。"""
+    """列出所有知识库及其统计信息（读取知识库目录；只扫描目录表中尚未登记的知识库）。"""
     cfg = get_settings()
-    raw_root = cfg.raw_dir
-    meta = _load_meta(raw_root)
-    items: List[KnowledgeBaseInfo] = []
-    if raw_root.exists():
-        for entry in raw_root.iterdir():
-            if not entry.is_dir() or entry.name == META_FILENAME:
-                continue
-            files_count = sum(
-                1 for p in entry.iterdir() if p.is_file()
-            )
-            kb_id = entry.name
-            info = meta.get(kb_id) or {}
-            display_name = info.get("name") or kb_id
-            items.append(KnowledgeBaseInfo(id=kb_id, name=display_name, files=files_count))
+    catalog = get_catalog(cfg)
+    catalog.sync_new()
+    items = [
+        KnowledgeBaseInfo(
+            id=row["id"],
+            name=row["name"] or row["id"],
+            files=row["files"],
+            bytes=row["bytes"],
+            chunks=row["chunks"],
+            index_version=row["index_version"] or None,
+            index_bytes=row["index_bytes"],
+            last_ingest=row["last_ingest"],
+        )
+        for row in catalog.list_kbs()
+    ]
     return KnowledgeBaseListResponse(items=items)
 
 
@@ -82,27 +70,20 @@ async def list_kbs() -> KnowledgeBaseListResponse:
 async def create_kb(payload: KnowledgeBaseCreateRequest) -> KnowledgeBaseInfo:
     """创建新的知识库目录。"""
     cfg = get_settings()
-    raw_root = cfg.raw_dir
     display_name = (payload.name or "").strip()
     if not display_name:
         raise HTTPException(status_code=400, detail="知识库名称不能为空")
 
-    meta = _load_meta(raw_root)
-    existing_ids: set[str] = set(meta.keys())
-    if raw_root.exists():
-        existing_ids.update(
-            entry.name for entry in raw_root.iterdir() if entry.is_dir() and entry.name != META_FILENAME
-        )
-
-    kb_id = _generate_kb_id(display_name, existing_ids)
-    kb_raw = (raw_root / kb_id).resolve()
+    catalog = get_catalog(cfg)
+    # 登记与 ID 唯一性检查在同一事务中完成；并发创建同名知识库时换一个 ID 重试
+    kb_id = _generate_kb_id(display_name, catalog.ids())
+    while not catalog.create(kb_id, display_name):
+        kb_id = _generate_kb_id(display_name, catalog.ids())
+    kb_raw = (cfg.raw_dir / kb_id).resolve()
     kb_index = (cfg.index_dir / kb_id).resolve()
     kb_raw.mkdir(parents=True, exist_ok=True)
     kb_index.mkdir(parents=True, exist_ok=True)
 
-    meta[kb_id] = {"name": display_name}
-    _save_meta(raw_root, meta)
-
     return KnowledgeBaseInfo(id=kb_id, name=display_name, files=0)
 
 
@@ -110,28 +91,30 @@ async def create_kb(payload: KnowledgeBaseCreateRequest) -> KnowledgeBaseInfo:
 async def delete_kb(kb: str = ApiPath(..., description="知识库名称")) -> None:
     """删除指定知识库（原始文档与索引目录）。"""
     cfg = get_settings()
-    raw_root = cfg.raw_dir
-    meta = _load_meta(raw_root)
     kb_id = kb.strip()
     if not kb_id:
         raise HTTPException(status_code=400, detail="知识库 ID 不能为空")
 
-    for root in (cfg.raw_dir / kb_id, cfg.index_dir / kb_id):
-        if root.exists():
-            for child in root.iterdir():
-                if child.is_file():
-                    child.unlink(missing_ok=True)  # type: ignore[arg-type]
-                else:
-                    # 简单递归删除子目录
-                    for p, _, files in os.walk(child, topdown=False):
-                        for f in files:
-                            Path(p, f).unlink(missing_ok=True)  # type: ignore[arg-type]
-                        Path(p).rmdir()
-            root.rmdir()
-
-    if kb_id in meta:
-        del meta[kb_id]
-        _save_meta(raw_root, meta)
+    def remove() -> None:
+        # 与同一知识库的入库/导入互斥，避免删除进行到一半时又有新索引写入
+        with kb_lock(cfg.index_dir / kb_id):
+            snapshot_cache.evict(cfg.index_dir / kb_id)
+            for root in (cfg.raw_dir / kb_id, cfg.index_dir / kb_id):
+                if root.exists():
+                    for child in root.iterdir():
+                        if child.is_file():
+                            child.unlink(missing_ok=True)  # type: ignore[arg-type]
+                        else:
+                            # 简单递归删除子目录
+                            for p, _, files in os.walk(child, topdown=False):
+                                for f in files:
+                                    Path(p, f).unlink(missing_ok=True)  # type: ignore[arg-type]
+                                Path(p).rmdir()
+                    root.rmdir()
+
+    async with get_scheduler(cfg).slot(INGEST):
+        await run_in_threadpool(remove)
+    get_catalog(cfg).delete(kb_id)
 
 
 @router.get("/{kb}/files", response_model=KnowledgeBaseFilesResponse)
@@ -162,10 +145,19 @@ async def rebuild_kb_index(kb: str = ApiPath(..., description="知识库名称")
     """手动触发指定知识库的全量索引重建。"""
     cfg = get_settings()
     try:
-        files, chunks = ingest_corpus(kb=kb, rebuild=True, settings=cfg)
+        async with get_scheduler(cfg).slot(INGEST):
+            files, chunks, dedup_ratio = await run_in_threadpool(ingest_corpus, kb=kb, rebuild=True, settings=cfg)
     except ValueError as exc:
+        # 重建失败时索引可能已被清空，同步目录中的统计
+        get_catalog(cfg).refresh(kb)
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return IngestResponse(ok=True, files=files, chunks=chunks, index_dir=str(cfg.index_dir / kb))
+    return IngestResponse(
+        ok=True,
+        files=files,
+        chunks=chunks,
+        index_dir=str(cfg.index_dir / kb),
+        dedup_ratio=dedup_ratio,
+    )
 
 
 @router.delete("/{kb}/files", response_model=KnowledgeBaseFilesResponse)
@@ -199,25 +191,107 @@ async def delete_kb_files(
                 modified_ts=stat.st_mtime,
             )
         )
-    # 自动重建或清空索引
+    # 自动重建或清空索引（增量模式：只重建文件清单发生变化的分片）
     kb_index_dir = (cfg.index_dir / kb_id).resolve()
     if files:
         try:
-            ingest_corpus(kb=kb_id, rebuild=True, settings=cfg)
+            async with get_scheduler(cfg).slot(INGEST):
+                await run_in_threadpool(ingest_corpus, kb=kb_id, rebuild=False, settings=cfg)
         except ValueError:
             # 如果因语料为空等原因出错，忽略，让调用方再手动重建
             pass
     else:
         # 知识库已无文档，清空索引目录
-        if kb_index_dir.exists():
-            for child in kb_index_dir.iterdir():
-                if child.is_file():
-                    child.unlink(missing_ok=True)  # type: ignore[arg-type]
-                else:
-                    for p, _, child_files in os.walk(child, topdown=False):
-                        for f in child_files:
-                            Path(p, f).unlink(missing_ok=True)  # type: ignore[arg-type]
-                        Path(p).rmdir()
-            kb_index_dir.rmdir()
-
+        def clear_index() -> None:
+            with kb_lock(kb_index_dir):
+                snapshot_cache.evict(kb_index_dir)
+                if kb_index_dir.exists():
+                    for child in kb_index_dir.iterdir():
+                        if child.is_file():
+                            child.unlink(missing_ok=True)  # type: ignore[arg-type]
+                        else:
+                            for p, _, child_files in os.walk(child, topdown=False):
+                                for f in child_files:
+                                    Path(p, f).unlink(missing_ok=True)  # type: ignore[arg-type]
+                                Path(p).rmdir()
+                    kb_index_dir.rmdir()
+
+        async with get_scheduler(cfg).slot(INGEST):
+            await run_in_threadpool(clear_index)
+
+    get_catalog(cfg).refresh(kb_id)
     return KnowledgeBaseFilesResponse(kb=kb_id, files=files)
+
+
+@router.get("/{kb}/export")
+async def export_kb_archive(
+    kb: str = ApiPath(..., description="知识库名称"),
+    float16: bool = Query(False, description="向量以 float16 存储，归档体积减半"),
+) -> FileResponse:
+    """导出指定知识库为单个压缩归档（向量 + 二进制节点存储 + 清单与校验和）。"""
+    cfg = get_settings()
+    kb_id = kb.strip()
+    if not kb_id or _KB_ID_PATTERN.search(kb_id):
+        raise HTTPException(status_code=400, detail="知识库 ID 只能包含字母、数字、下划线与连字符")
+    fd, tmp_name = tempfile.mkstemp(suffix=".easyrag")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        # 归档可达数百 MB：在线程池中写出，并与入库/导入共用 INGEST 执行槽
+        async with get_scheduler(cfg).slot(INGEST):
+            await run_in_threadpool(export_kb, (cfg.index_dir / kb_id).resolve(), tmp_path, cfg, float16)
+    except FileNotFoundError as exc:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    except ValueError as exc:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except BaseException:
+        # 排队超时（429）或请求取消时同样清理临时文件
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return FileResponse(
+        tmp_path,
+        media_type="application/zip",
+        filename=f"{kb_id}.easyrag",
+        background=BackgroundTask(tmp_path.unlink, missing_ok=True),
+    )
+
+
+@router.post("/{kb}/import", response_model=KnowledgeBaseImportResponse)
+async def import_kb_archive(
+    kb: str = ApiPath(..., description="知识库名称"),
+    archive: UploadFile = File(..., description="由 /kb/{kb}/export 或 build_index.py export 生成的归档"),
+) -> KnowledgeBaseImportResponse:
+    """导入知识库归档：无需重新嵌入即可直接检索；目标知识库已有索引时整体替换。"""
+    cfg = get_settings()
+    kb_id = kb.strip()
+    if not kb_id or _KB_ID_PATTERN.search(kb_id):
+        raise HTTPException(status_code=400, detail="知识库 ID 只能包含字母、数字、下划线与连字符")
+
+    fd, tmp_name = tempfile.mkstemp(suffix=".easyrag")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await archive.read(1 << 20):
+                f.write(chunk)
+        async with get_scheduler(cfg).slot(INGEST):
+            manifest = await run_in_threadpool(import_kb, (cfg.index_dir / kb_id).resolve(), tmp_path, cfg)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    # 保证导入的知识库出现在 /kb 列表中
+    (cfg.raw_dir / kb_id).mkdir(parents=True, exist_ok=True)
+    catalog = get_catalog(cfg)
+    catalog.ensure(kb_id, manifest.get("kb") or kb_id)
+    catalog.refresh(kb_id, ingested=True)
+
+    return KnowledgeBaseImportResponse(
+        kb=kb_id,
+        shards=len(manifest.get("shards") or []),
+        chunks=manifest["chunks"],
+        embed_model=manifest.get("embed_model") or "",
+        embed_dimension=int(manifest.get("embed_dimension") or 0),
+    )
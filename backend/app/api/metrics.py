@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from fastapi import APIRouter
+
+from ..core.hedging import generation_stats
+from ..core.scheduler import get_scheduler
+from ..core.singleflight import ask_flight
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics() -> dict:
+    """进程内运行指标：生成请求的对冲/后备/超时计数与首 token 延迟分位数、请求合并计数，
+    以及准入调度各优先级的执行数、排队深度、拒绝/超时计数与排队等待分位数。"""
+    return {
+        "generation": generation_stats.snapshot(),
+        "coalescing": ask_flight.stats(),
+        "scheduler": get_scheduler().stats(),
+    }
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import json
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from ..core.rag import retrieve_chunks
+from ..core.scheduler import BATCH, INTERACTIVE, get_scheduler, request_priority
+from ..core.settings import Settings, get_settings
+from ..models.schemas import (
+    RetrieveBatchRequest,
+    RetrieveBatchResponse,
+    RetrieveRequest,
+    RetrieveResponse,
+    RetrievedChunk,
+)
+
+router = APIRouter(prefix="/retrieve", tags=["retrieve"])
+
+
+def _query_digest(kb: str, query: str, top_k: int, filters: dict | None = None) -> str:
+    scope = json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ""
+    return hashlib.sha1(f"{kb}\n{top_k}\n{scope}\n{query}".encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_cursor(version: str, digest: str, offset: int) -> str:
+    raw = json.dumps({"v": version, "q": digest, "o": offset}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return {"v": str(data["v"]), "q": str(data["q"]), "o": int(data["o"])}
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的翻页游标") from exc
+
+
+def _page(
+    kb: str,
+    query: str,
+    top_k: int,
+    offset: int,
+    version: str,
+    hits: list[dict],
+    cfg: Settings,
+    filters: dict | None = None,
+) -> RetrieveResponse:
+    """组装一页结果；取满一页且未超过最大深度时给出下一页游标（游标绑定索引版本与查询）。"""
+    next_offset = offset + top_k
+    next_cursor = None
+    if len(hits) == top_k and next_offset < cfg.retrieve_max_depth:
+        next_cursor = _encode_cursor(version, _query_digest(kb, query, top_k, filters), next_offset)
+    return RetrieveResponse(query=query, items=[RetrievedChunk(**hit) for hit in hits], next_cursor=next_cursor)
+
+
+def _run(kb: str, queries: list[str], top_k: int, offset: int, cfg: Settings, filters: dict | None = None):
+    try:
+        return retrieve_chunks(kb, queries, top_k, offset, cfg, filters)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except RuntimeError as exc:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(exc)) from exc
+
+
+@router.post("", response_model=RetrieveResponse)
+async def retrieve(payload: RetrieveRequest, x_priority: Optional[str] = Header(default=None)) -> RetrieveResponse:
+    """仅检索：返回带相似度、节点 ID 与元数据的排序片段，不调用生成模型；支持游标翻页。"""
+    cfg = get_settings()
+    top_k = payload.top_k or cfg.similarity_top_k
+    filters = payload.filters.as_dict() if payload.filters else None
+    offset = 0
+    expected_version = None
+    if payload.cursor:
+        cursor = _decode_cursor(payload.cursor)
+        if cursor["q"] != _query_digest(payload.kb, payload.query, top_k, filters):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="翻页游标与当前查询不匹配")
+        offset, expected_version = cursor["o"], cursor["v"]
+    if offset + top_k > cfg.retrieve_max_depth:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"超过最大检索深度 {cfg.retrieve_max_depth}")
+
+    start = time.perf_counter()
+    async with get_scheduler(cfg).slot(request_priority(x_priority, INTERACTIVE)):
+        version, results = await run_in_threadpool(_run, payload.kb, [payload.query], top_k, offset, cfg, filters)
+    if expected_version is not None and version != expected_version:
+        # 索引已重建，旧游标之后的排序不再成立
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="索引已更新，请从第一页重新检索")
+    response = _page(payload.kb, payload.query, top_k, offset, version, results[0], cfg, filters)
+    response.latency_ms = int((time.perf_counter() - start) * 1000)
+    return response
+
+
+@router.post("/batch", response_model=RetrieveBatchResponse)
+async def retrieve_batch(payload: RetrieveBatchRequest) -> RetrieveBatchResponse:
+    """批量检索：查询向量合并为一次批量嵌入请求，各查询返回第一页及各自的下一页游标（批量优先级）。"""
+    cfg = get_settings()
+    top_k = payload.top_k or cfg.similarity_top_k
+    filters = payload.filters.as_dict() if payload.filters else None
+    start = time.perf_counter()
+    async with get_scheduler(cfg).slot(BATCH):
+        version, results = await run_in_threadpool(_run, payload.kb, payload.queries, top_k, 0, cfg, filters)
+    return RetrieveBatchResponse(
+        kb=payload.kb,
+        results=[
+            _page(payload.kb, q, top_k, 0, version, hits, cfg, filters) for q, hits in zip(payload.queries, results)
+        ],
+        latency_ms=int((time.perf_counter() - start) * 1000),
+    )
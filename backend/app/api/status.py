@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fastapi import APIRouter
+
+from ..core.resources import process_rss, rss_source
+from ..core.settings import get_settings
+from ..core.shards import snapshot_cache
+from ..models.schemas import LoadedKnowledgeBase, StatusResponse
+
+router = APIRouter(prefix="/status", tags=["status"])
+
+
+@router.get("", response_model=StatusResponse)
+async def get_status() -> StatusResponse:
+    """进程资源状态：当前 RSS、内存预算、空闲卸载时间与已加载的知识库（按最近使用排序）。"""
+    cfg = get_settings()
+    return StatusResponse(
+        rss_bytes=process_rss(),
+        rss_source=rss_source(),
+        memory_budget_bytes=cfg.memory_budget_mb * 1024 * 1024,
+        idle_unload_seconds=cfg.kb_idle_unload_seconds,
+        loaded=[
+            LoadedKnowledgeBase(kb=Path(item.pop("index_dir")).name, **item) for item in snapshot_cache.loaded()
+        ],
+    )
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import zipfile
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+
+from .index import read_faiss_index
+from .nodestore import NODES_BIN, NODES_IDX, has_node_store
+from .settings import Settings
+from .shards import (
+    SHARD_MANIFEST,
+    backfill_shard_files,
+    kb_lock,
+    list_shard_dirs,
+    read_kb_embed_model,
+    read_layout,
+    read_shard_manifest,
+    replace_dir,
+    snapshot_cache,
+    write_layout,
+    write_version,
+)
+
+ARCHIVE_FORMAT = "easyrag-kb"
+ARCHIVE_VERSION = 1
+ARCHIVE_MANIFEST = "manifest.json"
+VECTORS_NAME = "vectors.npy"
+_COPY_CHUNK = 1 << 20
+_SHARD_NAME = re.compile(r"shard-(\d{3})")
+
+logger = logging.getLogger(__name__)
+
+
+class _HashingWriter:
+    """写入 zip 成员的同时计算 sha256。"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.digest.update(data)
+        return self.raw.write(data)
+
+
+def _member(shard_name: str, filename: str) -> str:
+    return f"{shard_name}/{filename}" if shard_name != "." else filename
+
+
+def export_kb(index_dir: Path, out_path: Path, settings: Settings, float16: bool = False) -> dict:
+    """把知识库索引导出为单个压缩归档（zip），返回归档清单。
+
+    归档内容：每个分片的向量矩阵（.npy，可选 float16）、二进制节点存储（nodes.bin/nodes.idx）、
+    分片清单，以及记录嵌入模型/维度、分片布局与各成员 sha256 的 manifest.json。
+    导出期间持有知识库锁，同一进程内的重建不会在中途替换分片目录。
+    """
+    with kb_lock(index_dir):
+        return _export_locked(index_dir, out_path, settings, float16)
+
+
+def _export_locked(index_dir: Path, out_path: Path, settings: Settings, float16: bool) -> dict:
+    shard_dirs = [d for d in list_shard_dirs(index_dir) if d.exists()]
+    if not shard_dirs or not any((d / "faiss.index").exists() for d in shard_dirs):
+        raise FileNotFoundError(f"索引目录 {index_dir} 不存在或为空，请先执行 ingest")
+
+    checksums: dict[str, str] = {}
+    shards: list[dict] = []
+    dimension = None
+    tmp_path = out_path.with_name(out_path.name + ".partial")
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+
+        def add_stream(name: str, writer_fn) -> None:
+            with zf.open(name, "w", force_zip64=True) as raw:
+                hashing = _HashingWriter(raw)
+                writer_fn(hashing)
+            checksums[name] = hashing.digest.hexdigest()
+
+        for directory in shard_dirs:
+            if not has_node_store(directory):
+                raise ValueError(f"分片 {directory} 为旧格式索引（缺少 nodes.bin），请先重建后再导出")
+            faiss_index = read_faiss_index(directory / "faiss.index", use_mmap=True)
+            dimension = int(faiss_index.d)
+            vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+            if float16:
+                vectors = vectors.astype(np.float16)
+            shard_name = "." if directory == index_dir else directory.name
+
+            add_stream(_member(shard_name, VECTORS_NAME), lambda w, v=vectors: np.save(w, v, allow_pickle=False))
+            for filename in (NODES_BIN, NODES_IDX, SHARD_MANIFEST):
+                path = directory / filename
+                if not path.exists():
+                    continue
+
+                def copy(w, p=path) -> None:
+                    with open(p, "rb") as src:
+                        shutil.copyfileobj(src, w, _COPY_CHUNK)
+
+                add_stream(_member(shard_name, filename), copy)
+            shards.append({"name": shard_name, "count": int(faiss_index.ntotal)})
+
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "format_version": ARCHIVE_VERSION,
+            "kb": index_dir.name,
+            # 以构建索引时记录的模型为准；早期索引未记录时才使用当前配置
+            "embed_model": read_kb_embed_model(index_dir) or settings.embed_model,
+            "embed_dimension": dimension,
+            "vector_dtype": "float16" if float16 else "float32",
+            "num_shards": read_layout(index_dir),
+            "shards": shards,
+            "created_at": int(time.time()),
+            "checksums": checksums,
+        }
+        zf.writestr(ARCHIVE_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+    os.replace(tmp_path, out_path)
+    logger.info("已导出知识库 %s：%s 个分片 → %s", index_dir.name, len(shards), out_path)
+    return manifest
+
+
+def _extract_verified(zf: zipfile.ZipFile, name: str, target: Path, expected: str) -> None:
+    digest = hashlib.sha256()
+    with zf.open(name) as src, open(target, "wb") as dst:
+        while True:
+            block = src.read(_COPY_CHUNK)
+            if not block:
+                break
+            digest.update(block)
+            dst.write(block)
+    if digest.hexdigest() != expected:
+        raise ValueError(f"归档校验失败：{name} 的 sha256 不匹配")
+
+
+def _shard_names(manifest: dict) -> list[str]:
+    """校验清单中的分片名：只接受 "."（单分片平铺布局）或 shard-XXX（编号小于 num_shards），
+    防止构造的归档通过 ../ 或绝对路径写出暂存目录。"""
+    try:
+        num_shards = int(manifest.get("num_shards") or 1)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("归档清单的 num_shards 无效") from exc
+    shards = manifest.get("shards")
+    if not isinstance(shards, list) or not shards:
+        raise ValueError("归档清单缺少分片列表")
+    names: list[str] = []
+    for shard in shards:
+        name = shard.get("name") if isinstance(shard, dict) else None
+        if not isinstance(name, str):
+            raise ValueError("归档清单中的分片缺少名称")
+        if name == ".":
+            valid = num_shards <= 1
+        else:
+            match = _SHARD_NAME.fullmatch(name)
+            valid = num_shards > 1 and match is not None and int(match.group(1)) < num_shards
+        if not valid or name in names:
+            raise ValueError(f"归档清单中的分片名无效：{name!r}")
+        names.append(name)
+    return names
+
+
+def import_kb(index_dir: Path, archive_path: Path, settings: Settings) -> dict:
+    """导入知识库归档：校验 sha256，由向量矩阵重建 faiss.index，节点存储原样落地（可直接 mmap）。
+
+    先在临时目录中完整构建，再整体替换目标索引目录并写入新版本戳，运行中的 worker 会自动切换到新快照。
+    """
+    with kb_lock(index_dir):
+        return _import_locked(index_dir, archive_path, settings)
+
+
+def _import_locked(index_dir: Path, archive_path: Path, settings: Settings) -> dict:
+    import faiss  # type: ignore
+
+    try:
+        zf = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile as exc:
+        raise ValueError("无效的知识库归档文件") from exc
+    with zf:
+        try:
+            manifest = json.loads(zf.read(ARCHIVE_MANIFEST))
+        except (KeyError, ValueError) as exc:
+            raise ValueError("归档缺少有效的 manifest.json") from exc
+        if manifest.get("format") != ARCHIVE_FORMAT or int(manifest.get("format_version", 0)) > ARCHIVE_VERSION:
+            raise ValueError("不支持的知识库归档格式")
+        if manifest.get("embed_model") != settings.embed_model:
+            raise ValueError(
+                f"归档使用的嵌入模型 {manifest.get('embed_model')} 与当前配置 {settings.embed_model} 不一致"
+            )
+        checksums: dict = manifest.get("checksums") or {}
+        dimension = int(manifest.get("embed_dimension") or 0)
+        shard_names = _shard_names(manifest)
+
+        staging = index_dir.parent / f".{index_dir.name}.import-{os.getpid()}"
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
+        try:
+            chunks = 0
+            for shard_name in shard_names:
+                target = staging if shard_name == "." else staging / shard_name
+                target.mkdir(parents=True, exist_ok=True)
+                for filename in (VECTORS_NAME, NODES_BIN, NODES_IDX, SHARD_MANIFEST):
+                    member = _member(shard_name, filename)
+                    if member not in checksums:
+                        if filename == SHARD_MANIFEST:
+                            continue
+                        raise ValueError(f"归档缺少成员：{member}")
+                    _extract_verified(zf, member, target / filename, checksums[member])
+
+                vectors_path = target / VECTORS_NAME
+                vectors = np.load(vectors_path, mmap_mode="r", allow_pickle=False)
+                if vectors.ndim != 2 or (dimension and vectors.shape[1] != dimension):
+                    raise ValueError(f"分片 {shard_name} 的向量维度与归档声明的 {dimension} 不一致")
+                dimension = dimension or int(vectors.shape[1])
+                faiss_index = faiss.IndexFlatL2(int(vectors.shape[1]))
+                if len(vectors):
+                    faiss_index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+                faiss.write_index(faiss_index, str(target / "faiss.index"))
+                del vectors
+                vectors_path.unlink()
+                if not read_shard_manifest(target):
+                    (target / SHARD_MANIFEST).write_text(
+                        json.dumps({"chunks": int(faiss_index.ntotal)}), encoding="utf-8"
+                    )
+                # 归档不含倒排表与路由向量，导入时一次写出，检索时不必每次加载都重新计算
+                backfill_shard_files(target)
+                chunks += int(faiss_index.ntotal)
+
+            # 记录归档的嵌入维度，检索时按该维度计算查询向量
+            write_layout(
+                staging, int(manifest.get("num_shards") or 1), dimension or None, manifest.get("embed_model")
+            )
+            write_version(staging)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    snapshot_cache.evict(index_dir)
+    replace_dir(staging, index_dir)
+    logger.info("已导入知识库归档 %s → %s（切片 %s 个）", archive_path, index_dir, chunks)
+    return {**manifest, "chunks": chunks}
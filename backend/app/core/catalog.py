@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .nodestore import NODES_IDX
+from .settings import Settings
+from .shards import list_shard_dirs, read_shard_manifest, read_version
+
+CATALOG_FILENAME = "_kb_catalog.db"
+LEGACY_META_FILENAME = "_kb_meta.json"
+_SCHEMA_VERSION = "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kbs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    files INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    index_version TEXT NOT NULL DEFAULT '',
+    index_bytes INTEGER NOT NULL DEFAULT 0,
+    last_ingest REAL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def scan_files(raw_dir: Path) -> tuple[int, int]:
+    """统计知识库原始目录下的文件数与总字节数（与 /kb/{kb}/files 一致，只统计第一层文件）。"""
+    count = total = 0
+    if raw_dir.exists():
+        for path in raw_dir.iterdir():
+            if path.is_file():
+                count += 1
+                total += path.stat().st_size
+    return count, total
+
+
+def index_stats(index_dir: Path) -> tuple[int, str, int]:
+    """读取知识库索引的 (切片数, 版本戳, FAISS 索引字节数)；没有索引时为 (0, "", 0)。"""
+    if not index_dir.exists() or not any(index_dir.iterdir()):
+        return 0, "", 0
+    chunks = index_bytes = 0
+    for directory in list_shard_dirs(index_dir):
+        manifest_chunks = read_shard_manifest(directory).get("chunks")
+        if manifest_chunks is not None:
+            chunks += int(manifest_chunks)
+        elif (directory / NODES_IDX).exists():
+            # 导入的归档或早期索引没有切片计数，按偏移表长度推算
+            chunks += max(0, (directory / NODES_IDX).stat().st_size // 8 - 1)
+        faiss_path = directory / "faiss.index"
+        if faiss_path.exists():
+            index_bytes += faiss_path.stat().st_size
+    return chunks, read_version(index_dir), index_bytes
+
+
+class Catalog:
+    """知识库目录（SQLite，WAL 模式）：名称、文件数/字节数、切片数、索引版本、最近入库时间与索引大小。
+
+    - /kb 列表直接读表，不再逐个扫描知识库目录；
+    - 上传、入库、删除等操作只刷新受影响知识库的一行，写入在事务中完成，多进程并发写不会丢失更新；
+    - 首次打开时从旧的 _kb_meta.json 与目录扫描结果迁移。
+    """
+
+    def __init__(self, path: Path, raw_root: Path, index_root: Path):
+        self.path = Path(path)
+        self.raw_root = Path(raw_root)
+        self.index_root = Path(index_root)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 每个线程一个连接；timeout 即 busy_timeout，等待其他进程的写事务结束
+            conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, params: tuple = ()) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = conn.execute(sql, params).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rowcount
+
+    def _migrate(self) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'schema_version'").fetchone()
+            if row is None:
+                migrated = self._import_legacy(conn)
+                conn.execute(
+                    "INSERT INTO catalog_meta (key, value) VALUES ('schema_version', ?)", (_SCHEMA_VERSION,)
+                )
+                logger.info("已建立知识库目录 %s（迁移 %s 个知识库）", self.path, migrated)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _raw_dirs(self) -> List[str]:
+        if not self.raw_root.exists():
+            return []
+        return sorted(entry.name for entry in self.raw_root.iterdir() if entry.is_dir())
+
+    def _insert_scanned(self, conn: sqlite3.Connection, kb_id: str, name: str) -> None:
+        files, total = scan_files(self.raw_root / kb_id)
+        chunks, version, index_bytes = index_stats(self.index_root / kb_id)
+        conn.execute(
+            "INSERT OR IGNORE INTO kbs (id, name, files, bytes, chunks, index_version, index_bytes, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (kb_id, name, files, total, chunks, version, index_bytes, time.time()),
+        )
+
+    def _import_legacy(self, conn: sqlite3.Connection) -> int:
+        """一次性迁移：展示名取自 _kb_meta.json，统计信息来自目录扫描（旧文件保留，不再写入）。"""
+        names: Dict[str, str] = {}
+        try:
+            data = json.loads((self.raw_root / LEGACY_META_FILENAME).read_text(encoding="utf-8"))
+            names = {k: (v or {}).get("name") or k for k, v in (data.get("kbs") or {}).items()}
+        except (OSError, ValueError, AttributeError):
+            pass
+        kb_ids = self._raw_dirs()
+        for kb_id in kb_ids:
+            self._insert_scanned(conn, kb_id, names.get(kb_id, kb_id))
+        return len(kb_ids)
+
+    def sync_new(self) -> List[str]:
+        """登记绕过 API 新增的知识库目录（如直接复制到 RAW_DIR 下）：只列出 RAW_DIR 第一层目录名，
+        仅对目录表中没有的知识库做统计扫描。返回新登记的知识库 ID。"""
+        missing = [kb_id for kb_id in self._raw_dirs() if kb_id not in self.ids()]
+        if not missing:
+            return []
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for kb_id in missing:
+                self._insert_scanned(conn, kb_id, kb_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info("知识库目录登记了新发现的知识库：%s", ", ".join(missing))
+        return missing
+
+    def list_kbs(self) -> List[dict]:
+        rows = self._conn().execute("SELECT * FROM kbs ORDER BY created_at, id").fetchall()
+        return [dict(row) for row in rows]
+
+    def ids(self) -> set[str]:
+        return {row[0] for row in self._conn().execute("SELECT id FROM kbs")}
+
+    def get(self, kb_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM kbs WHERE id = ?", (kb_id,)).fetchone()
+        return dict(row) if row else None
+
+    def create(self, kb_id: str, name: str) -> bool:
+        """登记新知识库；ID 已存在时返回 False（由调用方换一个 ID 重试）。"""
+        return (
+            self._write(
+                "INSERT OR IGNORE INTO kbs (id, name, created_at) VALUES (?, ?, ?)", (kb_id, name, time.time())
+            )
+            == 1
+        )
+
+    def ensure(self, kb_id: str, name: Optional[str] = None) -> None:
+        self._write(
+            "INSERT OR IGNORE INTO kbs (id, name, created_at) VALUES (?, ?, ?)", (kb_id, name or kb_id, time.time())
+        )
+
+    def delete(self, kb_id: str) -> None:
+        self._write("DELETE FROM kbs WHERE id = ?", (kb_id,))
+
+    def refresh(self, kb_id: str, ingested: bool = False) -> None:
+        """重新统计单个知识库（只扫描该知识库自身的目录）；ingested 时同时更新最近入库时间。"""
+        files, total = scan_files(self.raw_root / kb_id)
+        chunks, version, index_bytes = index_stats(self.index_root / kb_id)
+        now = time.time()
+        self._write(
+            "INSERT INTO kbs (id, name, files, bytes, chunks, index_version, index_bytes, last_ingest, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET files = excluded.files, bytes = excluded.bytes,"
+            " chunks = excluded.chunks, index_version = excluded.index_version,"
+            " index_bytes = excluded.index_bytes, last_ingest = COALESCE(excluded.last_ingest, kbs.last_ingest)",
+            (kb_id, kb_id, files, total, chunks, version, index_bytes, now if ingested else None, now),
+        )
+
+
+_catalogs: Dict[str, Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(settings: Settings) -> Catalog:
+    """按目录文件路径缓存的进程级单例；CATALOG_PATH 留空时位于 RAW_DIR/_kb_catalog.db。"""
+    path = settings.catalog_path or Path(settings.raw_dir) / CATALOG_FILENAME
+    key = str(path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = Catalog(path, settings.raw_dir, settings.index_dir)
+            _catalogs[key] = catalog
+        return catalog
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+import zlib
+from typing import List
+
+import numpy as np
+
+from .settings import Settings
+from .splitter import split_segments
+
+# 词项哈希桶数（2 的幂）；桶冲突只会轻微抬高个别句子的得分
+_BUCKETS = 1 << 12
+_ASCII_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]+")
+_GAP = " … "
+
+
+def _terms(text: str) -> List[str]:
+    """词项：英文/数字按词，中文按相邻字二元组（单字成段时取单字）。"""
+    text = text.lower()
+    terms = _ASCII_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _term_ids(text: str) -> np.ndarray:
+    return np.fromiter(
+        (zlib.crc32(term.encode("utf-8")) & (_BUCKETS - 1) for term in _terms(text)),
+        dtype=np.int64,
+    )
+
+
+def score_sentences(query: str, sentences: List[str]) -> np.ndarray:
+    """按 TF‑IDF 余弦相似度为句子打分（IDF 取自本次召回的全部句子）。
+
+    以 (句子, 词项) 稀疏对 + bincount 完成全部计算，开销与词项总数成正比。
+    """
+    n = len(sentences)
+    ids = [_term_ids(sentence) for sentence in sentences]
+    rows = np.repeat(np.arange(n, dtype=np.int64), [len(x) for x in ids])
+    cols = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    pairs, counts = np.unique(rows * _BUCKETS + cols, return_counts=True)
+    pair_rows, pair_cols = pairs // _BUCKETS, pairs % _BUCKETS
+
+    df = np.bincount(pair_cols, minlength=_BUCKETS)
+    idf = np.log((n + 1) / (df + 1)) + 1.0
+    weights = counts * idf[pair_cols]
+    q = np.bincount(_term_ids(query), minlength=_BUCKETS) * idf
+    dots = np.bincount(pair_rows, weights=weights * q[pair_cols], minlength=n)
+    norms = np.sqrt(np.bincount(pair_rows, weights=weights**2, minlength=n)) * (np.linalg.norm(q) or 1.0)
+    return dots / np.where(norms > 0, norms, 1.0)
+
+
+def compress_contexts(query: str, contexts: List[dict], settings: Settings) -> dict:
+    """抽取式压缩：每个片段只保留与问题最相关的若干句及其前后相邻句，写入 ctx["prompt_text"]。
+
+    片段本身（顺序、ref 编号、返回给前端的完整 text）保持不变，每个片段至少保留一句，
+    因此 [n] 引用始终对应原片段。返回压缩统计（chars_in/chars_out/ratio）。
+    """
+    owners: List[int] = []
+    sentences: List[str] = []
+    for idx, ctx in enumerate(contexts):
+        if len(ctx["text"]) < settings.compress_min_chars:
+            continue
+        for segment in split_segments(ctx["text"]):
+            owners.append(idx)
+            sentences.append(segment)
+
+    chars_in = sum(len(ctx["text"]) for ctx in contexts)
+    if sentences:
+        scores = score_sentences(query, sentences)
+        owners_arr = np.asarray(owners)
+        for idx in sorted(set(owners)):
+            positions = np.flatnonzero(owners_arr == idx)
+            segments = [sentences[p] for p in positions]
+            local = scores[positions]
+            # 按得分取前 N 句（至少 1 句），再扩展相邻句保证语义连贯
+            top = [i for i in np.argsort(-local, kind="stable")[: settings.compress_top_sentences] if local[i] > 0]
+            top = top or [int(np.argmax(local))]
+            keep = set()
+            for i in top:
+                keep.update(range(max(0, i - settings.compress_neighbors), min(len(segments), i + settings.compress_neighbors + 1)))
+            spans: List[str] = []
+            current = ""
+            for i in range(len(segments)):
+                if i in keep:
+                    current += segments[i]
+                elif current:
+                    spans.append(current.strip())
+                    current = ""
+            if current:
+                spans.append(current.strip())
+            compressed = _GAP.join(span for span in spans if span)
+            if len(compressed) < len(contexts[idx]["text"]):
+                contexts[idx]["prompt_text"] = compressed
+
+    chars_out = sum(len(ctx.get("prompt_text", ctx["text"])) for ctx in contexts)
+    return {
+        "chars_in": chars_in,
+        "chars_out": chars_out,
+        "ratio": round(chars_out / chars_in, 4) if chars_in else 1.0,
+    }
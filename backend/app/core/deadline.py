@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import time
+
+
+class DeadlineExceeded(RuntimeError):
+    """请求超过端到端截止时间。"""
+
+
+class Deadline:
+    """端到端截止时间（单调时钟），随请求贯穿检索与生成；timeout_ms<=0 表示不设截止。"""
+
+    def __init__(self, timeout_ms: int = 0):
+        self.expires_at: float | None = time.monotonic() + timeout_ms / 1000 if timeout_ms > 0 else None
+
+    def remaining(self) -> float | None:
+        """剩余秒数；未设截止时返回 None。"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"请求超过截止时间（{stage}阶段）")
+
+    def timeout(self, cap: float) -> float:
+        """单次网络调用的超时：不超过 cap，也不超过剩余时间。"""
+        remaining = self.remaining()
+        return cap if remaining is None else max(0.1, min(cap, remaining))
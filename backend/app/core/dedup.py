@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import re
+import zlib
+from typing import List, Sequence
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from .settings import Settings
+
+_PRIME_32 = np.uint64((1 << 32) - 5)  # 小于 2^32 的最大素数
+_WHITESPACE_RE = re.compile(r"\s+")
+ALIASES_KEY = "aliases"
+
+
+def _shingle_hashes(text: str, size: int) -> np.ndarray:
+    """字符级 shingle（适配中文，无需分词），以 crc32 得到稳定的 32 位哈希。"""
+    norm = _WHITESPACE_RE.sub("", text).lower()
+    if len(norm) <= size:
+        grams = {norm}
+    else:
+        grams = {norm[i : i + size] for i in range(len(norm) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """MinHash 签名：h_i(x) = (a_i * x + b_i) mod p，p 为 32 位素数，按排列向量化计算。"""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a, b, x 均小于 p < 2^32，a * x + b < 2^64，不会溢出 uint64
+        self.a = rng.integers(1, int(_PRIME_32), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(_PRIME_32), size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = _shingle_hashes(text, self.shingle_size)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _PRIME_32, dtype=np.uint64)
+        hashes %= _PRIME_32
+        values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % _PRIME_32
+        return values.min(axis=1)
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_duplicate_groups(
+    texts: Sequence[str],
+    threshold: float = 0.9,
+    num_perm: int = 128,
+    bands: int = 16,
+    shingle_size: int = 5,
+) -> List[int]:
+    """返回每个文本所属簇的代表下标（代表为簇内最早出现者）。
+
+    LSH 分桶：签名切成 bands 段，同段相同即为候选；每个桶只与桶内首个元素比较，
+    总体复杂度近似线性。候选对再以签名一致率（Jaccard 估计）≥ threshold 确认。
+    """
+    if num_perm % bands:
+        raise ValueError("num_perm 必须能被 bands 整除")
+    hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+    signatures = np.stack([hasher.signature(t) for t in texts]) if texts else np.empty((0, num_perm))
+    rows = num_perm // bands
+    parent = list(range(len(texts)))
+
+    for band in range(bands):
+        buckets: dict[bytes, int] = {}
+        band_sig = np.ascontiguousarray(signatures[:, band * rows : (band + 1) * rows])
+        for i in range(len(texts)):
+            key = band_sig[i].tobytes()
+            head = buckets.setdefault(key, i)
+            if head == i:
+                continue
+            ri, rh = _find(parent, i), _find(parent, head)
+            if ri == rh:
+                continue
+            similarity = float(np.mean(signatures[i] == signatures[head]))
+            if similarity >= threshold:
+                # 以更早出现的节点为代表，保证结果与输入顺序一致
+                lo, hi = min(ri, rh), max(ri, rh)
+                parent[hi] = lo
+    return [_find(parent, i) for i in range(len(texts))]
+
+
+def _alias_of(node: BaseNode) -> str:
+    metadata = node.metadata or {}
+    source = metadata.get("source") or metadata.get("file_name") or "未知来源"
+    page = metadata.get("page_label") or metadata.get("page") or metadata.get("slide")
+    return f"{source}#{page}" if page else str(source)
+
+
+def dedup_nodes(nodes: Sequence[BaseNode], settings: Settings) -> tuple[List[BaseNode], dict]:
+    """对切分后的节点做近重复检测：每簇保留一个代表节点，其余来源记入代表节点的 aliases 元数据。"""
+    total = len(nodes)
+    if not settings.dedup_enabled or total < 2:
+        return list(nodes), {"nodes_in": total, "nodes_out": total, "duplicates": 0, "dedup_ratio": 0.0}
+
+    texts = [node.get_content(metadata_mode="none") for node in nodes]
+    roots = find_duplicate_groups(texts, threshold=settings.dedup_threshold)
+
+    kept: List[BaseNode] = []
+    for i, node in enumerate(nodes):
+        root = roots[i]
+        if root == i:
+            kept.append(node)
+            continue
+        canonical = nodes[root]
+        alias = _alias_of(node)
+        if alias == _alias_of(canonical):
+            continue
+        aliases = canonical.metadata.setdefault(ALIASES_KEY, [])
+        if alias not in aliases:
+            aliases.append(alias)
+
+    for node in kept:
+        # aliases 仅作溯源，不参与嵌入与提示（列表可能与同文档节点共享，需复制后再改）
+        if ALIASES_KEY in node.metadata:
+            node.excluded_embed_metadata_keys = [*node.excluded_embed_metadata_keys, ALIASES_KEY]
+            node.excluded_llm_metadata_keys = [*node.excluded_llm_metadata_keys, ALIASES_KEY]
+
+    duplicates = total - len(kept)
+    stats = {
+        "nodes_in": total,
+        "nodes_out": len(kept),
+        "duplicates": duplicates,
+        "dedup_ratio": round(duplicates / total, 4),
+    }
+    return kept, stats
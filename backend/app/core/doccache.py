@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from llama_index.core import __version__ as LI_VERSION
+from llama_index.core.schema import Document
+
+from .settings import Settings
+
+_HASH_CHUNK = 1 << 20
+# 缓存格式版本：调整记录结构时递增，旧条目自然失效
+_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _path_metadata(path: Path) -> dict:
+    return {"file_path": str(path), "file_name": path.name}
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_HASH_CHUNK)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """解析结果缓存：按文件内容哈希保存解析出的 Document 文本与元数据（gzip 压缩 JSON）。
+
+    - 键为 内容 sha256 + 扩展名 + LlamaIndex 版本，与文件路径无关，可跨重建、跨知识库复用；
+    - 与路径相关的字段（doc_id 前缀、source、file_path、file_name）在每次命中时按当前路径改写；
+    - 总大小超过上限时按最近使用时间（mtime）淘汰最旧的条目。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, path: Path) -> Path:
+        key = hashlib.sha256(
+            f"{file_digest(path)}|{path.suffix.lower()}|{LI_VERSION}|{_FORMAT}".encode("utf-8")
+        ).hexdigest()
+        return self.root / key[:2] / f"{key}.json.gz"
+
+    def get(self, path: Path) -> Optional[List[Document]]:
+        entry = self._entry(path)
+        try:
+            with gzip.open(entry, "rt", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry)  # 记录最近使用时间，供淘汰参考
+        except OSError:
+            pass
+        self.hits += 1
+        prefix = str(path)
+        documents = []
+        for record in records:
+            metadata = dict(record["metadata"])
+            metadata["source"] = path.name
+            # 同一内容可能来自其他知识库或旧路径，读取器写入的路径元数据须指向当前文件
+            for key, value in _path_metadata(path).items():
+                if key in metadata:
+                    metadata[key] = value
+            documents.append(
+                Document(
+                    id_=prefix + record["id_suffix"],
+                    text=record["text"],
+                    metadata=metadata,
+                    excluded_embed_metadata_keys=record["excluded_embed"],
+                    excluded_llm_metadata_keys=record["excluded_llm"],
+                )
+            )
+        return documents
+
+    def put(self, path: Path, documents: List[Document]) -> None:
+        prefix = str(path)
+        records = [
+            {
+                "id_suffix": doc.doc_id[len(prefix) :] if doc.doc_id.startswith(prefix) else "",
+                "text": doc.text,
+                "metadata": {k: v for k, v in doc.metadata.items() if k != "source"},
+                "excluded_embed": list(doc.excluded_embed_metadata_keys),
+                "excluded_llm": list(doc.excluded_llm_metadata_keys),
+            }
+            for doc in documents
+        ]
+        entry = self._entry(path)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        try:
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(records, f, ensure_ascii=False, separators=(",", ":"), default=str)
+            os.replace(tmp, entry)
+        except OSError as exc:  # 缓存写入失败不影响入库
+            tmp.unlink(missing_ok=True)
+            logger.warning("写入解析缓存失败：%s（%s）", path, exc)
+
+    def evict(self) -> int:
+        """超过容量上限时淘汰最久未使用的条目（降到上限的 90%），返回淘汰数量。"""
+        if not self.root.exists():
+            return 0
+        entries = []
+        total = 0
+        for entry in self.root.glob("*/*.json.gz"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        target = int(self.max_bytes * 0.9)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= target:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        logger.info("解析缓存超过上限，淘汰 %s 个条目", removed)
+        return removed
+
+
+def get_document_cache(settings: Settings) -> Optional[DocumentCache]:
+    """DOC_CACHE_MAX_MB 为 0 时关闭缓存。"""
+    if settings.doc_cache_max_mb <= 0:
+        return None
+    return DocumentCache(Path(settings.doc_cache_dir), settings.doc_cache_max_mb << 20)
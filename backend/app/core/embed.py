@@ -1,13 +1,27 @@
 from __future__ import annotations
 
+from collections import OrderedDict
 from functools import lru_cache
-from typing import List
+from typing import List, Sequence
 import asyncio
+import threading
 
 from llama_index.core.embeddings import BaseEmbedding
 
 from .settings import Settings, get_settings
 
+# text-embedding-v3/v4 支持通过 dimension 参数返回降维向量（v4 额外支持 1536/2048）
+DIMENSION_MODELS = ("text-embedding-v3", "text-embedding-v4")
+SUPPORTED_DIMENSIONS = (64, 128, 256, 512, 768, 1024, 1536, 2048)
+
+
+def validate_dimension(dimension: int) -> int:
+    """校验嵌入维度是否为 DashScope 支持的取值。"""
+    if int(dimension) not in SUPPORTED_DIMENSIONS:
+        supported = "/".join(str(d) for d in SUPPORTED_DIMENSIONS)
+        raise ValueError(f"不支持的嵌入维度 {dimension}，可选：{supported}")
+    return int(dimension)
+
 
 class QwenEmbedding(BaseEmbedding):
     """通义千问（DashScope）TextEmbedding 封装（非兼容模式）。
@@ -20,6 +34,8 @@ class QwenEmbedding(BaseEmbedding):
     model: str
     timeout: int = 60
     expected_dim: int | None = None
+    # 请求的输出维度（None 表示使用模型默认维度）
+    dimension: int | None = None
 
     def _extract_embeddings(self, resp) -> List[List[float]]:
         try:
@@ -38,12 +54,13 @@ class QwenEmbedding(BaseEmbedding):
             from dashscope import TextEmbedding  # type: ignore
 
             dashscope.api_key = self.api_key
-            parameters = None
+            # SDK 会把额外关键字参数并入请求的 parameters 字段
+            extra = {"dimension": int(self.dimension)} if self.dimension else {}
             resp = TextEmbedding.call(
                 model=self.model,
                 input=texts,
                 timeout=self.timeout,
-                parameters=parameters,
+                **extra,
             )
             if getattr(resp, "status_code", None) not in (HTTPStatus.OK, 200):
                 message = getattr(resp, "message", "Qwen 嵌入请求失败")
@@ -69,16 +86,55 @@ class QwenEmbedding(BaseEmbedding):
         return await loop.run_in_executor(None, self._get_query_embedding, query)
 
 
-@lru_cache(maxsize=1)
+@lru_cache(maxsize=8)
+def _cached_model(api_key: str, model: str, timeout: int, dimension: int) -> QwenEmbedding:
+    return QwenEmbedding(
+        api_key=api_key,
+        model=model,
+        timeout=timeout,
+        expected_dim=dimension,
+        dimension=dimension if model in DIMENSION_MODELS else None,
+    )
+
+
 def get_embedding_model(settings: Settings | None = None) -> BaseEmbedding:
-    """返回 Qwen 嵌入模型实例（唯一实现）。"""
+    """返回 Qwen 嵌入模型实例（唯一实现）；按 模型/维度 缓存，不同维度的知识库各用一个实例。"""
 
     cfg = settings or get_settings()
     if not cfg.qwen_api_key:
         raise ValueError("QWEN_API_KEY 未配置，无法计算嵌入")
-    return QwenEmbedding(
-        api_key=cfg.qwen_api_key,
-        model=cfg.embed_model,
-        timeout=cfg.request_timeout,
-        expected_dim=int(cfg.embed_dimension),
-    )
+    return _cached_model(cfg.qwen_api_key, cfg.embed_model, int(cfg.request_timeout), int(cfg.embed_dimension))
+
+
+_QUERY_CACHE_SIZE = 2048
+_query_cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def embed_queries(queries: Sequence[str], settings: Settings | None = None) -> List[List[float]]:
+    """批量计算查询向量：进程内 LRU 缓存（按 模型/维度/文本），未命中的查询合并为一次批量请求。
+
+    翻页与批量检索常重复同一查询，缓存命中时无需再调用嵌入接口。
+    """
+    cfg = settings or get_settings()
+    prefix = (cfg.embed_model, int(cfg.embed_dimension))
+    results: List[List[float] | None] = []
+    misses: List[str] = []
+    with _query_cache_lock:
+        for query in queries:
+            vector = _query_cache.get((*prefix, query))
+            if vector is not None:
+                _query_cache.move_to_end((*prefix, query))
+            elif query not in misses:
+                misses.append(query)
+            results.append(vector)
+    if misses:
+        vectors = get_embedding_model(cfg).get_text_embedding_batch(misses)
+        fresh = dict(zip(misses, vectors))
+        with _query_cache_lock:
+            for query, vector in fresh.items():
+                _query_cache[(*prefix, query)] = vector
+            while len(_query_cache) > _QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+        results = [vector if vector is not None else fresh[query] for query, vector in zip(queries, results)]
+    return results  # type: ignore[return-value]
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import logging
+import random
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+from .embed import get_embedding_model, validate_dimension
+from .nodestore import NodeStore, has_node_store
+from .settings import Settings
+from .shards import list_shard_dirs
+from .splitter import split_segments
+
+logger = logging.getLogger(__name__)
+
+
+def _load_chunk_texts(index_dir: Path, limit: int | None = None) -> List[str]:
+    """从各分片的节点存储读取切片文本。"""
+    texts: List[str] = []
+    for directory in list_shard_dirs(index_dir):
+        if not has_node_store(directory):
+            raise ValueError(f"分片 {directory} 为旧格式索引（缺少 nodes.bin），请先重建后再评估")
+        store = NodeStore(directory)
+        try:
+            for position in range(len(store)):
+                record = store.get(position) or {}
+                if record.get("text"):
+                    texts.append(record["text"])
+        finally:
+            store.close()
+    if not texts:
+        raise FileNotFoundError(f"索引目录 {index_dir} 不存在或为空，请先执行 ingest")
+    return texts[:limit] if limit else texts
+
+
+def _sample_queries(texts: Sequence[str], count: int, seed: int = 0) -> List[str]:
+    """没有提供问题集时，从随机切片中取最长的一句作为伪查询。"""
+    rng = random.Random(seed)
+    picked = rng.sample(list(texts), min(count, len(texts)))
+    queries = []
+    for text in picked:
+        segments = [seg.strip() for seg in split_segments(text) if len(seg.strip()) >= 8]
+        if segments:
+            queries.append(max(segments, key=len))
+    return queries
+
+
+def _embed(texts: Sequence[str], settings: Settings, dimension: int) -> np.ndarray:
+    cfg = settings.model_copy()
+    cfg.embed_dimension = dimension
+    model = get_embedding_model(cfg)
+    return np.asarray(model.get_text_embedding_batch(list(texts)), dtype="float32")
+
+
+def evaluate_dimensions(
+    index_dir: Path,
+    dimensions: Sequence[int],
+    settings: Settings,
+    top_k: int = 10,
+    questions: Sequence[str] | None = None,
+    num_queries: int = 50,
+    limit: int | None = None,
+) -> List[dict]:
+    """在同一知识库上对比不同嵌入维度：向量存储大小、单次检索延迟与 recall@k。
+
+    以列表中最大的维度为基准（其 Top‑K 视为真值），recall@k 为各维度 Top‑K 与基准 Top‑K 的重合比例。
+    每个维度都会重新嵌入全部切片，--limit 可限制参与评估的切片数以控制调用量。
+    """
+    import faiss  # type: ignore
+
+    dims = sorted({validate_dimension(d) for d in dimensions}, reverse=True)
+    texts = _load_chunk_texts(index_dir, limit)
+    queries = list(questions) if questions else _sample_queries(texts, num_queries)
+    if not queries:
+        raise ValueError("没有可用于评估的问题")
+    k = max(1, min(top_k, len(texts)))
+    logger.info("维度评估：切片 %s 个，问题 %s 个，维度 %s，k=%s", len(texts), len(queries), dims, k)
+
+    rows: List[dict] = []
+    reference: np.ndarray | None = None
+    for dimension in dims:
+        vectors = _embed(texts, settings, dimension)
+        query_vectors = _embed(queries, settings, dimension)
+        index = faiss.IndexFlatL2(int(vectors.shape[1]))
+        index.add(vectors)
+
+        latencies: List[float] = []
+        results = np.empty((len(queries), k), dtype="int64")
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, ids = index.search(query_vectors[i : i + 1], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results[i] = ids[0]
+        if reference is None:
+            reference = results
+        recall = float(
+            np.mean([len(set(results[i]) & set(reference[i])) / k for i in range(len(queries))])
+        )
+        rows.append(
+            {
+                "dimension": dimension,
+                "vectors": int(index.ntotal),
+                "index_bytes": int(index.ntotal) * int(index.d) * 4,
+                "search_ms_avg": float(np.mean(latencies)),
+                "search_ms_p95": float(np.percentile(latencies, 95)),
+                "recall_at_k": recall,
+            }
+        )
+    return rows
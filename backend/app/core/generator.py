@@ -1,60 +1,118 @@
 from __future__ import annotations
 
+import json
+import logging
+import queue
+import socket
+import threading
 import time
-from typing import Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
+from .deadline import Deadline, DeadlineExceeded
+from .hedging import generation_stats, latency_tracker
+from .profiling import annotate
 from .settings import Settings, get_settings
 
 SYSTEM_PROMPT = (
     "你是一个中文知识库助教。仅依据提供的上下文回答用户问题；"
     "如果上下文不足以回答，请明确说明无法从资料中找到答案，不要凭空编造。"
     "回答要简洁、结构清晰。若需要引用，请在回答最后增加“引用来源：”一行，"
-    "使用 [1] [2] [3]… 这种连续编号，并确保这些编号与系统提供的上下文编号一致；"
-    "在正文中可以使用 [1][2]… 进行引用。"
+    "只能使用每段上下文前标注的 [n] 编号，原样引用，不要重新编号或改为连续编号；"
+    "在正文中也使用同样的 [n] 编号进行引用。"
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 class GenerationResult(dict):
-    """生成结果：包含模型回答与耗时（毫秒）。"""
+    """生成结果：包含模型回答、耗时（毫秒）与 token 用量（含前缀缓存命中数）。"""
     answer: str
     latency_ms: int
+    usage: dict
 
 
-def _request_payload(question: str, context_text: str, settings: Settings) -> dict:
-    """组装 DeepSeek 聊天接口请求体。"""
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"问题：{question}\n\n上下文：\n{context_text}"},
-    ]
+def _request_payload(
+    question: str,
+    context_text: str,
+    settings: Settings,
+    history: Sequence[tuple[str, str]] = (),
+) -> dict:
+    """组装 DeepSeek 聊天接口请求体。
+
+    消息按“稳定在前、易变在后”排列：系统提示 → 上下文 → 历史问答 → 本轮问题，
+    相同上下文上的不同问题（以及同一会话的追问）可以共享可缓存的前缀。
+    """
+    messages = [{"role": "system", "content": f"{SYSTEM_PROMPT}\n\n上下文：\n{context_text}"}]
+    for past_question, past_answer in history:
+        messages.append({"role": "user", "content": f"问题：{past_question}"})
+        messages.append({"role": "assistant", "content": past_answer})
+    messages.append({"role": "user", "content": f"问题：{question}"})
     return {"model": settings.deepseek_model, "messages": messages, "temperature": 0.2}
 
 
-def generate_answer(question: str, context_text: str, settings: Settings | None = None) -> GenerationResult:
-    """调用 DeepSeek 聊天接口生成答案。"""
+def _parse_usage(data: dict) -> dict:
+    """提取 token 用量；DeepSeek 以 prompt_cache_hit_tokens/miss_tokens 报告前缀缓存命中。"""
+    usage = data.get("usage") or {}
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+        "cache_hit_tokens": int(usage.get("prompt_cache_hit_tokens") or 0),
+        "cache_miss_tokens": int(usage.get("prompt_cache_miss_tokens") or 0),
+    }
+
 
-    cfg = settings or get_settings()
+@dataclass
+class _Endpoint:
+    label: str
+    url: str
+    headers: dict
+    model: str
+
+
+def _is_placeholder(key: str) -> bool:
+    return not key or key.strip().lower() in {"", "your_deepseek_key", "placeholder"}
+
+
+def _endpoints(cfg: Settings) -> tuple[_Endpoint, Optional[_Endpoint]]:
+    """返回主模型与后备模型（未配置时为 None）的接口地址、请求头与模型名。"""
     # 更严格的 Key 校验：占位符也视为未配置
-    if not cfg.deepseek_api_key or cfg.deepseek_api_key.strip().lower() in {"", "your_deepseek_key", "placeholder"}:
+    if _is_placeholder(cfg.deepseek_api_key):
         raise ValueError("DEEPSEEK_API_KEY 未配置或无效，无法生成答案")
 
-    base_url = cfg.deepseek_base_url.rstrip("/")
-    url = f"{base_url}/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {cfg.deepseek_api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = _request_payload(question, context_text, cfg)
+    def build(label: str, base_url: str, api_key: str, model: str) -> _Endpoint:
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        return _Endpoint(label, f"{base_url.rstrip('/')}/v1/chat/completions", headers, model)
 
-    start = time.perf_counter()
-    # 统一超时，失败抛出上层处理（不泄露密钥）
+    primary = build("primary", cfg.deepseek_base_url, cfg.deepseek_api_key, cfg.deepseek_model)
+    if not (cfg.fallback_model or cfg.fallback_base_url):
+        return primary, None
+    fallback_key = cfg.fallback_api_key if not _is_placeholder(cfg.fallback_api_key) else cfg.deepseek_api_key
+    fallback = build(
+        "fallback",
+        cfg.fallback_base_url or cfg.deepseek_base_url,
+        fallback_key,
+        cfg.fallback_model or cfg.deepseek_model,
+    )
+    return primary, fallback
+
+
+@contextmanager
+def _deepseek_errors() -> Iterator[None]:
+    """把请求异常统一转换为 RuntimeError，交由上层处理（不泄露密钥）。"""
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=cfg.request_timeout)
-        response.raise_for_status()
-        data = response.json()
-        answer = data["choices"][0]["message"]["content"].strip()
-    except (KeyError, IndexError) as exc:  # pragma: no cover - defensive
+        yield
+    except (KeyError, IndexError, ValueError) as exc:  # pragma: no cover - defensive
         raise RuntimeError("DeepSeek 响应格式异常") from exc
     except requests.HTTPError as exc:  # 返回非 2xx
         status = exc.response.status_code if exc.response is not None else "N/A"
@@ -63,5 +121,270 @@ def generate_answer(question: str, context_text: str, settings: Settings | None
     except requests.RequestException as exc:  # 网络/超时等
         raise RuntimeError(f"DeepSeek 请求失败：{exc}") from exc
 
+
+# 当前线程所属的生成请求：连接建立后登记到这里，取消方可直接关闭 socket
+_current = threading.local()
+
+
+def _track_socket(sock) -> None:
+    attempt = getattr(_current, "attempt", None)
+    if attempt is not None and sock is not None:
+        attempt.track(sock)
+
+
+class _TrackedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        super().connect()
+        _track_socket(self.sock)
+
+
+class _TrackedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        super().connect()
+        _track_socket(self.sock)
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _CancellableAdapter(HTTPAdapter):
+    """连接池改用可追踪的连接类，建立的 socket 登记到所属的 _Attempt。"""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+
+
+def _shutdown(sock) -> None:
+    # shutdown 会唤醒阻塞在 recv 上的读取线程（仅 close 不会）
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _read_stream(
+    session: requests.Session, endpoint: _Endpoint, payload: dict, timeout: float, cancelled: threading.Event
+) -> Iterator[dict]:
+    """发起一次流式请求并解析 SSE：逐段产出 delta，最后产出 usage。"""
+    body = {**payload, "model": endpoint.model, "stream": True, "stream_options": {"include_usage": True}}
+    usage = _parse_usage({})
+    with session.post(endpoint.url, json=body, headers=endpoint.headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        # SSE 响应通常不声明编码，按 UTF-8 解码避免中文乱码
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if cancelled.is_set():
+                return
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("usage"):
+                usage = _parse_usage(chunk)
+            for choice in chunk.get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield {"type": "delta", "text": text}
+    yield {"type": "usage", "usage": usage}
+
+
+class _Attempt(threading.Thread):
+    """单路生成请求：在后台线程读取流式响应，事件写入共享队列。
+
+    cancel() 由取消方调用，直接关闭本路已建立的连接，仍在等待响应头或下一行数据的请求立即结束，不必等到 request_timeout。
+    """
+
+    def __init__(self, label: str, endpoint: _Endpoint, payload: dict, timeout: float, events: queue.Queue):
+        super().__init__(name=f"generate-{label}", daemon=True)
+        self.label = label
+        self.endpoint = endpoint
+        self.payload = payload
+        self.timeout = timeout
+        self.events = events
+        self.started_at = time.monotonic()
+        self.cancelled = threading.Event()
+        self._sockets: list = []
+        self._lock = threading.Lock()
+
+    def track(self, sock) -> None:
+        with self._lock:
+            self._sockets.append(sock)
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            _shutdown(sock)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled.set()
+            sockets = list(self._sockets)
+        for sock in sockets:
+            _shutdown(sock)
+
+    def run(self) -> None:
+        _current.attempt = self
+        session = requests.Session()
+        adapter = _CancellableAdapter()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        try:
+            with _deepseek_errors():
+                for event in _read_stream(session, self.endpoint, self.payload, self.timeout, self.cancelled):
+                    self.events.put((self, event))
+        except Exception as exc:
+            # 被取消的请求因连接关闭而报错，无需上报
+            if not self.cancelled.is_set():
+                self.events.put((self, {"type": "error", "error": exc}))
+        finally:
+            session.close()
+            _current.attempt = None
+
+
+def _generate_events(payload: dict, cfg: Settings, deadline: Deadline) -> Iterator[dict]:
+    """带尾延迟控制的生成：逐段产出 delta，最后产出 usage。
+
+    - 对冲：主请求超过“近期首 token 延迟的分位数”仍无输出时，再发一路相同请求，先出 token 者胜出；
+    - 后备：距截止时间不足 FALLBACK_RESERVE_MS 时改用（或追加）后备模型/地址，主请求全部失败时也立即切换；
+    - 截止：超过端到端截止时间即取消所有请求并抛出 DeadlineExceeded。
+    一旦某路请求产出首个 token，其余请求立即取消（由取消方关闭连接），每个请求最多多付出一路对冲与一路后备的成本。
+    """
+    primary, fallback = _endpoints(cfg)
+    events: queue.Queue = queue.Queue()
+    attempts: List[_Attempt] = []
+    finished: set = set()
+
+    def launch(label: str, endpoint: _Endpoint) -> None:
+        attempt = _Attempt(label, endpoint, payload, deadline.timeout(cfg.request_timeout), events)
+        attempt.start()
+        attempts.append(attempt)
+
+    generation_stats.incr("requests")
+    now = time.monotonic()
+    remaining = deadline.remaining()
+    reserve = cfg.fallback_reserve_ms / 1000
+    fallback_at: float | None = None
+    if fallback is not None and remaining is not None and remaining <= reserve:
+        launch("fallback", fallback)
+        generation_stats.incr("fallbacks")
+    else:
+        launch("primary", primary)
+        if fallback is not None and remaining is not None:
+            fallback_at = now + remaining - reserve
+    hedge_at = now + latency_tracker.hedge_delay(cfg) if cfg.hedge_enabled else None
+
+    def record_latency() -> None:
+        # 首 token 延迟只按主请求采样：主请求胜出时即其延迟；被对冲/后备抢先或超时时，记入截至此刻的已等待时间
+        # （删失样本，真实延迟不低于此值）。只记胜出者会让对冲胜出时留下的都是快样本，分位数被持续拉低
+        first = next((a for a in attempts if a.label == "primary"), None)
+        if first is not None and first not in finished:
+            latency_tracker.record(time.monotonic() - first.started_at)
+
+    winner: _Attempt | None = None
+    try:
+        while True:
+            wake = [t for t in (hedge_at, fallback_at, deadline.expires_at) if t is not None]
+            try:
+                attempt, event = events.get(timeout=max(0.0, min(wake) - time.monotonic()) if wake else None)
+            except queue.Empty:
+                now = time.monotonic()
+                if deadline.expired():
+                    record_latency()
+                    generation_stats.incr("timeouts")
+                    raise DeadlineExceeded("生成超过请求截止时间")
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    launch("hedge", primary)
+                    generation_stats.incr("hedged")
+                if fallback_at is not None and now >= fallback_at:
+                    fallback_at = None
+                    launch("fallback", fallback)
+                    generation_stats.incr("fallbacks")
+                continue
+
+            if winner is not None and attempt is not winner:
+                continue
+            if event["type"] == "error":
+                error = event["error"]
+                logger.warning("生成请求失败（%s）：%s", attempt.label, error)
+                if attempt is winner:
+                    generation_stats.incr("errors")
+                    raise error
+                finished.add(attempt)
+                if len(finished) < len(attempts):
+                    continue
+                # 已发出的请求全部失败：后备模型尚未启用时立即切换，否则报错
+                if fallback is not None and all(a.label != "fallback" for a in attempts):
+                    hedge_at = fallback_at = None
+                    launch("fallback", fallback)
+                    generation_stats.incr("fallbacks")
+                    continue
+                generation_stats.incr("errors")
+                raise error
+
+            if winner is None:
+                winner = attempt
+                hedge_at = fallback_at = None
+                for other in attempts:
+                    if other is not winner:
+                        other.cancel()
+                record_latency()
+                if winner.label == "hedge":
+                    generation_stats.incr("hedge_wins")
+                elif winner.label == "fallback":
+                    generation_stats.incr("fallback_wins")
+                annotate(generation_attempts=len(attempts), generation_winner=winner.label)
+            yield event
+            if event["type"] == "usage":
+                return
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+def generate_answer(
+    question: str,
+    context_text: str,
+    settings: Settings | None = None,
+    history: Sequence[tuple[str, str]] = (),
+    deadline: Deadline | None = None,
+) -> GenerationResult:
+    """调用 DeepSeek 聊天接口生成答案（history 为同一会话的历史问答）。"""
+
+    cfg = settings or get_settings()
+    payload = _request_payload(question, context_text, cfg, history)
+
+    start = time.perf_counter()
+    parts: List[str] = []
+    usage = _parse_usage({})
+    for event in _generate_events(payload, cfg, deadline or Deadline(cfg.request_deadline_ms)):
+        if event["type"] == "delta":
+            parts.append(event["text"])
+        else:
+            usage = event["usage"]
+
     latency_ms = int((time.perf_counter() - start) * 1000)
-    return GenerationResult(answer=answer, latency_ms=latency_ms)
+    return GenerationResult(answer="".join(parts).strip(), latency_ms=latency_ms, usage=usage)
+
+
+def stream_answer(
+    question: str,
+    context_text: str,
+    settings: Settings | None = None,
+    history: Sequence[tuple[str, str]] = (),
+    deadline: Deadline | None = None,
+) -> Iterator[dict]:
+    """以流式方式调用 DeepSeek：逐段产出 {"type": "delta", "text": ...}，最后产出 {"type": "usage", "usage": {...}}。"""
+
+    cfg = settings or get_settings()
+    payload = _request_payload(question, context_text, cfg, history)
+    yield from _generate_events(payload, cfg, deadline or Deadline(cfg.request_deadline_ms))
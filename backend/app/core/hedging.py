@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter, deque
+from typing import Deque
+
+from .settings import Settings
+
+# 样本数不足时使用配置的初始对冲延迟
+_MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """记录最近若干次生成请求的首 token 延迟（秒），按分位数给出对冲触发延迟。"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(pct / 100 * (len(samples) - 1) + 0.5))]
+
+    def hedge_delay(self, settings: Settings) -> float:
+        with self._lock:
+            enough = len(self._samples) >= _MIN_SAMPLES
+        if not enough:
+            return settings.hedge_delay_ms / 1000
+        return self.percentile(settings.hedge_percentile) or settings.hedge_delay_ms / 1000
+
+
+class GenerationStats:
+    """生成请求计数：总数、对冲/后备发起与胜出次数、超时与失败次数。"""
+
+    def __init__(self) -> None:
+        self._counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        p50, p95 = latency_tracker.percentile(50), latency_tracker.percentile(95)
+        return {
+            **{
+                name: counts.get(name, 0)
+                for name in ("requests", "hedged", "hedge_wins", "fallbacks", "fallback_wins", "timeouts", "errors")
+            },
+            "first_token_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "first_token_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+latency_tracker = LatencyTracker()
+generation_stats = GenerationStats()
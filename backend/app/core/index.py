@@ -5,6 +5,10 @@ from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_s
 from llama_index.core.schema import BaseNode
 from llama_index.vector_stores.faiss import FaissVectorStore
 
+from .embed import get_embedding_model
+from .nodestore import write_node_store
+from .postings import Postings, build_postings, write_postings
+from .routing import build_routing, write_routing
 from .settings import Settings
 
 
@@ -27,14 +31,49 @@ def build_and_persist_index(
     faiss_index = faiss.IndexFlatL2(int(settings.embed_dimension))
     vector_store = FaissVectorStore(faiss_index=faiss_index)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    # 使用全局 Settings（已在上层设置 embed_model）创建向量索引
-    VectorStoreIndex(nodes, storage_context=storage_context)
+    # 显式传入与知识库维度一致的嵌入模型（不同知识库可能使用不同维度，不能依赖全局 Settings）
+    index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=get_embedding_model(settings))
     storage_context.persist(persist_dir=str(settings.index_dir))
     # 额外落地原生 FAISS 索引，便于无需 LlamaIndex 直接加载
     try:  # pragma: no cover - 辅助持久化
         faiss.write_index(faiss_index, str(Path(settings.index_dir) / "faiss.index"))
     except Exception:
         pass
+    # 按 FAISS 位置顺序落地二进制节点存储，检索时 mmap 直读，无需解析 docstore.json
+    by_id = {node.node_id: node for node in nodes}
+    positions = sorted(index.index_struct.nodes_dict.items(), key=lambda item: int(item[0]))
+    records = [
+        {
+            "id": node_id,
+            "text": by_id[node_id].get_content(metadata_mode="LLM"),
+            "metadata": by_id[node_id].metadata,
+        }
+        for _, node_id in positions
+    ]
+    write_node_store(Path(settings.index_dir), records)
+    # 同时落地 (来源, 页码) → FAISS 位置的倒排表，供过滤检索构造 IDSelector
+    postings = build_postings(records)
+    write_postings(Path(settings.index_dir), postings)
+    # 文档级路由向量（每个来源文件一条），供两阶段检索先选文档
+    if faiss_index.ntotal:
+        vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+        write_routing(Path(settings.index_dir), *build_routing(vectors, Postings.from_map(postings)))
+
+
+def read_faiss_index(path: Path, use_mmap: bool = True):
+    """读取原生 FAISS 索引；use_mmap 时以只读 mmap 打开，多进程共享操作系统页缓存。"""
+    import faiss  # type: ignore
+
+    if use_mmap:
+        for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            flag = getattr(faiss, flag_name, None)
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+            except Exception:
+                continue
+    return faiss.read_index(str(path))
 
 
 def load_persisted_index(settings: Settings) -> VectorStoreIndex:
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import json
+import mmap
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+NODES_BIN = "nodes.bin"
+NODES_IDX = "nodes.idx"
+
+
+def write_node_store(directory: Path, records: Iterable[dict]) -> int:
+    """按 FAISS 位置顺序写出二进制节点存储，返回记录数。
+
+    - nodes.bin：逐条拼接的 UTF-8 JSON 记录（id/text/metadata）；
+    - nodes.idx：n+1 个小端 uint64 偏移量，第 i 条记录位于 [idx[i], idx[i+1])。
+    两个文件都以只读 mmap 打开，多进程共享同一份页缓存，且无需整体解析。
+    """
+    offsets = [0]
+    with open(directory / NODES_BIN, "wb") as f:
+        for record in records:
+            data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.asarray(offsets, dtype="<u8").tofile(directory / NODES_IDX)
+    return len(offsets) - 1
+
+
+def has_node_store(directory: Path) -> bool:
+    return (directory / NODES_BIN).exists() and (directory / NODES_IDX).exists()
+
+
+class NodeStore:
+    """只读 mmap 节点存储：按 FAISS 位置随机读取单条记录。"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._offsets = np.memmap(self.directory / NODES_IDX, dtype="<u8", mode="r")
+        self._file = open(self.directory / NODES_BIN, "rb")
+        size = int(self._offsets[-1]) if len(self._offsets) else 0
+        self._data: Optional[mmap.mmap] = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        )
+
+    def __len__(self) -> int:
+        return max(0, len(self._offsets) - 1)
+
+    def get(self, position: int) -> Optional[dict]:
+        if position < 0 or position >= len(self) or self._data is None:
+            return None
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return json.loads(self._data[start:end])
+
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+        self._offsets = np.empty(0, dtype="<u8")
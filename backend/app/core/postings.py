@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .dedup import ALIASES_KEY
+from .nodestore import NodeStore
+
+POSTINGS_JSON = "postings.json"
+POSTINGS_IDS = "postings.ids"
+_FORMAT = 1
+
+# (来源文件, 页码) → FAISS 位置列表；页码无法解析为整数时为 None
+PostingMap = Dict[Tuple[str, Optional[int]], List[int]]
+
+
+def _page_number(value: object) -> Optional[int]:
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _keys_of(metadata: dict) -> Iterator[Tuple[str, Optional[int]]]:
+    """切片对应的 (来源, 页码)；去重合并的切片同时计入 aliases 中记录的来源。"""
+    source = metadata.get("source") or metadata.get("file_name") or metadata.get("file_path")
+    if source:
+        yield str(source), _page_number(metadata.get("page_label") or metadata.get("page") or metadata.get("slide"))
+    for alias in metadata.get(ALIASES_KEY) or []:
+        name, _, page = str(alias).rpartition("#")
+        yield (name, _page_number(page)) if name else (str(alias), None)
+
+
+def build_postings(records: Iterable[dict]) -> PostingMap:
+    """按节点存储顺序（即 FAISS 位置）构建倒排表。"""
+    postings: PostingMap = {}
+    for position, record in enumerate(records):
+        for key in set(_keys_of(record.get("metadata") or {})):
+            postings.setdefault(key, []).append(position)
+    return postings
+
+
+def _flatten(postings: PostingMap) -> Tuple[List[list], np.ndarray]:
+    entries = []
+    chunks = []
+    offset = 0
+    for (source, page), positions in sorted(postings.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+        entries.append([source, page, offset, offset + len(positions)])
+        chunks.append(np.asarray(positions, dtype="<i8"))
+        offset += len(positions)
+    return entries, np.concatenate(chunks) if chunks else np.empty(0, dtype="<i8")
+
+
+def write_postings(directory: Path, postings: PostingMap) -> None:
+    """postings.ids 为拼接后的 int64 位置数组，postings.json 记录每个 (来源, 页码) 在其中的区间。"""
+    entries, ids = _flatten(postings)
+    ids.tofile(directory / POSTINGS_IDS)
+    (directory / POSTINGS_JSON).write_text(
+        json.dumps({"format": _FORMAT, "entries": entries}, ensure_ascii=False), encoding="utf-8"
+    )
+
+
+def _map_ids(path: Path) -> np.ndarray:
+    """位置数组以只读 mmap 打开：卸载后重新加载不必整体读入，多个 worker 共享页缓存。"""
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype="<i8")
+    return np.memmap(path, dtype="<i8", mode="r")
+
+
+class Postings:
+    """单个分片的元数据倒排表：把过滤条件解析为 FAISS 位置集合。"""
+
+    def __init__(self, entries: List[list], ids: np.ndarray):
+        self._ids = ids
+        self._by_source: Dict[str, List[Tuple[Optional[int], int, int]]] = {}
+        for source, page, start, end in entries:
+            self._by_source.setdefault(source, []).append((page, int(start), int(end)))
+
+    @classmethod
+    def from_map(cls, postings: PostingMap) -> "Postings":
+        return cls(*_flatten(postings))
+
+    @classmethod
+    def load(cls, directory: Path, node_store: NodeStore) -> "Postings":
+        """优先读取入库时写出的倒排表；旧分片或导入的归档没有时由节点存储即时构建（仅驻留内存）。"""
+        try:
+            meta = json.loads((directory / POSTINGS_JSON).read_text(encoding="utf-8"))
+            if meta.get("format") == _FORMAT:
+                return cls(meta["entries"], _map_ids(directory / POSTINGS_IDS))
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.from_map(build_postings(node_store.get(i) or {} for i in range(len(node_store))))
+
+    def sources(self) -> List[str]:
+        return list(self._by_source)
+
+    def select(self, filters: dict) -> np.ndarray:
+        """返回满足过滤条件的位置（升序去重）。
+
+        filters 支持 sources（文件名列表，任一匹配）与 page_from/page_to（闭区间，
+        仅匹配可解析为整数的页码）；同一切片的来源与页码须同时满足。
+        """
+        sources = filters.get("sources")
+        page_from = filters.get("page_from")
+        page_to = filters.get("page_to")
+        by_page = page_from is not None or page_to is not None
+        groups = (
+            [self._by_source.get(s, []) for s in sources] if sources else list(self._by_source.values())
+        )
+        spans = [
+            self._ids[start:end]
+            for group in groups
+            for page, start, end in group
+            if not by_page
+            or (
+                page is not None
+                and (page_from is None or page >= page_from)
+                and (page_to is None or page <= page_to)
+            )
+        ]
+        if not spans:
+            return np.empty(0, dtype="int64")
+        return np.unique(np.concatenate(spans)).astype("int64", copy=False)
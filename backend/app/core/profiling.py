@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set
+
+from .settings import Settings
+
+PROFILE_HEADER = "x-profile"
+_REQUEST_ID_RE = re.compile(r"[^A-Za-z0-9_-]")
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("easyrag.slow")
+
+
+@dataclass
+class RequestTrace:
+    """单个请求的耗时分解与关键字段（kb/top_k/提示长度等），供慢请求日志与采样分析使用。"""
+
+    request_id: str
+    method: str
+    path: str
+    started: float = field(default_factory=time.perf_counter)
+    stages: Dict[str, float] = field(default_factory=dict)
+    fields: Dict[str, object] = field(default_factory=dict)
+    # 实际执行该请求的线程（事件循环线程或线程池线程），采样器只采这些线程
+    threads: Set[int] = field(default_factory=set)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """记录一个处理阶段的耗时（毫秒，同名累加）；不在请求上下文中时为空操作。"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    trace.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.stages[name] = trace.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def annotate(**fields: object) -> None:
+    """为当前请求补充慢请求日志字段。"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+class SamplingProfiler(threading.Thread):
+    """轻量采样分析器：按固定间隔抓取请求线程的调用栈，输出折叠栈（flamegraph.pl / speedscope 可直接读取）。"""
+
+    def __init__(self, trace: RequestTrace, interval_ms: int):
+        super().__init__(name=f"profiler-{trace.request_id}", daemon=True)
+        self.trace = trace
+        # 文件名在开始采样时确定：流式响应的响应头先于采样结束发出
+        self.filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.request_id}.folded"
+        self.interval = max(1, interval_ms) / 1000
+        self.counts: Counter[str] = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in tuple(self.trace.threads):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.counts[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def stop(self, out_dir: Path) -> Path:
+        self._stopped.set()
+        self.join()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / self.filename
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def _server_timing(trace: RequestTrace) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in trace.stages.items())
+
+
+class _TracedResponse:
+    """包装下游响应：响应体发送完毕（或客户端断开）后才结束采样并记录慢请求，流式响应的生成过程也计入。"""
+
+    def __init__(self, response, on_close):
+        self.response = response
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+def _wants_profile(request, settings: Settings) -> bool:
+    if not settings.profile_allow_header:
+        return False
+    value = request.headers.get(PROFILE_HEADER, "")
+    if settings.profile_token:
+        return hmac.compare_digest(value.encode("utf-8"), settings.profile_token.encode("utf-8"))
+    return value not in ("", "0")
+
+
+def install_profiling(app, settings: Settings, log_dir: Path) -> None:
+    """挂载请求级中间件：阶段耗时（Server-Timing 头）、按需采样分析与慢请求日志。
+
+    - PROFILE_ALLOW_HEADER 开启时，请求头 `X-Profile`（配置了 PROFILE_TOKEN 时须与之一致）触发采样分析，
+      也可按 PROFILE_SAMPLE_RATE 抽样；折叠栈写入 logs/profiles/，文件名通过响应头 X-Profile-File 返回；
+    - 采样与耗时统计持续到响应体发送完毕（/ask/stream 的生成过程也计入），
+      Server-Timing 头只包含响应头发出之前完成的阶段；
+    - 总耗时超过 SLOW_REQUEST_MS 的请求，以 JSON 行写入 logs/slow_requests.log。
+    """
+    profile_dir = log_dir / "profiles"
+    slow_path = str((log_dir / "slow_requests.log").resolve())
+    # create_app 可能被调用多次（如桌面入口），避免重复挂载同一文件的处理器
+    if not any(getattr(h, "baseFilename", None) == slow_path for h in slow_logger.handlers):
+        slow_handler = logging.FileHandler(slow_path, encoding="utf-8")
+        slow_handler.setFormatter(logging.Formatter("%(asctime)s | %(message)s"))
+        slow_logger.addHandler(slow_handler)
+
+    @app.middleware("http")
+    async def _profiling_middleware(request, call_next):
+        trace = RequestTrace(
+            # 请求 ID 会出现在分析文件名中，只保留安全字符
+            request_id=_REQUEST_ID_RE.sub("", request.headers.get("x-request-id", ""))[:64] or uuid.uuid4().hex[:12],
+            method=request.method,
+            path=request.url.path,
+        )
+        trace.threads.add(threading.get_ident())
+        token = _current_trace.set(trace)
+        profiler = None
+        if _wants_profile(request, settings) or (
+            settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+        ):
+            profiler = SamplingProfiler(trace, settings.profile_interval_ms)
+            profiler.start()
+        status_code: list = [500]
+        finished = False
+
+        def finish() -> None:
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            if profiler is not None:
+                profile_path = profiler.stop(profile_dir)
+                logger.info("已写入采样分析：%s（%s 个样本）", profile_path, profiler.samples)
+            total_ms = trace.elapsed_ms()
+            if settings.slow_request_ms and total_ms >= settings.slow_request_ms:
+                slow_logger.warning(
+                    json.dumps(
+                        {
+                            "request_id": trace.request_id,
+                            "method": trace.method,
+                            "path": trace.path,
+                            "status": status_code[0],
+                            "total_ms": round(total_ms, 1),
+                            "stages_ms": {k: round(v, 1) for k, v in trace.stages.items()},
+                            **trace.fields,
+                        },
+                        ensure_ascii=False,
+                        default=str,
+                    )
+                )
+
+        try:
+            response = await call_next(request)
+        except BaseException:
+            finish()
+            raise
+        finally:
+            _current_trace.reset(token)
+
+        status_code[0] = response.status_code
+        response.headers["X-Request-Id"] = trace.request_id
+        if trace.stages:
+            response.headers["Server-Timing"] = _server_timing(trace)
+        if profiler is not None:
+            response.headers["X-Profile-File"] = profiler.filename
+        return _TracedResponse(response, finish)
@@ -1,46 +1,98 @@
 from __future__ import annotations
 
+import hashlib
+import os
 import shutil
+import sqlite3
 import time
 from pathlib import Path
-from typing import List, Sequence
+from typing import Iterator, List, Sequence
 
 import logging
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core import Settings as LISettings
-from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.schema import BaseNode
 
-from .embed import get_embedding_model
-from .generator import generate_answer
-from .index import build_and_persist_index, load_persisted_index
-from .retriever import as_topk_retriever
+from .catalog import get_catalog
+from .compress import compress_contexts
+from .deadline import Deadline
+from .dedup import ALIASES_KEY, dedup_nodes
+from .doccache import get_document_cache
+from .embed import embed_queries, get_embedding_model, validate_dimension
+from .generator import generate_answer, stream_answer
+from .index import build_and_persist_index
+from .profiling import annotate, stage
+from .retriever import rerank_hits
+from .session import ChatSession, get_session_store, merge_session_contexts
 from .settings import Settings, get_settings
+from .shards import (
+    SUPPORTED_EXTS,
+    backfill_shard_files,
+    kb_lock,
+    list_source_files,
+    plan_shards,
+    read_kb_dimension,
+    read_layout,
+    read_shard_manifest,
+    read_version,
+    replace_dir,
+    search_shards,
+    snapshot_cache,
+    shard_dir,
+    shard_fingerprint,
+    write_layout,
+    write_shard_manifest,
+    write_version,
+)
+from .splitter import get_node_parser
 
-SUPPORTED_EXTS = [".pdf", ".pptx", ".md"]
 CHAR_PER_TOKEN = 4  # 粗略换算，限制上下文长度
 
 logger = logging.getLogger(__name__)
 
 
-def _load_documents(raw_dir: Path) -> list:
-    """从原始资料目录读取 PDF/PPTX/MD，并补充 source 元信息。"""
+def _read_files(files: Sequence[Path]) -> list:
     reader = SimpleDirectoryReader(
-        input_dir=str(raw_dir),
+        input_files=[str(f) for f in files],
         required_exts=SUPPORTED_EXTS,
-        recursive=True,
         filename_as_id=True,
         file_metadata=lambda fp: {"source": Path(fp).name},
     )
-    documents = reader.load_data()
+    return reader.load_data()
+
+
+def _load_documents(
+    raw_dir: Path,
+    files: Sequence[Path] | None = None,
+    settings: Settings | None = None,
+) -> list:
+    """从原始资料目录读取 PDF/PPTX/MD（或仅读取给定文件），并补充 source 元信息。
+
+    解析结果按文件内容哈希缓存（DOC_CACHE_DIR），内容未变的文件直接复用，调整切分参数重建时无需重新解析。
+    """
+    paths = list(files) if files is not None else list_source_files(raw_dir)
+    if not paths:
+        return []
+    cache = get_document_cache(settings or get_settings())
+    documents = []
+    for path in paths:
+        cached = cache.get(path) if cache is not None else None
+        if cached is None:
+            cached = _read_files([path])
+            if cache is not None:
+                cache.put(path, cached)
+        documents.extend(cached)
+    if cache is not None:
+        logger.info("解析缓存：命中 %s 个文件，解析 %s 个文件", cache.hits, cache.misses)
+        cache.evict()
     for doc in documents:
         doc.metadata.setdefault("source", doc.metadata.get("file_name") or doc.metadata.get("file_path"))
     return documents
 
 
 def _prepare_nodes(documents: Sequence, settings: Settings) -> List[BaseNode]:
-    """按固定窗口切分文档，生成可嵌入的节点集合。"""
-    splitter = SentenceSplitter(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+    """按固定窗口切分文档，生成可嵌入的节点集合（切分器由 TEXT_SPLITTER 选择）。"""
+    splitter = get_node_parser(settings)
     nodes: List[BaseNode] = splitter.get_nodes_from_documents(documents)
     timestamp = int(time.time())
     for node in nodes:
@@ -60,27 +112,264 @@ def _with_kb(settings: Settings, kb: str) -> Settings:
     return cfg
 
 
-def ingest_corpus(kb: str, rebuild: bool, settings: Settings | None = None) -> tuple[int, int]:
-    """执行 ingest：对指定知识库可选重建、解析+切分、向量化并持久化 FAISS 索引。"""
+def _split_shard(documents: Sequence, cfg: Settings) -> List[BaseNode]:
+    """切分单个分片的文档。"""
+    nodes = _prepare_nodes(documents, cfg)
+    logger.info(
+        "已切分节点：%s 个（splitter=%s，chunk_size=%s，overlap=%s）",
+        len(nodes),
+        cfg.text_splitter,
+        cfg.chunk_size,
+        cfg.chunk_overlap,
+    )
+    return nodes
+
+
+def _dedup(nodes: List[BaseNode], cfg: Settings) -> tuple[List[BaseNode], dict]:
+    """近重复检测并记录日志，返回 (保留切片, 去重统计)。"""
+    kept, stats = dedup_nodes(nodes, cfg)
+    logger.info(
+        "近重复检测：%s → %s 个切片，去重 %s 个（占比 %.1f%%）",
+        stats["nodes_in"],
+        stats["nodes_out"],
+        stats["duplicates"],
+        stats["dedup_ratio"] * 100,
+    )
+    return kept, stats
+
+
+def _dedup_across_shards(
+    shard_nodes: dict[int, List[BaseNode]], cfg: Settings
+) -> dict[int, tuple[List[BaseNode], dict]]:
+    """在整个知识库的切片上做近重复检测（跨文件的重复常落在不同分片），再把保留的切片分回各自分片。
+
+    返回 {分片: (保留切片, 该分片的去重统计)}；统计中的 duplicates 为该分片被并入其他切片的数量。
+    """
+    origin = {id(node): shard_id for shard_id, nodes in shard_nodes.items() for node in nodes}
+    kept, stats = _dedup([node for shard_id in sorted(shard_nodes) for node in shard_nodes[shard_id]], cfg)
+    result: dict[int, tuple[List[BaseNode], dict]] = {
+        shard_id: ([], {"nodes_in": len(nodes), "duplicates": len(nodes)}) for shard_id, nodes in shard_nodes.items()
+    }
+    for node in kept:
+        nodes, shard_stats = result[origin[id(node)]]
+        nodes.append(node)
+        shard_stats["duplicates"] -= 1
+    return result
+
+
+def _content_digest(nodes: Sequence[BaseNode]) -> str:
+    """分片去重后内容的指纹（切片文本与 aliases），用于判断源文件未变的分片是否因跨分片去重而需要重建。"""
+    h = hashlib.sha1()
+    for node in nodes:
+        h.update(node.get_content(metadata_mode="none").encode("utf-8"))
+        h.update(b"\0")
+        h.update("\n".join(node.metadata.get(ALIASES_KEY) or []).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _dedup_totals(manifest: dict) -> tuple[int, int]:
+    """从分片清单读取 (去重前切片数, 去重数)；旧清单只有 dedup_ratio 时据切片数反推。"""
+    if "nodes_in" in manifest:
+        return int(manifest["nodes_in"]), int(manifest.get("duplicates", 0))
+    chunks = int(manifest.get("chunks", 0))
+    ratio = float(manifest.get("dedup_ratio", 0.0))
+    nodes_in = round(chunks / (1 - ratio)) if ratio < 1 else chunks
+    return nodes_in, nodes_in - chunks
+
+
+def _kb_dimension(cfg: Settings) -> int:
+    """知识库的嵌入维度：优先使用索引中记录的维度，其次为全局默认值。"""
+    return read_kb_dimension(cfg.index_dir) or int(cfg.embed_dimension)
+
+
+def _refresh_catalog(settings: Settings, kb: str) -> None:
+    """入库完成后刷新知识库目录中的统计；目录写入失败不影响入库结果。"""
+    try:
+        get_catalog(settings).refresh(kb, ingested=True)
+    except sqlite3.Error as exc:
+        logger.warning("更新知识库目录失败：kb=%s（%s）", kb, exc)
+
+
+def ingest_corpus(
+    kb: str,
+    rebuild: bool,
+    settings: Settings | None = None,
+    dimension: int | None = None,
+) -> tuple[int, int, float]:
+    """执行 ingest：对指定知识库可选重建、解析+切分、去重、向量化并持久化 FAISS 索引。
+
+    知识库按源文件哈希划分为 INDEX_SHARDS 个分片，各分片独立构建：
+    rebuild=False 时只重建文件清单或配置发生变化的分片，其余分片原样保留；
+    近重复检测在整个知识库范围进行，源文件未变但去重结果变化的分片也会重建。
+    新索引先写入暂存目录，完整构建后再以 rename 替换并写入版本戳，运行中的检索始终读到完整的快照。
+    dimension 指定该知识库的嵌入维度并随索引保存，不指定时沿用已有索引的维度。
+    返回 (文件数, 切片数, 近重复切片占比)，占比按全部分片清单汇总。
+    """
     base_cfg = settings or get_settings()
     cfg = _with_kb(base_cfg, kb)
-    logger.info("开始构建索引：kb=%s, rebuild=%s，原始目录=%s", kb, rebuild, cfg.raw_dir)
-    if rebuild and cfg.index_dir.exists():
-        logger.info("清空已有索引目录：%s", cfg.index_dir)
-        shutil.rmtree(cfg.index_dir)
-    documents = _load_documents(cfg.raw_dir)
-    if not documents:
+    with kb_lock(cfg.index_dir):
+        return _ingest_locked(kb, rebuild, base_cfg, cfg, dimension)
+
+
+def _ingest_locked(
+    kb: str, rebuild: bool, base_cfg: Settings, cfg: Settings, dimension: int | None
+) -> tuple[int, int, float]:
+    previous_dimension = read_kb_dimension(cfg.index_dir)
+    cfg.embed_dimension = validate_dimension(dimension or previous_dimension or cfg.embed_dimension)
+    num_shards = max(1, int(cfg.index_shards))
+    logger.info(
+        "开始构建索引：kb=%s, rebuild=%s，分片=%s，维度=%s，原始目录=%s",
+        kb,
+        rebuild,
+        num_shards,
+        cfg.embed_dimension,
+        cfg.raw_dir,
+    )
+    layout_changed = read_layout(cfg.index_dir) != num_shards or (
+        previous_dimension is not None and previous_dimension != cfg.embed_dimension
+    )
+    plan = plan_shards(cfg.raw_dir, num_shards)
+    if not plan:
         raise ValueError("RAW_DIR 中没有可用的课程资料")
-    logger.info("已从原始目录读取文档：%s 个", len(documents))
+
+    fingerprints = {shard_id: shard_fingerprint(files, cfg.raw_dir, cfg) for shard_id, files in plan.items()}
+    live = (
+        {}
+        if rebuild or layout_changed
+        else {shard_id: read_shard_manifest(shard_dir(cfg.index_dir, shard_id, num_shards)) for shard_id in plan}
+    )
+    changed = [
+        shard_id for shard_id in sorted(plan) if live.get(shard_id, {}).get("fingerprint") != fingerprints[shard_id]
+    ]
+    # 跨文件的近重复常落在不同分片：分片布局下任一分片有变化（含源文件全部删除的分片）时，
+    # 对全部分片的切片统一去重（解析结果来自文档缓存），源文件未变的分片只在去重后的内容变化时才重新向量化
+    removed = (
+        []
+        if rebuild or layout_changed
+        else [
+            shard_id
+            for shard_id in range(num_shards)
+            if shard_id not in plan and shard_dir(cfg.index_dir, shard_id, num_shards).exists()
+        ]
+    )
+    shard_docs: dict[int, Sequence] = {}
+    prepared: dict[int, tuple[List[BaseNode], dict]] = {}
+    digests: dict[int, str] = {}
+    if cfg.dedup_enabled and num_shards > 1 and (changed or removed):
+        for shard_id in sorted(plan):
+            shard_docs[shard_id] = _load_documents(cfg.raw_dir, plan[shard_id], cfg)
+        prepared = _dedup_across_shards(
+            {shard_id: _split_shard(documents, cfg) for shard_id, documents in shard_docs.items()}, cfg
+        )
+        digests = {shard_id: _content_digest(nodes) for shard_id, (nodes, _) in prepared.items()}
+        changed = [
+            shard_id
+            for shard_id in sorted(plan)
+            if shard_id in changed or live.get(shard_id, {}).get("content_digest") != digests[shard_id]
+        ]
+
+    # 全量重建、布局变化或平铺布局（唯一的分片就是知识库目录）时，在同级暂存目录中构建整个知识库后整体替换；
+    # 分片布局的增量构建只在知识库目录内暂存变化的分片。版本戳最后写入，其他 worker 不会加载写了一半的索引
+    whole = rebuild or layout_changed or (num_shards <= 1 and bool(changed))
+    build_root = cfg.index_dir.parent / f".{cfg.index_dir.name}.build-{os.getpid()}" if whole else cfg.index_dir
+    if whole:
+        shutil.rmtree(build_root, ignore_errors=True)
+        build_root.mkdir(parents=True)
 
     # 设置全局嵌入模型（LlamaIndex 新推荐写法，替代 ServiceContext）
-    embed_model = get_embedding_model()
+    embed_model = get_embedding_model(cfg)
     LISettings.embed_model = embed_model
-    nodes = _prepare_nodes(documents, cfg)
-    logger.info("已切分节点：%s 个（chunk_size=%s，overlap=%s）", len(nodes), cfg.chunk_size, cfg.chunk_overlap)
-    build_and_persist_index(nodes, cfg)
-    file_names = {doc.metadata.get("source") or doc.doc_id for doc in documents}
-    return len(file_names), len(nodes)
+
+    staged: dict[int, Path | None] = {}
+    total_files = total_chunks = nodes_in = duplicates = 0
+    try:
+        for shard_id in sorted(plan):
+            if shard_id not in changed:
+                unchanged = shard_dir(cfg.index_dir, shard_id, num_shards)
+                logger.info("分片 %s 未变化，跳过重建：%s", shard_id, unchanged)
+                # 早于倒排表/路由向量构建的旧分片在此补写（持有知识库锁，不会与重建交错）
+                backfill_shard_files(unchanged)
+                total_files += int(live[shard_id].get("files", 0))
+                total_chunks += int(live[shard_id].get("chunks", 0))
+                shard_in, shard_duplicates = _dedup_totals(live[shard_id])
+                nodes_in += shard_in
+                duplicates += shard_duplicates
+                continue
+            final = shard_dir(cfg.index_dir, shard_id, num_shards)
+            if whole:
+                target = shard_dir(build_root, shard_id, num_shards)
+            else:
+                target = final.parent / f".{final.name}.build-{os.getpid()}"
+            if target != build_root:
+                shutil.rmtree(target, ignore_errors=True)
+            if shard_id in prepared:
+                documents = shard_docs[shard_id]
+                nodes, dedup_stats = prepared[shard_id]
+            else:
+                documents = _load_documents(cfg.raw_dir, plan[shard_id], cfg)
+                nodes, dedup_stats = _dedup(_split_shard(documents, cfg), cfg) if documents else ([], {})
+            logger.info("分片 %s：读取文档 %s 个（文件 %s 个）", shard_id, len(documents), len(plan[shard_id]))
+            if not nodes:
+                staged[shard_id] = None
+                continue
+            shard_cfg = cfg.model_copy()
+            shard_cfg.index_dir = target
+            target.mkdir(parents=True, exist_ok=True)
+            build_and_persist_index(nodes, shard_cfg)
+            files_count = len({doc.metadata.get("source") or doc.doc_id for doc in documents})
+            manifest = {
+                "fingerprint": fingerprints[shard_id],
+                "files": files_count,
+                "chunks": len(nodes),
+                "nodes_in": dedup_stats["nodes_in"],
+                "duplicates": dedup_stats["duplicates"],
+                "dedup_ratio": round(dedup_stats["duplicates"] / dedup_stats["nodes_in"], 4),
+                "embed_dimension": cfg.embed_dimension,
+                "built_at": int(time.time()),
+            }
+            if shard_id in digests:
+                manifest["content_digest"] = digests[shard_id]
+            write_shard_manifest(target, manifest)
+            staged[shard_id] = target
+            total_files += files_count
+            total_chunks += len(nodes)
+            nodes_in += dedup_stats["nodes_in"]
+            duplicates += dedup_stats["duplicates"]
+        if whole:
+            write_layout(build_root, num_shards, cfg.embed_dimension, cfg.embed_model)
+            write_version(build_root)
+    except BaseException:
+        if whole:
+            shutil.rmtree(build_root, ignore_errors=True)
+        else:
+            for target in staged.values():
+                if target is not None:
+                    shutil.rmtree(target, ignore_errors=True)
+        raise
+
+    # 切换前丢弃整个知识库的快照（缓存以知识库目录为键），旧快照不再持有待替换文件的 mmap
+    snapshot_cache.evict(cfg.index_dir)
+    if whole:
+        replace_dir(build_root, cfg.index_dir)
+    else:
+        for shard_id, target in staged.items():
+            final = shard_dir(cfg.index_dir, shard_id, num_shards)
+            if target is not None:
+                replace_dir(target, final)
+            elif final.exists():
+                shutil.rmtree(final)
+        # 已没有源文件的分片
+        for shard_id in range(num_shards):
+            stale = shard_dir(cfg.index_dir, shard_id, num_shards)
+            if shard_id not in plan and stale != cfg.index_dir and stale.exists():
+                shutil.rmtree(stale)
+        write_layout(cfg.index_dir, num_shards, cfg.embed_dimension, cfg.embed_model)
+        write_version(cfg.index_dir)
+    _refresh_catalog(base_cfg, kb)
+    if not total_chunks:
+        raise ValueError("RAW_DIR 中没有可用的课程资料")
+    return total_files, total_chunks, round(duplicates / nodes_in, 4) if nodes_in else 0.0
 
 
 def _context_budget_chars(settings: Settings) -> int:
@@ -88,17 +377,16 @@ def _context_budget_chars(settings: Settings) -> int:
     return settings.context_token_budget * CHAR_PER_TOKEN
 
 
-def _to_context_dict(node: BaseNode) -> dict:
-    """提取检索节点的关键信息（来源/页码/文本）。"""
-    metadata = node.metadata or {}
+def _to_context_dict(hit: dict) -> dict:
+    """提取检索命中的关键信息（来源/页码/文本）。"""
+    metadata = hit.get("metadata") or {}
     source = metadata.get("source") or metadata.get("file_name") or metadata.get("file_path") or "未知来源"
     page = metadata.get("page_label") or metadata.get("page") or metadata.get("slide")
     section = metadata.get("section")
-    text = node.get_content(metadata_mode="LLM") if hasattr(node, "get_content") else node.text
     return {
         "source": source,
         "page": page or section,
-        "text": text.strip(),
+        "text": (hit.get("text") or "").strip(),
     }
 
 
@@ -118,54 +406,222 @@ def _trim_contexts(contexts: list[dict], settings: Settings) -> list[dict]:
     return trimmed
 
 
+def _stable_order(contexts: list[dict]) -> list[dict]:
+    """按来源/页码/文本排序，使同一批片段无论召回顺序如何都拼出相同的提示前缀。"""
+    return sorted(contexts, key=lambda ctx: (str(ctx.get("source") or ""), str(ctx.get("page") or ""), ctx["text"]))
+
+
 def _build_context_prompt(contexts: list[dict]) -> str:
     """将片段组装为提示文本，带 [序号] 便于引用。"""
     lines = []
     for idx, ctx in enumerate(contexts, start=1):
-        lines.append(f"[{idx}] {ctx['text']}")
+        # 启用上下文压缩时使用压缩后的文本，编号不变
+        lines.append(f"[{ctx.get('ref', idx)}] {ctx.get('prompt_text', ctx['text'])}")
     return "\n".join(lines)
 
 
-def retrieve_and_answer(
+def _retrieve_for_answer(
     kb: str,
     question: str,
     top_k: int | None,
-    settings: Settings | None = None,
-) -> tuple[str, list[dict], int]:
-    """加载指定知识库索引→Top‑K 检索→上下文拼接→调用生成→返回答案与引用。"""
+    settings: Settings | None,
+    session_id: str | None,
+    deadline: Deadline,
+    filters: dict | None = None,
+) -> tuple[Settings, ChatSession | None, list[dict], str, float | None]:
+    """检索并准备生成所需的上下文：返回知识库配置、会话（可为空）、带编号的片段、提示文本与上下文压缩比。"""
     base_cfg = settings or get_settings()
     cfg = _with_kb(base_cfg, kb)
-    start = time.perf_counter()
+    # 查询向量必须与索引同维度
+    cfg.embed_dimension = _kb_dimension(cfg)
 
-    logger.info("收到提问：kb=%s, 问题=%s，Top-K=%s", kb, question, top_k)
+    logger.info("收到提问：kb=%s, 问题=%s，Top-K=%s，会话=%s", kb, question, top_k, session_id)
+    annotate(
+        kb=kb, top_k=top_k or cfg.similarity_top_k, question_chars=len(question), session=bool(session_id), filters=filters
+    )
+    session = get_session_store(cfg).get_or_create(session_id, kb) if session_id else None
+    # 追问往往省略主语，检索时拼上上一轮问题
+    previous = session.recent_history(1) if session else []
+    query = f"{previous[-1][0]}\n{question}" if previous else question
 
     # 使用全局 Settings 设置嵌入模型，避免已弃用的 ServiceContext
-    embed_model = get_embedding_model()
+    embed_model = get_embedding_model(cfg)
     LISettings.embed_model = embed_model
     contexts: list[dict]
     try:
-        index = load_persisted_index(cfg)
-        retriever = as_topk_retriever(index, top_k or cfg.similarity_top_k)
-        nodes = retriever.retrieve(question)
-        contexts = [_to_context_dict(node) for node in nodes]
+        with stage("embed"):
+            query_embedding = embed_queries([query], cfg)[0]
+        k = top_k or cfg.similarity_top_k
+        # 启用 MMR 时过量召回候选并取回存储向量，重排后最多保留 k 条
+        fetch = k * max(1, cfg.mmr_fetch_factor) if cfg.mmr_enabled else k
+        with stage("search"):
+            hits = search_shards(query, query_embedding, fetch, cfg, with_vectors=cfg.mmr_enabled, filters=filters)
+        if cfg.mmr_enabled or cfg.rerank_min_score > 0 or cfg.rerank_max_gap > 0:
+            with stage("rerank"):
+                candidates = len(hits)
+                hits = rerank_hits(query_embedding, hits, k, cfg)
+            annotate(candidates=candidates, selected=len(hits))
+        contexts = [_to_context_dict(hit) for hit in hits]
     except FileNotFoundError as exc:
+        if filters:
+            # 手动 FAISS 检索不读取倒排表，无法保证过滤语义
+            raise
         logger.warning("加载 LlamaIndex 索引失败，尝试手动 FAISS 检索：%s", exc)
-        contexts = _manual_faiss_retrieve(question, top_k or cfg.similarity_top_k, cfg)
-    # 控制总长度，避免超出生成模型可用的上下文窗口
-    contexts = _trim_contexts(contexts, cfg)
-    # 为每个上下文片段分配引用编号 ref，便于在回答中使用 [1][2]… 映射
-    for idx, ctx in enumerate(contexts, start=1):
-        ctx["ref"] = idx
+        with stage("search"):
+            contexts = _manual_faiss_retrieve(query, top_k or cfg.similarity_top_k, cfg)
+    deadline.check("检索")
+    with stage("prepare"):
+        # 控制总长度，避免超出生成模型可用的上下文窗口
+        contexts = _trim_contexts(contexts, cfg)
+        # 为每个上下文片段分配引用编号 ref，便于在回答中使用 [1][2]… 映射（会话模式下编号在会话内保持稳定）
+        if session is not None:
+            contexts = merge_session_contexts(session, contexts, _context_budget_chars(cfg))
+        else:
+            contexts = _stable_order(contexts)
+            for idx, ctx in enumerate(contexts, start=1):
+                ctx["ref"] = idx
+    compression_ratio = None
+    # 会话模式复用上下文以命中前缀缓存，不做按问题压缩
+    if cfg.context_compression and session is None and contexts:
+        with stage("compress"):
+            compression = compress_contexts(query, contexts, cfg)
+        compression_ratio = compression["ratio"]
+        logger.info(
+            "上下文压缩：%s → %s 字符（压缩比 %.2f）", compression["chars_in"], compression["chars_out"], compression_ratio
+        )
+    context_prompt = _build_context_prompt(contexts)
     logger.info("检索到上下文片段：%s 个（已按预算裁剪）", len(contexts))
+    annotate(contexts=len(contexts), prompt_chars=len(context_prompt), compression_ratio=compression_ratio)
 
     if not contexts:
+        if filters:
+            raise ValueError("没有满足过滤条件的片段，请检查 filters 中的来源文件名与页码范围")
         # 没有召回任何片段，通常是未建索引或语料缺失
         raise ValueError("索引中没有匹配到任何片段，请先 ingest")
+    return cfg, session, contexts, context_prompt, compression_ratio
+
+
+def _record_answer(cfg: Settings, session: ChatSession | None, question: str, answer: str, usage: dict) -> None:
+    """记录 token 用量，会话模式下追加本轮问答。"""
+    annotate(prompt_tokens=usage["prompt_tokens"], cache_hit_tokens=usage["cache_hit_tokens"])
+    if session is not None:
+        session.add_turn(question, answer, cfg.session_max_turns)
+    logger.info(
+        "生成完成：prompt_tokens=%s，缓存命中=%s，completion_tokens=%s",
+        usage["prompt_tokens"],
+        usage["cache_hit_tokens"],
+        usage["completion_tokens"],
+    )
 
-    context_prompt = _build_context_prompt(contexts)
-    generation = generate_answer(question, context_prompt, cfg)
+
+def retrieve_and_answer(
+    kb: str,
+    question: str,
+    top_k: int | None,
+    settings: Settings | None = None,
+    session_id: str | None = None,
+    deadline: Deadline | None = None,
+    filters: dict | None = None,
+) -> tuple[str, list[dict], int, dict]:
+    """加载指定知识库索引→Top‑K 检索→上下文拼接→调用生成→返回答案、引用、耗时与 token 用量。
+
+    指定 session_id 时进入会话模式：追问复用会话已召回的上下文（顺序与编号不变），
+    并携带历史问答，使请求前缀在多轮之间保持一致以命中供应商侧前缀缓存。
+    deadline 为端到端截止时间（默认按 REQUEST_DEADLINE_MS 从此刻起算）；
+    filters 限定检索范围（sources / page_from / page_to，见 postings.Postings.select）。
+    """
+    start = time.perf_counter()
+    deadline = deadline or Deadline((settings or get_settings()).request_deadline_ms)
+    cfg, session, contexts, context_prompt, compression_ratio = _retrieve_for_answer(
+        kb, question, top_k, settings, session_id, deadline, filters
+    )
+
+    history = session.recent_history(cfg.session_max_turns) if session else ()
+    with stage("generate"):
+        generation = generate_answer(question, context_prompt, cfg, history, deadline)
+    usage = {**generation["usage"], "compression_ratio": compression_ratio}
+    _record_answer(cfg, session, question, generation["answer"], usage)
     latency_ms = int((time.perf_counter() - start) * 1000)
-    return generation["answer"], contexts, max(latency_ms, generation["latency_ms"])
+    return generation["answer"], contexts, max(latency_ms, generation["latency_ms"]), usage
+
+
+def stream_retrieve_and_answer(
+    kb: str,
+    question: str,
+    top_k: int | None,
+    settings: Settings | None = None,
+    session_id: str | None = None,
+    deadline: Deadline | None = None,
+    filters: dict | None = None,
+) -> Iterator[dict]:
+    """retrieve_and_answer 的流式版本，依次产出事件：
+
+    - {"type": "contexts", "contexts": [...]}：检索完成后立即返回引用片段；
+    - {"type": "delta", "text": "..."}：模型增量输出；
+    - {"type": "done", "latency_ms": ..., "usage": {...}}：生成结束。
+    """
+    start = time.perf_counter()
+    deadline = deadline or Deadline((settings or get_settings()).request_deadline_ms)
+    cfg, session, contexts, context_prompt, compression_ratio = _retrieve_for_answer(
+        kb, question, top_k, settings, session_id, deadline, filters
+    )
+    yield {"type": "contexts", "contexts": [{k: v for k, v in ctx.items() if k != "prompt_text"} for ctx in contexts]}
+
+    history = session.recent_history(cfg.session_max_turns) if session else ()
+    parts: list[str] = []
+    usage: dict = {}
+    for event in stream_answer(question, context_prompt, cfg, history, deadline):
+        if event["type"] == "delta":
+            parts.append(event["text"])
+            yield event
+        else:
+            usage = {**event["usage"], "compression_ratio": compression_ratio}
+    _record_answer(cfg, session, question, "".join(parts).strip(), usage)
+    yield {"type": "done", "latency_ms": int((time.perf_counter() - start) * 1000), "usage": usage}
+
+
+def _to_retrieved_item(hit: dict, rank: int) -> dict:
+    """检索命中 → 对外条目：L2 距离换算为相似度（单位向量下 1 - d²/2 即余弦相似度）。"""
+    ctx = _to_context_dict(hit)
+    distance = float(hit.get("distance", float("inf")))
+    return {
+        "rank": rank,
+        "node_id": hit.get("node_id"),
+        "score": round(1.0 - distance / 2.0, 6) + 0.0,  # 避免出现 -0.0
+        "distance": round(distance, 6),
+        "source": str(ctx["source"]),
+        "page": str(ctx["page"]) if ctx["page"] is not None else None,
+        "text": ctx["text"],
+        "metadata": hit.get("metadata") or {},
+    }
+
+
+def retrieve_chunks(
+    kb: str,
+    queries: Sequence[str],
+    limit: int,
+    offset: int = 0,
+    settings: Settings | None = None,
+    filters: dict | None = None,
+) -> tuple[str, list[list[dict]]]:
+    """仅检索不生成：返回 (索引版本戳, 每个查询第 offset 起的 limit 条命中)。
+
+    查询向量批量计算并缓存；各查询在全部分片上检索 offset+limit 条后截取当前页。
+    """
+    base_cfg = settings or get_settings()
+    cfg = _with_kb(base_cfg, kb)
+    cfg.embed_dimension = _kb_dimension(cfg)
+    version = read_version(cfg.index_dir)
+    annotate(kb=kb, top_k=limit, offset=offset, queries=len(queries), filters=filters)
+
+    with stage("embed"):
+        vectors = embed_queries(list(queries), cfg)
+    results: list[list[dict]] = []
+    with stage("search"):
+        for query, vector in zip(queries, vectors):
+            hits = search_shards(query, vector, offset + limit, cfg, filters=filters)[offset:]
+            results.append([_to_retrieved_item(hit, offset + i) for i, hit in enumerate(hits, start=1)])
+    return version, results
 
 
 def _manual_faiss_retrieve(question: str, top_k: int, settings: Settings) -> list[dict]:
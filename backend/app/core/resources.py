@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import sys
+from typing import Optional
+
+from .settings import Settings
+
+try:  # 可选依赖：跨平台读取 RSS（Windows 桌面端建议安装）
+    import psutil  # type: ignore
+except ImportError:  # pragma: no cover - 未安装时退回 /proc
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+def process_rss() -> Optional[int]:
+    """当前进程常驻内存（字节）；优先 psutil，其次 Linux /proc/self/statm，均不可用时返回 None。"""
+    if psutil is not None:
+        try:
+            return int(psutil.Process().memory_info().rss)
+        except Exception:  # pragma: no cover - 受限环境下读取失败
+            return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def rss_source() -> Optional[str]:
+    if psutil is not None:
+        return "psutil"
+    return "procfs" if os.path.exists("/proc/self/statm") else None
+
+
+_libc = None
+if sys.platform.startswith("linux"):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+    except OSError:  # pragma: no cover
+        _libc = None
+
+
+def release_memory() -> None:
+    """卸载索引后回收内存：先跑一轮 GC 释放 LlamaIndex/FAISS 对象的循环引用，
+    glibc 下再用 malloc_trim 把空闲堆页归还操作系统（否则 RSS 不会下降）。"""
+    gc.collect()
+    if _libc is not None and hasattr(_libc, "malloc_trim"):
+        _libc.malloc_trim(0)
+
+
+def install_resource_reaper(app, settings: Settings, cache) -> None:
+    """启用 KB_IDLE_UNLOAD_SECONDS 或 MEMORY_BUDGET_MB 时，在应用生命周期内运行后台回收任务：
+    定期卸载空闲知识库，并在 RSS 超出预算时按最久未用顺序卸载。"""
+    idle = settings.kb_idle_unload_seconds
+    budget = settings.memory_budget_mb * 1024 * 1024
+    if idle <= 0 and budget <= 0:
+        return
+    interval = max(1, settings.resource_check_seconds)
+    if idle > 0:
+        interval = min(interval, max(1, idle // 2))
+
+    def sweep() -> None:
+        if idle > 0:
+            cache.unload_idle(idle)
+        if budget > 0:
+            cache.shrink_to(budget, process_rss)
+
+    async def loop() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # GC 与 malloc_trim 可能耗时数十毫秒，放到线程中执行
+                await asyncio.to_thread(sweep)
+            except Exception:  # pragma: no cover - 回收失败不影响服务
+                logger.exception("资源回收失败")
+
+    state: dict = {}
+
+    @app.on_event("startup")
+    async def _start_reaper() -> None:
+        state["task"] = asyncio.create_task(loop())
+
+    @app.on_event("shutdown")
+    async def _stop_reaper() -> None:
+        task = state.pop("task", None)
+        if task is not None:
+            task.cancel()
@@ -1,8 +1,78 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
 from llama_index.core import VectorStoreIndex
 
+from .settings import Settings
+
 
 def as_topk_retriever(index: VectorStoreIndex, top_k: int):
     """返回按相似度召回的 Top-K 检索器。"""
 
     top_k = max(1, top_k)
     return index.as_retriever(similarity_top_k=top_k)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def mmr_select(query_embedding: Sequence[float], vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """最大边际相关（MMR）：每步选取 λ·相关度 − (1−λ)·与已选结果的最大相似度 最高的候选。
+
+    相关度与两两相似度均为余弦，一次矩阵乘法算出，逐步选择时只做向量化的 max/argmax。
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    selected: List[int] = []
+    for _ in range(min(k, len(vectors))):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def adaptive_cut(scores: Sequence[float], min_score: float, max_gap: float, min_k: int = 1) -> int:
+    """按相似度降序的得分自适应截断，返回保留条数。
+
+    - 低于 min_score（绝对阈值）的结果丢弃；
+    - 相邻两条的相对落差 (前 − 后) / 前 超过 max_gap 时，从落差处截断；
+    两个条件均为 0 时不生效，至少保留 min_k 条。
+    """
+    keep = len(scores)
+    for i, score in enumerate(scores):
+        if i < min_k:
+            continue
+        if min_score and score < min_score:
+            keep = i
+            break
+        previous = scores[i - 1]
+        if max_gap and previous > 0 and (previous - score) / previous > max_gap:
+            keep = i
+            break
+    return max(min(min_k, len(scores)), keep)
+
+
+def rerank_hits(query_embedding: Sequence[float], hits: List[dict], top_k: int, settings: Settings) -> List[dict]:
+    """对过量召回的候选先做自适应截断，再用存储向量做 MMR 去冗余，最多返回 top_k 条。
+
+    hits 需按距离升序；相似度取 1 − d/2（单位向量下即余弦相似度）。缺少存储向量时（旧格式分片）只截断。
+    """
+    if not hits:
+        return hits
+    scores = [1.0 - hit["distance"] / 2.0 for hit in hits]
+    keep = adaptive_cut(scores, settings.rerank_min_score, settings.rerank_max_gap, settings.rerank_min_k)
+    candidates = hits[:keep]
+    if not settings.mmr_enabled or any(hit.get("vector") is None for hit in candidates):
+        return candidates[:top_k]
+    vectors = np.stack([hit["vector"] for hit in candidates])
+    return [candidates[i] for i in mmr_select(query_embedding, vectors, top_k, settings.mmr_lambda)]
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .postings import Postings
+
+ROUTING_VECTORS = "routing.npy"
+ROUTING_SOURCES = "routing.json"
+
+
+def build_routing(vectors: np.ndarray, postings: Postings) -> Tuple[List[str], np.ndarray]:
+    """文档级路由向量：每个来源文件取其全部切片向量的均值并归一化（去重合并到别处的切片也计入）。"""
+    sources = postings.sources()
+    matrix = np.zeros((len(sources), vectors.shape[1] if vectors.ndim == 2 else 0), dtype="float32")
+    for i, source in enumerate(sources):
+        positions = postings.select({"sources": [source]})
+        if len(positions):
+            mean = vectors[positions].mean(axis=0)
+            matrix[i] = mean / (np.linalg.norm(mean) or 1.0)
+    return sources, matrix
+
+
+def write_routing(directory: Path, sources: List[str], matrix: np.ndarray) -> None:
+    np.save(directory / ROUTING_VECTORS, np.ascontiguousarray(matrix, dtype="float32"))
+    (directory / ROUTING_SOURCES).write_text(json.dumps(sources, ensure_ascii=False), encoding="utf-8")
+
+
+def read_routing(directory: Path) -> Optional[Tuple[List[str], np.ndarray]]:
+    """读取入库时写出的路由向量；文件缺失或不完整时返回 None。"""
+    try:
+        sources = json.loads((directory / ROUTING_SOURCES).read_text(encoding="utf-8"))
+        matrix = np.load(directory / ROUTING_VECTORS)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(sources, list) or matrix.ndim != 2 or matrix.shape[0] != len(sources):
+        return None
+    return [str(s) for s in sources], matrix.astype("float32", copy=False)
+
+
+def top_documents(
+    matrix: np.ndarray, query_embedding, top_m: int, candidates: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """按余弦相似度选出前 top_m 个文档的行号（candidates 为可选的布尔掩码，限定候选文档）。"""
+    q = np.asarray(query_embedding, dtype="float32")
+    scores = matrix @ (q / (np.linalg.norm(q) or 1.0))
+    if candidates is not None:
+        scores = np.where(candidates, scores, -np.inf)
+    m = min(top_m, int(np.isfinite(scores).sum()))
+    if m <= 0:
+        return np.empty(0, dtype="int64")
+    top = np.argpartition(-scores, m - 1)[:m]
+    return top[np.argsort(-scores[top], kind="stable")]
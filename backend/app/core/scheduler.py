@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from .deadline import Deadline
+from .settings import Settings, get_settings
+
+# 优先级从高到低：交互问答 > 批量问答/检索 > 入库
+INTERACTIVE = "interactive"
+BATCH = "batch"
+INGEST = "ingest"
+PRIORITIES = (INTERACTIVE, BATCH, INGEST)
+
+
+class Overloaded(Exception):
+    """队列已满或排队超时；由 API 层转换为 429 + Retry-After。"""
+
+    def __init__(self, priority: str, retry_after: int, reason: str):
+        super().__init__(f"服务繁忙（{priority}：{reason}），请 {retry_after} 秒后重试")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _ClassState:
+    def __init__(self, queue_limit: int):
+        self.queue_limit = queue_limit
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.waits: Deque[float] = deque(maxlen=500)
+        # 单个请求占用执行槽的平均时长（秒，指数滑动平均），用于估算 Retry-After
+        self.service_ewma = 1.0
+
+
+class Scheduler:
+    """进程内准入调度：所有请求共用 capacity 个执行槽。
+
+    - 严格优先级：空出的槽位总是先分给排队中的更高优先级请求；
+    - 为交互请求预留 reserved 个槽位，批量与入库请求最多使用 capacity - reserved 个，
+      入库另受 ingest_limit 限制，大规模重建不会占满处理能力；
+    - 每个优先级的排队长度有上限，排满或排队超时即拒绝（Overloaded），而不是让延迟无限增长。
+    """
+
+    def __init__(
+        self, capacity: int, reserved: int, ingest_limit: int, queue_limits: Dict[str, int], queue_timeout: float
+    ):
+        self.capacity = capacity
+        self.reserved = min(max(0, reserved), max(0, capacity - 1))
+        self.ingest_limit = max(1, ingest_limit)
+        self.queue_timeout = queue_timeout
+        self._classes = {name: _ClassState(max(0, queue_limits.get(name, 0))) for name in PRIORITIES}
+
+    def _running(self) -> int:
+        return sum(state.running for state in self._classes.values())
+
+    def _can_run(self, priority: str) -> bool:
+        running = self._running()
+        if running >= self.capacity:
+            return False
+        if priority == INTERACTIVE:
+            return True
+        if running >= self.capacity - self.reserved:
+            return False
+        return priority != INGEST or self._classes[INGEST].running < self.ingest_limit
+
+    def _ahead(self, priority: str) -> bool:
+        """是否有同级或更高优先级的请求在排队（新请求不能插队）。"""
+        for name in PRIORITIES:
+            if self._classes[name].waiters:
+                return True
+            if name == priority:
+                return False
+        return False
+
+    def _retry_after(self, priority: str) -> int:
+        state = self._classes[priority]
+        slots = self.capacity if priority == INTERACTIVE else max(1, self.capacity - self.reserved)
+        if priority == INGEST:
+            slots = min(slots, self.ingest_limit)
+        return max(1, math.ceil(state.service_ewma * (len(state.waiters) + 1) / slots))
+
+    def _dispatch(self) -> None:
+        for name in PRIORITIES:
+            state = self._classes[name]
+            while state.waiters and self._can_run(name):
+                waiter = state.waiters.popleft()
+                if waiter.done():
+                    continue
+                # 槽位在唤醒前即记入，避免被新到达的请求抢走
+                state.running += 1
+                waiter.set_result(None)
+
+    @staticmethod
+    def _abandon(state: _ClassState, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            state.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    async def acquire(self, priority: str, deadline: Deadline | None = None) -> float:
+        """获取执行槽，返回获取时刻（供 release 统计占用时长）。"""
+        state = self._classes[priority]
+        start = time.monotonic()
+        if not self._ahead(priority) and self._can_run(priority):
+            state.running += 1
+        else:
+            if len(state.waiters) >= state.queue_limit:
+                state.rejected += 1
+                raise Overloaded(priority, self._retry_after(priority), "排队已满")
+            waiter = asyncio.get_running_loop().create_future()
+            state.waiters.append(waiter)
+            timeout = self.queue_timeout
+            remaining = deadline.remaining() if deadline is not None else None
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                # 超时与分配同时发生时按已获得处理
+                if not waiter.done():
+                    self._abandon(state, waiter)
+                    state.timeouts += 1
+                    raise Overloaded(priority, self._retry_after(priority), "排队超时") from None
+            except asyncio.CancelledError:
+                # 客户端断开：已分配的槽位需要归还
+                if waiter.done():
+                    state.running -= 1
+                    self._dispatch()
+                else:
+                    self._abandon(state, waiter)
+                raise
+        state.admitted += 1
+        acquired = time.monotonic()
+        state.waits.append(acquired - start)
+        return acquired
+
+    def release(self, priority: str, acquired: float) -> None:
+        state = self._classes[priority]
+        state.running -= 1
+        state.service_ewma = 0.8 * state.service_ewma + 0.2 * (time.monotonic() - acquired)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str, deadline: Deadline | None = None) -> AsyncIterator[None]:
+        acquired = await self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(priority, acquired)
+
+    def stats(self) -> dict:
+        result: dict = {"capacity": self.capacity, "reserved_interactive": self.reserved}
+        for name, state in self._classes.items():
+            waits = sorted(state.waits)
+
+            def pct(p: float) -> float | None:
+                if not waits:
+                    return None
+                return round(waits[min(len(waits) - 1, int(p / 100 * (len(waits) - 1) + 0.5))] * 1000, 1)
+
+            result[name] = {
+                "running": state.running,
+                "queued": len(state.waiters),
+                "queue_limit": state.queue_limit,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "timeouts": state.timeouts,
+                "wait_p50_ms": pct(50),
+                "wait_p95_ms": pct(95),
+            }
+        return result
+
+
+class _Unlimited:
+    """SCHEDULER_CAPACITY=0 时不做准入控制。"""
+
+    async def acquire(self, priority: str, deadline: Deadline | None = None) -> float:
+        return time.monotonic()
+
+    def release(self, priority: str, acquired: float) -> None:
+        pass
+
+    @asynccontextmanager
+    async def slot(self, priority: str, deadline: Deadline | None = None) -> AsyncIterator[None]:
+        yield
+
+    def stats(self) -> dict:
+        return {"capacity": 0}
+
+
+_scheduler: Scheduler | _Unlimited | None = None
+
+
+def get_scheduler(settings: Settings | None = None) -> Scheduler | _Unlimited:
+    """进程级单例（只在事件循环线程中使用，无需加锁）。"""
+    global _scheduler
+    if _scheduler is None:
+        cfg = settings or get_settings()
+        if cfg.scheduler_capacity <= 0:
+            _scheduler = _Unlimited()
+        else:
+            _scheduler = Scheduler(
+                capacity=cfg.scheduler_capacity,
+                reserved=cfg.scheduler_interactive_reserved,
+                ingest_limit=cfg.scheduler_ingest_limit,
+                queue_limits={
+                    INTERACTIVE: cfg.scheduler_queue_interactive,
+                    BATCH: cfg.scheduler_queue_batch,
+                    INGEST: cfg.scheduler_queue_ingest,
+                },
+                queue_timeout=cfg.scheduler_queue_timeout_ms / 1000,
+            )
+    return _scheduler
+
+
+def request_priority(header: str | None, default: str) -> str:
+    """请求头 X-Priority: batch 可把问答/检索降为批量优先级（不能提升）。"""
+    if header and header.strip().lower() == BATCH and default == INTERACTIVE:
+        return BATCH
+    return default
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .settings import Settings
+
+
+@dataclass
+class ChatSession:
+    """会话状态：所属知识库、已累积的上下文（顺序固定、只追加）与历史问答。
+
+    同一会话的并发请求通过 lock 串行读写状态；refs 记录片段文本 → 引用编号，编号在会话内不复用。
+    """
+
+    session_id: str
+    kb: str
+    contexts: List[dict] = field(default_factory=list)
+    history: List[tuple[str, str]] = field(default_factory=list)
+    refs: Dict[str, int] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def recent_history(self, turns: int) -> List[tuple[str, str]]:
+        with self.lock:
+            return list(self.history[-turns:]) if turns > 0 else []
+
+    def add_turn(self, question: str, answer: str, max_turns: int) -> None:
+        with self.lock:
+            self.history.append((question, answer))
+            del self.history[:-max_turns]
+
+
+class SessionStore:
+    """进程内会话存储：LRU + 空闲过期，线程安全。"""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: int = 1800):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: str, kb: str) -> ChatSession:
+        now = time.time()
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None and (session.kb != kb or now - session.updated_at > self.ttl_seconds):
+                session = None
+            if session is None:
+                session = ChatSession(session_id=session_id, kb=kb)
+            session.updated_at = now
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+
+_store: SessionStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_session_store(settings: Settings) -> SessionStore:
+    """进程级单例会话存储。"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(
+                max_sessions=settings.session_max_sessions,
+                ttl_seconds=settings.session_ttl_seconds,
+            )
+        return _store
+
+
+def merge_session_contexts(session: ChatSession, new_contexts: List[dict], max_chars: int) -> List[dict]:
+    """把新召回的片段追加到会话上下文之后，保持已有片段的顺序与编号不变，返回带 ref 的片段副本。
+
+    已有片段构成稳定前缀，供应商侧前缀缓存可以命中；若追加后超出长度预算，
+    则以本轮召回结果重置会话上下文（仅本轮缓存失效）。编号按片段文本分配、重置后也不改变：
+    仍保留的片段沿用原编号，新片段继续向后编号，历史回答中的 [n] 始终指向同一片段。
+    """
+    with session.lock:
+        seen = {ctx["text"] for ctx in session.contexts}
+        additions = [ctx for ctx in new_contexts if ctx["text"] not in seen]
+        merged = session.contexts + additions
+        if sum(len(ctx["text"]) for ctx in merged) > max_chars:
+            merged = list(new_contexts)
+        numbered = []
+        for ctx in merged:
+            ref = session.refs.get(ctx["text"])
+            if ref is None:
+                ref = session.refs[ctx["text"]] = len(session.refs) + 1
+            numbered.append({**ctx, "ref": ref})
+        session.contexts = numbered
+        return [dict(ctx) for ctx in numbered]
@@ -1,6 +1,8 @@
 from functools import lru_cache
 from pathlib import Path
-from pydantic import Field
+from typing import Optional
+
+from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
 
@@ -27,15 +29,94 @@ class Settings(BaseSettings):
     deepseek_base_url: str = Field(default="https://api.deepseek.com", env="DEEPSEEK_BASE_URL")
     # 嵌入（仅使用通义千问 Qwen / DashScope）
     embed_model: str = Field(default="text-embedding-v4", env="EMBED_MODEL")
-    embed_dimension: int = Field(default=1024)
+    # 新建知识库的默认嵌入维度（v3/v4 可降至 512/256 等）；已有知识库沿用索引中记录的维度
+    embed_dimension: int = Field(default=1024, env="EMBED_DIMENSION")
     qwen_api_key: str = Field(default="", env="QWEN_API_KEY")
     index_dir: Path = Field(default=Path("./data/index"), env="INDEX_DIR")
+    # 知识库分片数（按源文件哈希划分，各分片独立构建、并行检索）；1 表示不分片
+    index_shards: int = Field(default=1, env="INDEX_SHARDS")
+    shard_search_workers: int = Field(default=4, env="SHARD_SEARCH_WORKERS")
+    # 以只读 mmap 打开 faiss.index / nodes.bin，多个 worker 进程共享操作系统页缓存
+    index_mmap: bool = Field(default=True, env="INDEX_MMAP")
     raw_dir: Path = Field(default=Path("./data/raw"), env="RAW_DIR")
+    # 知识库目录（SQLite）路径，留空时为 RAW_DIR/_kb_catalog.db
+    catalog_path: Optional[Path] = Field(default=None, env="CATALOG_PATH")
+    # 文档解析缓存（按文件内容哈希，跨重建/知识库复用）目录与容量上限（MB，0 关闭）
+    doc_cache_dir: Path = Field(default=Path("./data/doc_cache"), env="DOC_CACHE_DIR")
+    doc_cache_max_mb: int = Field(default=512, env="DOC_CACHE_MAX_MB")
     chunk_size: int = Field(default=1000)
     chunk_overlap: int = Field(default=120)
+    # 切分器：sentence（LlamaIndex SentenceSplitter）或 chinese（中文句读单遍切分）
+    text_splitter: str = Field(default="sentence", env="TEXT_SPLITTER")
+    # 入库近重复检测（MinHash + LSH）：Jaccard 估计 ≥ 阈值的切片只保留一份
+    dedup_enabled: bool = Field(default=True, env="DEDUP_ENABLED")
+    dedup_threshold: float = Field(default=0.9, env="DEDUP_THRESHOLD")
     similarity_top_k: int = Field(default=6)
+    # 重排：MMR 去冗余（过量召回 top_k × MMR_FETCH_FACTOR 个候选，λ 越大越偏重相关度）
+    mmr_enabled: bool = Field(default=False, env="MMR_ENABLED")
+    mmr_lambda: float = Field(default=0.7, env="MMR_LAMBDA")
+    mmr_fetch_factor: int = Field(default=3, env="MMR_FETCH_FACTOR")
+    # 自适应 top‑k：相似度低于阈值或相邻相对落差超过 RERANK_MAX_GAP 时截断（0 关闭），至少保留 RERANK_MIN_K 条
+    rerank_min_score: float = Field(default=0.0, env="RERANK_MIN_SCORE")
+    rerank_max_gap: float = Field(default=0.0, env="RERANK_MAX_GAP")
+    rerank_min_k: int = Field(default=1, env="RERANK_MIN_K")
+    # 两阶段检索：先按文档级路由向量选出前 ROUTING_TOP_DOCS 个来源文件，再只在其切片中检索（0 关闭）；
+    # 来源文件数不足 ROUTING_MIN_DOCS 的知识库直接全量检索
+    routing_top_docs: int = Field(default=0, env="ROUTING_TOP_DOCS")
+    routing_min_docs: int = Field(default=100, env="ROUTING_MIN_DOCS")
+    # 准入调度：全部请求共用 SCHEDULER_CAPACITY 个执行槽（0 关闭），其中为交互问答预留若干个；
+    # 入库最多同时执行 SCHEDULER_INGEST_LIMIT 个；各优先级排队上限与最长排队时间，超出即返回 429
+    scheduler_capacity: int = Field(default=16, env="SCHEDULER_CAPACITY")
+    scheduler_interactive_reserved: int = Field(default=4, env="SCHEDULER_INTERACTIVE_RESERVED")
+    scheduler_ingest_limit: int = Field(default=1, env="SCHEDULER_INGEST_LIMIT")
+    scheduler_queue_interactive: int = Field(default=64, env="SCHEDULER_QUEUE_INTERACTIVE")
+    scheduler_queue_batch: int = Field(default=32, env="SCHEDULER_QUEUE_BATCH")
+    scheduler_queue_ingest: int = Field(default=4, env="SCHEDULER_QUEUE_INGEST")
+    scheduler_queue_timeout_ms: int = Field(default=30000, env="SCHEDULER_QUEUE_TIMEOUT_MS")
+    # 资源回收（桌面端默认开启）：知识库索引空闲 KB_IDLE_UNLOAD_SECONDS 秒后卸载，下次检索时按 mmap 重新打开（0 不卸载）；
+    # 进程常驻内存超过 MEMORY_BUDGET_MB 时按最久未用顺序卸载其他知识库（0 不限制）；后台每 RESOURCE_CHECK_SECONDS 秒检查一次
+    kb_idle_unload_seconds: int = Field(default=0, env="KB_IDLE_UNLOAD_SECONDS")
+    memory_budget_mb: int = Field(default=0, env="MEMORY_BUDGET_MB")
+    resource_check_seconds: int = Field(default=30, env="RESOURCE_CHECK_SECONDS")
+    # /retrieve 翻页可达的最大深度（offset + top_k）
+    retrieve_max_depth: int = Field(default=200, env="RETRIEVE_MAX_DEPTH")
     context_token_budget: int = Field(default=2500)
+    # 抽取式上下文压缩：每个片段保留与问题最相关的 N 句及前后相邻句（短于 COMPRESS_MIN_CHARS 的片段不压缩）
+    context_compression: bool = Field(default=False, env="CONTEXT_COMPRESSION")
+    compress_top_sentences: int = Field(default=3, env="COMPRESS_TOP_SENTENCES")
+    compress_neighbors: int = Field(default=1, env="COMPRESS_NEIGHBORS")
+    compress_min_chars: int = Field(default=300, env="COMPRESS_MIN_CHARS")
     request_timeout: int = Field(default=60)
+    # 端到端截止时间（毫秒，贯穿检索与生成，0 表示只受 request_timeout 约束）
+    request_deadline_ms: int = Field(default=0, env="REQUEST_DEADLINE_MS")
+    # 对冲请求：主请求超过近期首 token 延迟的 HEDGE_PERCENTILE 分位仍无输出时再发一路（样本不足时用 HEDGE_DELAY_MS）
+    hedge_enabled: bool = Field(default=False, env="HEDGE_ENABLED")
+    hedge_percentile: float = Field(default=95.0, env="HEDGE_PERCENTILE")
+    hedge_delay_ms: int = Field(default=3000, env="HEDGE_DELAY_MS")
+    # 后备模型/地址（留空则不启用）：距截止不足 FALLBACK_RESERVE_MS 或主请求失败时使用
+    fallback_model: str = Field(default="", env="FALLBACK_MODEL")
+    fallback_base_url: str = Field(default="", env="FALLBACK_BASE_URL")
+    fallback_api_key: str = Field(default="", env="FALLBACK_API_KEY")
+    fallback_reserve_ms: int = Field(default=8000, env="FALLBACK_RESERVE_MS")
+    # 请求剖析：允许通过 X-Profile 请求头触发采样、按比例抽样、采样间隔与慢请求阈值（毫秒，0 关闭）
+    profile_allow_header: bool = Field(default=False, env="PROFILE_ALLOW_HEADER")
+    # 非空时 X-Profile 请求头的值须与之一致才触发采样（对外暴露的部署建议设置）
+    profile_token: str = Field(default="", env="PROFILE_TOKEN")
+    profile_sample_rate: float = Field(default=0.0, env="PROFILE_SAMPLE_RATE")
+    profile_interval_ms: int = Field(default=5, env="PROFILE_INTERVAL_MS")
+    slow_request_ms: int = Field(default=3000, env="SLOW_REQUEST_MS")
+    # 会话模式（/ask 携带 session_id）：保留的历史轮数、会话空闲过期时间与最大会话数
+    session_max_turns: int = Field(default=6)
+    session_ttl_seconds: int = Field(default=1800)
+    session_max_sessions: int = Field(default=1000)
+    # 合并进行中的相同提问（同一知识库版本、归一化后相同的问题与 Top‑K），只检索/生成一次
+    coalesce_requests: bool = Field(default=True, env="COALESCE_REQUESTS")
+
+    @field_validator("catalog_path", mode="before")
+    @classmethod
+    def _empty_path_as_none(cls, value):
+        # CATALOG_PATH= 留空表示使用默认位置，而不是当前目录
+        return value or None
 
     # 兼容 v1 风格的 Config 写法已迁移至 model_config
 
@@ -57,8 +138,13 @@ def get_settings() -> Settings:
         settings.index_dir = (BACKEND_DIR / settings.index_dir).resolve()
     if not settings.raw_dir.is_absolute():
         settings.raw_dir = (BACKEND_DIR / settings.raw_dir).resolve()
+    if not settings.doc_cache_dir.is_absolute():
+        settings.doc_cache_dir = (BACKEND_DIR / settings.doc_cache_dir).resolve()
+    if settings.catalog_path is not None and not settings.catalog_path.is_absolute():
+        settings.catalog_path = (BACKEND_DIR / settings.catalog_path).resolve()
 
-    # 确保目录存在：FAISS 持久化目录与原始资料目录
+    # 确保目录存在：FAISS 持久化目录、原始资料目录与解析缓存目录
     settings.index_dir.mkdir(parents=True, exist_ok=True)
     settings.raw_dir.mkdir(parents=True, exist_ok=True)
+    settings.doc_cache_dir.mkdir(parents=True, exist_ok=True)
     return settings
@@ -0,0 +1,569 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import QueryBundle
+
+from .index import load_persisted_index, read_faiss_index
+from .nodestore import NodeStore, has_node_store
+from .postings import POSTINGS_JSON, Postings, build_postings, write_postings
+from .profiling import annotate
+from .resources import process_rss, release_memory
+from .retriever import as_topk_retriever
+from .routing import build_routing, read_routing, top_documents, write_routing
+from .settings import Settings
+
+SUPPORTED_EXTS = [".pdf", ".pptx", ".md"]
+LAYOUT_FILENAME = "shards.json"
+SHARD_MANIFEST = "shard.json"
+VERSION_FILENAME = "VERSION"
+
+logger = logging.getLogger(__name__)
+
+
+def list_source_files(raw_dir: Path) -> List[Path]:
+    """递归列出知识库原始目录下可解析的文件（按相对路径排序，保证分片结果稳定）。"""
+    if not raw_dir.exists():
+        return []
+    files = [p for p in raw_dir.rglob("*") if p.is_file() and p.suffix.lower() in SUPPORTED_EXTS]
+    return sorted(files, key=lambda p: p.relative_to(raw_dir).as_posix())
+
+
+def shard_of(rel_path: str, num_shards: int) -> int:
+    """按源文件相对路径哈希分配分片：同一文件始终落在同一分片。"""
+    return zlib.crc32(rel_path.encode("utf-8")) % max(1, num_shards)
+
+
+def shard_dir(index_dir: Path, shard_id: int, num_shards: int) -> Path:
+    """单分片时沿用原有平铺布局（索引文件直接位于 INDEX_DIR/kb）。"""
+    if num_shards <= 1:
+        return index_dir
+    return index_dir / f"shard-{shard_id:03d}"
+
+
+def plan_shards(raw_dir: Path, num_shards: int) -> Dict[int, List[Path]]:
+    """把原始文件分配到各分片。"""
+    plan: Dict[int, List[Path]] = {}
+    for path in list_source_files(raw_dir):
+        plan.setdefault(shard_of(path.relative_to(raw_dir).as_posix(), num_shards), []).append(path)
+    return plan
+
+
+def shard_fingerprint(files: List[Path], raw_dir: Path, settings: Settings) -> str:
+    """分片指纹：文件清单（路径/大小/修改时间）+ 影响切分与嵌入的配置；指纹不变则无需重建。"""
+    digest = hashlib.sha1()
+    for path in files:
+        stat = path.stat()
+        digest.update(f"{path.relative_to(raw_dir).as_posix()}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    digest.update(
+        "|".join(
+            str(v)
+            for v in (
+                settings.text_splitter,
+                settings.chunk_size,
+                settings.chunk_overlap,
+                settings.dedup_enabled,
+                settings.dedup_threshold,
+                settings.embed_model,
+                settings.embed_dimension,
+            )
+        ).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def read_shard_manifest(directory: Path) -> dict:
+    return _read_json(directory / SHARD_MANIFEST)
+
+
+def write_shard_manifest(directory: Path, manifest: dict) -> None:
+    (directory / SHARD_MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def read_layout(index_dir: Path) -> int:
+    """读取知识库的分片数；无布局文件即为单分片（平铺布局）。"""
+    return int(_read_json(index_dir / LAYOUT_FILENAME).get("num_shards") or 1)
+
+
+def read_kb_dimension(index_dir: Path) -> int | None:
+    """读取知识库索引记录的嵌入维度；早期索引未记录时返回 None。"""
+    dimension = _read_json(index_dir / LAYOUT_FILENAME).get("embed_dimension")
+    if not dimension:
+        dimension = read_shard_manifest(index_dir).get("embed_dimension")
+    return int(dimension) if dimension else None
+
+
+def read_kb_embed_model(index_dir: Path) -> str | None:
+    """读取构建知识库索引时使用的嵌入模型；早期索引未记录时返回 None。"""
+    return _read_json(index_dir / LAYOUT_FILENAME).get("embed_model") or None
+
+
+def write_layout(
+    index_dir: Path, num_shards: int, embed_dimension: int | None = None, embed_model: str | None = None
+) -> None:
+    path = index_dir / LAYOUT_FILENAME
+    if num_shards <= 1 and not embed_dimension and not embed_model:
+        path.unlink(missing_ok=True)
+        return
+    layout: dict = {"num_shards": num_shards}
+    if embed_dimension:
+        layout["embed_dimension"] = int(embed_dimension)
+    if embed_model:
+        layout["embed_model"] = embed_model
+    path.write_text(json.dumps(layout), encoding="utf-8")
+
+
+def list_shard_dirs(index_dir: Path) -> List[Path]:
+    """列出知识库现有的分片目录（跳过尚未构建或已清空的分片）。"""
+    num_shards = read_layout(index_dir)
+    if num_shards <= 1:
+        return [index_dir]
+    dirs = [shard_dir(index_dir, i, num_shards) for i in range(num_shards)]
+    return [d for d in dirs if d.exists() and any(d.iterdir())]
+
+
+def write_version(index_dir: Path) -> str:
+    """写入知识库版本戳（原子替换）；各工作进程据此发现新快照。"""
+    version = str(time.time_ns())
+    tmp = index_dir / f"{VERSION_FILENAME}.{os.getpid()}.tmp"
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, index_dir / VERSION_FILENAME)
+    return version
+
+
+_kb_locks: Dict[str, threading.Lock] = {}
+_kb_locks_guard = threading.Lock()
+
+
+def kb_lock(index_dir: Path) -> threading.Lock:
+    """知识库级写锁（进程内）：入库、导入与删除同一知识库的操作串行执行，
+    不依赖准入调度的并发限制（SCHEDULER_CAPACITY=0 或入库并发大于 1 时同样安全）。"""
+    key = str(Path(index_dir).resolve())
+    with _kb_locks_guard:
+        lock = _kb_locks.get(key)
+        if lock is None:
+            lock = _kb_locks[key] = threading.Lock()
+        return lock
+
+
+def replace_dir(staging: Path, target: Path) -> None:
+    """用完整构建好的暂存目录替换目标目录：两次 rename 完成切换，旧目录随后删除。"""
+    retired = target.parent / f".{target.name}.old-{time.time_ns()}"
+    if target.exists():
+        os.replace(target, retired)
+    os.replace(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def read_version(index_dir: Path) -> str:
+    """读取版本戳：每个请求一次小文件读取；旧索引没有版本戳时退化为目录修改时间。"""
+    try:
+        return (index_dir / VERSION_FILENAME).read_text(encoding="utf-8").strip()
+    except OSError:
+        try:
+            return f"legacy-{index_dir.stat().st_mtime_ns}"
+        except OSError:
+            return ""
+
+
+def _shard_stamp(directory: Path) -> int:
+    for name in (SHARD_MANIFEST, "docstore.json"):
+        path = directory / name
+        if path.exists():
+            return path.stat().st_mtime_ns
+    return 0
+
+
+def backfill_shard_files(directory: Path) -> bool:
+    """为缺少倒排表或路由向量的分片（早于这些文件构建的旧分片、导入的归档）补写 postings.* 与 routing.*，
+    之后每次加载（包括空闲卸载后的重新加载）直接读取，不再遍历全部节点与向量。返回是否写入了文件。"""
+    faiss_path = directory / "faiss.index"
+    if not has_node_store(directory) or not faiss_path.exists():
+        return False
+    has_postings = (directory / POSTINGS_JSON).exists()
+    if has_postings and read_routing(directory) is not None:
+        return False
+    node_store = NodeStore(directory)
+    try:
+        postings = build_postings(node_store.get(i) or {} for i in range(len(node_store)))
+    finally:
+        node_store.close()
+    if not has_postings:
+        write_postings(directory, postings)
+    faiss_index = read_faiss_index(faiss_path, use_mmap=False)
+    if faiss_index.ntotal:
+        vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+        write_routing(directory, *build_routing(vectors, Postings.from_map(postings)))
+    logger.info("已补写分片倒排表与路由向量：%s", directory)
+    return True
+
+
+# 过滤后的候选位置不超过分片切片数的该比例时，直接对候选计算距离；否则交给 FAISS 扫描全部位置 + IDSelector
+_SUBSET_SEARCH_RATIO = 0.25
+
+
+def subset_search(faiss_index, query: np.ndarray, positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """只在给定位置（升序去重）上做精确 L2 Top‑k，返回按距离升序的 (距离, 位置)。
+
+    同一来源文件的切片在分片中连续存放，候选按连续区间以 reconstruct_n 取回向量，
+    距离计算次数等于候选数，与分片规模无关。距离与 IndexFlatL2 一致（L2 平方）。
+    """
+    positions = np.asarray(positions, dtype="int64")
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(positions)]))
+    vectors = np.vstack(
+        [faiss_index.reconstruct_n(int(positions[a]), int(b - a)) for a, b in zip(starts, ends)]
+    )
+    diff = vectors - np.asarray(query, dtype="float32")
+    distances = np.einsum("ij,ij->i", diff, diff)
+    k = min(k, len(positions))
+    top = np.argpartition(distances, k - 1)[:k]
+    order = top[np.argsort(distances[top], kind="stable")]
+    return distances[order], positions[order]
+
+
+class ShardHandle:
+    """已加载的单个分片。
+
+    新格式（faiss.index + nodes.bin）以只读 mmap 打开 FAISS 索引与节点存储，
+    同一台机器上的多个 worker 共享页缓存；旧格式退回 LlamaIndex 存储加载。
+    """
+
+    def __init__(self, directory: Path, settings: Settings):
+        self.directory = directory
+        self.stamp = _shard_stamp(directory)
+        self.faiss_index = None
+        self.node_store: NodeStore | None = None
+        self.li_index: VectorStoreIndex | None = None
+        self._postings: Postings | None = None
+        self._routing: Tuple[List[str], np.ndarray] | None = None
+        faiss_path = directory / "faiss.index"
+        if has_node_store(directory) and faiss_path.exists():
+            try:
+                self.faiss_index = read_faiss_index(faiss_path, use_mmap=settings.index_mmap)
+            except Exception as exc:
+                raise FileNotFoundError(f"无法读取 FAISS 索引：{faiss_path}（{exc}）") from exc
+            self.node_store = NodeStore(directory)
+            dimension = int(self.faiss_index.d)
+        else:
+            shard_cfg = settings.model_copy()
+            shard_cfg.index_dir = directory
+            self.li_index = load_persisted_index(shard_cfg)
+            faiss_index = getattr(self.li_index.vector_store, "_faiss_index", None)
+            dimension = int(faiss_index.d) if faiss_index is not None else int(settings.embed_dimension)
+        self.dimension = dimension
+        # 常驻内存的粗略上限：分片目录下的文件总大小（mmap 打开时只有访问过的页面计入 RSS）
+        self.resident_bytes = sum(p.stat().st_size for p in directory.iterdir() if p.is_file())
+        if dimension != int(settings.embed_dimension):
+            raise ValueError(
+                f"分片 {directory} 的向量维度 {dimension} 与知识库记录的维度 {settings.embed_dimension} 不一致，请重建索引"
+            )
+
+    def postings(self) -> Postings:
+        """元数据倒排表（首次过滤检索时加载）。"""
+        if self._postings is None:
+            self._postings = Postings.load(self.directory, self.node_store)
+        return self._postings
+
+    def routing(self) -> Tuple[List[str], np.ndarray]:
+        """文档级路由向量（来源文件, 归一化均值向量）；文件缺失时由存储向量即时计算（仅驻留内存，见 backfill_shard_files）。"""
+        if self._routing is None:
+            routing = read_routing(self.directory)
+            if routing is None:
+                vectors = self.faiss_index.reconstruct_n(0, self.faiss_index.ntotal)
+                routing = build_routing(vectors, self.postings())
+            self._routing = routing
+        return self._routing
+
+    def search(
+        self, bundle: QueryBundle, top_k: int, with_vectors: bool = False, filters: dict | None = None
+    ) -> List[dict]:
+        """返回命中列表：node_id / distance（L2，越小越近）/ text / metadata。
+
+        with_vectors 时附带命中的存储向量（vector，供 MMR 重排；旧格式分片为 None）。
+        filters 经倒排表解析为位置集合：候选不超过分片的 _SUBSET_SEARCH_RATIO 时只对这些位置计算距离（subset_search），
+        否则以 IDSelector 在 FAISS 检索内部过滤；两种方式结果都是精确 Top‑K。
+        """
+        if self.li_index is not None:
+            if filters:
+                raise ValueError(f"分片 {self.directory} 为旧格式索引，不支持过滤检索，请重建")
+            return [
+                {
+                    "node_id": hit.node.node_id,
+                    "distance": float(hit.score) if hit.score is not None else float("inf"),
+                    "text": hit.node.get_content(metadata_mode="LLM"),
+                    "metadata": dict(hit.node.metadata or {}),
+                    "vector": None,
+                }
+                for hit in as_topk_retriever(self.li_index, top_k).retrieve(bundle)
+            ]
+        k = max(1, top_k)
+        xq = np.asarray([bundle.embedding], dtype="float32")
+        if filters:
+            allowed = self.postings().select(filters)
+            if not len(allowed):
+                return []
+            k = min(k, len(allowed))
+            if len(allowed) <= self.faiss_index.ntotal * _SUBSET_SEARCH_RATIO:
+                # 候选较少（路由选出的文档、窄过滤条件）：只对候选位置计算距离
+                distances, positions = subset_search(self.faiss_index, xq[0], allowed, k)
+                annotate(scored=int(len(allowed)))
+                distances, positions = distances[None, :], positions[None, :]
+            else:
+                import faiss  # type: ignore
+
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed))
+                distances, positions = self.faiss_index.search(xq, k, params=params)
+        else:
+            distances, positions = self.faiss_index.search(xq, k)
+        hits: List[dict] = []
+        found: List[int] = []
+        for distance, position in zip(distances[0], positions[0]):
+            record = self.node_store.get(int(position)) if position >= 0 else None
+            if record is None:
+                continue
+            found.append(int(position))
+            hits.append(
+                {
+                    "node_id": record.get("id"),
+                    "distance": float(distance),
+                    "text": record.get("text") or "",
+                    "metadata": record.get("metadata") or {},
+                }
+            )
+        if with_vectors and hits:
+            vectors = self.faiss_index.reconstruct_batch(np.asarray(found, dtype="int64"))
+            for hit, vector in zip(hits, vectors):
+                hit["vector"] = vector
+        return hits
+
+
+class KBSnapshot:
+    """某个版本戳下知识库全部分片的只读视图。"""
+
+    def __init__(self, version: str, shards: List[ShardHandle]):
+        self.version = version
+        self.shards = shards
+        self.last_used = time.monotonic()
+        self._routing: Tuple[List[str], np.ndarray, np.ndarray] | None = None
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(handle.resident_bytes for handle in self.shards)
+
+    def routing(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """全部分片的路由向量拼成一张表：(来源文件, 所属分片下标, 向量矩阵)。"""
+        if self._routing is None:
+            parts = [handle.routing() for handle in self.shards]
+            sources = [source for names, _ in parts for source in names]
+            owners = np.concatenate([np.full(len(names), i, dtype="int64") for i, (names, _) in enumerate(parts)])
+            self._routing = (sources, owners, np.vstack([matrix for _, matrix in parts]))
+        return self._routing
+
+
+class SnapshotCache:
+    """进程内快照缓存：每次请求只比较版本戳，变化时按分片清单增量重新加载。
+
+    记录每个知识库最近一次使用的时间，空闲过久或超出内存预算时整体卸载，下次检索时重新打开
+    （mmap 格式的分片重新加载只需读取清单与偏移表）。
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, KBSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_dir: Path, settings: Settings) -> KBSnapshot:
+        key = str(index_dir)
+        version = read_version(index_dir)
+        snapshot = self._entries.get(key)
+        if snapshot is not None and snapshot.version == version:
+            snapshot.last_used = time.monotonic()
+            return snapshot
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is not None and snapshot.version == version:
+                snapshot.last_used = time.monotonic()
+                return snapshot
+            previous = {str(h.directory): h for h in snapshot.shards} if snapshot else {}
+            shards: List[ShardHandle] = []
+            for directory in list_shard_dirs(index_dir):
+                handle = previous.get(str(directory))
+                if handle is None or handle.stamp != _shard_stamp(directory):
+                    try:
+                        handle = ShardHandle(directory, settings)
+                    except FileNotFoundError as exc:
+                        if handle is None:
+                            raise
+                        # 新快照尚未写完整时继续使用旧分片（其 mmap 文件仍然有效）
+                        logger.warning("分片重新加载失败，沿用旧版本：%s（%s）", directory, exc)
+                shards.append(handle)
+            snapshot = KBSnapshot(version, shards)
+            self._entries[key] = snapshot
+        if settings.memory_budget_mb > 0 and len(self._entries) > 1:
+            # 新加载的知识库可能使进程超出预算：先卸载其他最久未用的知识库
+            self.shrink_to(settings.memory_budget_mb * 1024 * 1024, process_rss, keep=key)
+        return snapshot
+
+    def loaded(self) -> List[dict]:
+        """已加载的知识库（按最近使用排序）：索引目录、版本戳、分片数、估算常驻字节数与空闲秒数。"""
+        now = time.monotonic()
+        entries = sorted(self._entries.items(), key=lambda item: item[1].last_used, reverse=True)
+        return [
+            {
+                "index_dir": key,
+                "version": snapshot.version,
+                "shards": len(snapshot.shards),
+                "resident_bytes": snapshot.resident_bytes,
+                "idle_seconds": round(now - snapshot.last_used, 1),
+            }
+            for key, snapshot in entries
+        ]
+
+    def _unload(self, keys: List[str]) -> List[str]:
+        with self._lock:
+            removed = [key for key in keys if self._entries.pop(key, None) is not None]
+        if removed:
+            release_memory()
+            logger.info("已卸载知识库索引：%s", ", ".join(removed))
+        return removed
+
+    def unload_idle(self, max_idle_seconds: float) -> List[str]:
+        """卸载空闲超过 max_idle_seconds 秒的知识库，返回被卸载的索引目录。"""
+        cutoff = time.monotonic() - max_idle_seconds
+        return self._unload([key for key, snapshot in list(self._entries.items()) if snapshot.last_used < cutoff])
+
+    def shrink_to(
+        self, budget_bytes: int, rss: Callable[[], int | None], keep: str | None = None
+    ) -> List[str]:
+        """按最久未用顺序卸载知识库，直到进程 RSS 不超过预算（不可用时按已加载索引的估算大小）。
+
+        keep 指定的知识库（当前请求正在使用）与最近使用的知识库始终保留；
+        卸载后 RSS 不再下降（进程基础占用已超出预算，或旧快照仍被进行中的请求引用）时停止，避免反复卸载重载。
+        """
+        removed: List[str] = []
+        previous: int | None = None
+        while True:
+            measured = rss()
+            usage = measured
+            if usage is None:
+                usage = sum(snapshot.resident_bytes for snapshot in list(self._entries.values()))
+            if usage <= budget_bytes or (measured is not None and previous is not None and measured >= previous):
+                return removed
+            entries = sorted(self._entries.items(), key=lambda item: item[1].last_used)
+            protected = {keep, entries[-1][0]} if entries else {keep}
+            victims = [key for key, _ in entries if key not in protected]
+            if not victims:
+                return removed
+            previous = measured
+            removed.extend(self._unload([victims[0]]))
+
+    def evict(self, prefix: Path) -> None:
+        """丢弃快照引用；进行中的检索仍持有旧句柄，结束后随垃圾回收释放 mmap。"""
+        with self._lock:
+            prefix = Path(prefix)
+            # 按路径层级匹配：丢弃 …/kb1 时不能误伤 …/kb10
+            for key in [k for k in self._entries if Path(k) == prefix or prefix in Path(k).parents]:
+                del self._entries[key]
+
+
+snapshot_cache = SnapshotCache()
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(settings: Settings) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.shard_search_workers),
+                thread_name_prefix="shard-search",
+            )
+        return _executor
+
+
+def _route(
+    snapshot: KBSnapshot, query_embedding: List[float], settings: Settings, filters: dict | None
+) -> Optional[List[dict | None]]:
+    """两阶段检索的第一阶段：按文档级路由向量选出前 ROUTING_TOP_DOCS 个来源文件，
+    转换为各分片的来源过滤条件（未选中任何文档的分片为 None，跳过检索）。不需要路由时返回 None。
+    """
+    if settings.routing_top_docs <= 0 or any(handle.li_index is not None for handle in snapshot.shards):
+        return None
+    sources, owners, matrix = snapshot.routing()
+    if len(sources) < max(settings.routing_min_docs, settings.routing_top_docs + 1):
+        return None
+    candidates = None
+    if filters and filters.get("sources"):
+        allowed = set(filters["sources"])
+        candidates = np.fromiter((source in allowed for source in sources), dtype=bool, count=len(sources))
+    selected: List[List[str]] = [[] for _ in snapshot.shards]
+    for row in top_documents(matrix, query_embedding, settings.routing_top_docs, candidates):
+        selected[int(owners[row])].append(sources[row])
+    annotate(routed_docs=sum(len(names) for names in selected), total_docs=len(sources))
+    return [{**(filters or {}), "sources": sorted(names)} if names else None for names in selected]
+
+
+def search_shards(
+    query: str,
+    query_embedding: List[float],
+    top_k: int,
+    settings: Settings,
+    with_vectors: bool = False,
+    filters: dict | None = None,
+) -> List[dict]:
+    """在知识库的全部分片上并行检索 Top‑K 并合并。
+
+    查询向量只计算一次；各分片在线程池上检索（FAISS 检索期间释放 GIL），
+    以 L2 距离升序合并各分片结果后取全局 Top‑K。filters 在各分片内部独立生效。
+    启用 ROUTING_TOP_DOCS 时先按文档级路由向量选出相关文档，再只在这些文档的切片中检索：
+    未选中文档的分片直接跳过，其余分片按倒排表取出选中文档的切片区间，只对它们计算距离，
+    开销随选中文档的切片数而非语料规模增长（路由本身按文档数计算）。
+    """
+    snapshot = snapshot_cache.get(Path(settings.index_dir), settings)
+    bundle = QueryBundle(query_str=query, embedding=query_embedding)
+    if not snapshot.shards:
+        raise FileNotFoundError(f"知识库 {settings.index_dir} 没有可用的分片索引，请先执行 ingest")
+    for handle in snapshot.shards:
+        if handle.dimension != len(query_embedding):
+            raise ValueError(
+                f"查询向量维度 {len(query_embedding)} 与分片 {handle.directory} 的索引维度 {handle.dimension} 不一致，请重建索引"
+            )
+    routed = _route(snapshot, query_embedding, settings, filters)
+    jobs = (
+        [(handle, filters) for handle in snapshot.shards]
+        if routed is None
+        else [(handle, scope) for handle, scope in zip(snapshot.shards, routed) if scope is not None]
+    )
+    if len(jobs) == 1:
+        handle, scope = jobs[0]
+        return handle.search(bundle, top_k, with_vectors, scope)
+
+    executor = _get_executor(settings)
+    futures = [executor.submit(handle.search, bundle, top_k, with_vectors, scope) for handle, scope in jobs]
+    hits: List[dict] = []
+    for future in futures:
+        hits.extend(future.result())
+    hits.sort(key=lambda hit: hit["distance"])
+    return hits[:top_k]
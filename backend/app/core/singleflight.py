@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import unicodedata
+from contextlib import nullcontext
+from pathlib import Path
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .shards import read_version
+
+T = TypeVar("T")
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = "?!.。？！~～ "
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本：全角转半角、合并空白、忽略大小写与句末标点。"""
+    text = unicodedata.normalize("NFKC", question)
+    text = _SPACE_RE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+    return text.lower()
+
+
+def coalesce_key(kb: str, index_dir: Path, question: str, top_k: int, filters: Optional[dict] = None) -> tuple:
+    """合并键：知识库 + 索引版本戳 + 归一化问题 + Top‑K + 过滤条件；重建索引后版本变化，不会复用旧结果。"""
+    scope = json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ""
+    return (kb, read_version(index_dir), normalize_question(question), top_k, scope)
+
+
+class _Broadcast:
+    """单个流式调用的事件缓冲：后加入的订阅者先回放已产生的事件，再跟随实时输出。"""
+
+    def __init__(self) -> None:
+        self.events: List[dict] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # 所有订阅者都已断开时由事件循环置位，生产线程据此提前结束上游请求
+        self.abandoned = False
+        # 准入完成（或失败）时置位：调用方据此在建立事件流之前得知是否被拒绝
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.started.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, event: dict) -> None:
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException]) -> None:
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self) -> AsyncIterator[dict]:
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self.abandoned = True
+
+
+class SingleFlight:
+    """进程内请求合并（single-flight）：相同键的并发调用只执行一次，其余调用等待并共享结果（含异常）。
+
+    只合并“进行中”的调用，完成后立即移除，不承担结果缓存的职责。
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """执行或加入一次调用，返回 (结果, 是否为共享结果)。"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget_call(k, t))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+            logger.info("合并进行中的相同请求：%s", key)
+        # shield：某个等待方断开连接不会取消其他请求共享的任务
+        return await asyncio.shield(task), shared
+
+    def _forget_call(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 标记异常已取回，避免无人等待时的告警日志
+
+    async def stream(
+        self,
+        key: Hashable,
+        produce: Callable[[], Iterator[dict]],
+        admit: Optional[Callable[[], AsyncContextManager]] = None,
+    ) -> Tuple[AsyncIterator[dict], bool]:
+        """流式版本：produce 为同步事件生成器，在线程池中运行一次，事件广播给所有订阅者。
+
+        admit 为准入上下文（如调度器执行槽），只由实际执行 produce 的一方持有到生成结束，
+        跟随者直接订阅、不占用执行槽。返回前等待准入完成；准入失败（如 Overloaded）时所有调用方都收到该异常。
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is not None and broadcast.abandoned:
+            broadcast = None
+        shared = broadcast is not None
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            asyncio.ensure_future(self._run(key, broadcast, produce, admit))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+            logger.info("合并进行中的相同流式请求：%s", key)
+        # shield：某个调用方断开连接不会取消共享的准入等待
+        await asyncio.shield(broadcast.started)
+        return broadcast.subscribe(), shared
+
+    async def _run(
+        self,
+        key: Hashable,
+        broadcast: _Broadcast,
+        produce: Callable[[], Iterator[dict]],
+        admit: Optional[Callable[[], AsyncContextManager]],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            async with admit() if admit is not None else nullcontext():
+                broadcast.started.set_result(None)
+                await loop.run_in_executor(None, context.run, self._pump, loop, key, broadcast, produce)
+        except Exception as exc:
+            # 准入失败：生产线程尚未启动，由这里结束广播（之后的失败由 _pump 处理）
+            if not broadcast.started.done():
+                broadcast.started.set_exception(exc)
+                self._finish_stream(key, broadcast, exc)
+            else:
+                logger.exception("流式请求执行失败：%s", key)
+
+    def _pump(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        key: Hashable,
+        broadcast: _Broadcast,
+        produce: Callable[[], Iterator[dict]],
+    ) -> None:
+        error: Optional[BaseException] = None
+        events = produce()
+        try:
+            for event in events:
+                loop.call_soon_threadsafe(broadcast.publish, event)
+                if broadcast.abandoned:
+                    logger.info("流式请求的订阅者均已断开，提前结束：%s", key)
+                    break
+        except Exception as exc:
+            error = exc
+        finally:
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+            loop.call_soon_threadsafe(self._finish_stream, key, broadcast, error)
+
+    def _finish_stream(self, key: Hashable, broadcast: _Broadcast, error: Optional[BaseException]) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+        broadcast.finish(error)
+
+
+ask_flight = SingleFlight()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.interface import MetadataAwareTextSplitter, NodeParser
+from llama_index.core.utils import get_tokenizer
+
+from .settings import Settings
+
+# 句末标点（含中英文），其后可跟随右引号/右括号
+_SEGMENT_RE = re.compile(r".*?(?:[。！？；!?;…]+[”’」』）)\]]*|\n+|$)", re.S)
+# 标题行：Markdown 标题、“第X章/节/讲”、“一、”、“1.2 ”等编号
+_HEADING_RE = re.compile(
+    r"^\s*(?:#{1,6}\s+\S"
+    r"|第[0-9一二三四五六七八九十百零]+[章节讲部分篇]"
+    r"|[一二三四五六七八九十]+、"
+    r"|\d+(?:\.\d+){0,3}[.、]?\s+\S)"
+)
+TEXT_SPLITTERS = ("sentence", "chinese")
+
+
+def split_segments(text: str) -> List[str]:
+    """单遍扫描，把文本切成首尾相接的句子片段（按中文/英文句末标点与换行）。
+
+    所有片段拼接后与原文完全一致，便于上层按片段累积并保留原始偏移。
+    """
+    return [m.group(0) for m in _SEGMENT_RE.finditer(text) if m.group(0)]
+
+
+def is_heading(segment: str) -> bool:
+    """判断片段是否为标题行（需位于行首）。"""
+    line = segment.strip()
+    return bool(line) and len(line) <= 80 and bool(_HEADING_RE.match(line))
+
+
+class ChineseSentenceSplitter(MetadataAwareTextSplitter):
+    """面向中文语料的句子切分器。
+
+    与 SentenceSplitter 的区别：
+    - 单遍正则扫描，在“。！？；”等句末标点与换行处断开，并在标题行前强制分块；
+    - 每个句子只做一次 token 计数（带 LRU 缓存，重复的页眉/页脚直接命中），
+      块大小由句子计数累加得到，避免对候选块反复调用 tiktoken。
+    继承 MetadataAwareTextSplitter，因此产出的节点、关系与元数据形态与 SentenceSplitter 一致。
+    """
+
+    chunk_size: int = Field(default=1000, gt=0, description="每个块的 token 上限")
+    chunk_overlap: int = Field(default=120, ge=0, description="相邻块的 token 重叠")
+    token_cache_size: int = Field(default=65536, ge=0, description="句子 token 计数缓存条目数")
+
+    _count_tokens: Callable[[str], int] = PrivateAttr()
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 120,
+        tokenizer: Optional[Callable] = None,
+        token_cache_size: int = 65536,
+        **kwargs,
+    ) -> None:
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap（{chunk_overlap}）不能大于 chunk_size（{chunk_size}）")
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            token_cache_size=token_cache_size,
+            **kwargs,
+        )
+        tokenize = tokenizer or get_tokenizer()
+
+        @lru_cache(maxsize=token_cache_size or None)
+        def _count(segment: str) -> int:
+            return len(tokenize(segment))
+
+        self._count_tokens = _count
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ChineseSentenceSplitter"
+
+    def split_text_metadata_aware(self, text: str, metadata_str: str) -> List[str]:
+        effective = self.chunk_size - self._count_tokens(metadata_str)
+        if effective <= 0:
+            raise ValueError(
+                f"元数据长度超过 chunk_size（{self.chunk_size}），请调大 chunk_size 或精简元数据"
+            )
+        return self._split_text(text, effective)
+
+    def split_text(self, text: str) -> List[str]:
+        return self._split_text(text, self.chunk_size)
+
+    def _split_long(self, segment: str, tokens: int, chunk_size: int) -> List[tuple[str, int]]:
+        """超长句子按字符窗口硬切（按平均每 token 字符数估算窗口大小）。"""
+        chars_per_token = max(len(segment) / max(tokens, 1), 0.1)
+        window = max(1, int(chunk_size * chars_per_token * 0.9))
+        pieces = []
+        for start in range(0, len(segment), window):
+            piece = segment[start : start + window]
+            pieces.append((piece, self._count_tokens(piece)))
+        return pieces
+
+    def _split_text(self, text: str, chunk_size: int) -> List[str]:
+        if text == "":
+            return [text]
+        overlap = min(self.chunk_overlap, chunk_size // 2)
+
+        chunks: List[str] = []
+        current: List[tuple[str, int]] = []
+        current_tokens = 0
+        at_line_start = True
+
+        def close_chunk(keep_overlap: bool) -> None:
+            nonlocal current, current_tokens
+            chunk = "".join(seg for seg, _ in current).strip()
+            if chunk:
+                chunks.append(chunk)
+            tail: List[tuple[str, int]] = []
+            tail_tokens = 0
+            if keep_overlap:
+                for seg, n in reversed(current):
+                    if tail_tokens + n > overlap:
+                        break
+                    tail.insert(0, (seg, n))
+                    tail_tokens += n
+            current, current_tokens = tail, tail_tokens
+
+        for segment in split_segments(text):
+            heading = at_line_start and is_heading(segment)
+            at_line_start = segment.endswith("\n")
+            if heading and current_tokens:
+                # 新章节开始：断块且不携带上一节的重叠内容
+                close_chunk(keep_overlap=False)
+            n_tokens = self._count_tokens(segment)
+            pieces = (
+                self._split_long(segment, n_tokens, chunk_size)
+                if n_tokens > chunk_size
+                else [(segment, n_tokens)]
+            )
+            for piece, n in pieces:
+                if current_tokens + n > chunk_size and current:
+                    close_chunk(keep_overlap=True)
+                    # 重叠部分加上新片段仍超限时，丢弃重叠
+                    if current_tokens + n > chunk_size:
+                        current, current_tokens = [], 0
+                current.append((piece, n))
+                current_tokens += n
+
+        if current:
+            close_chunk(keep_overlap=False)
+        return chunks
+
+
+def get_node_parser(settings: Settings) -> NodeParser:
+    """按配置返回切分器：sentence（LlamaIndex 默认）或 chinese（中文句子切分）。"""
+    kind = (settings.text_splitter or "sentence").strip().lower()
+    if kind == "chinese":
+        return ChineseSentenceSplitter(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+    if kind == "sentence":
+        return SentenceSplitter(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+    raise ValueError(f"未知的切分器类型：{settings.text_splitter}（可选：{'/'.join(TEXT_SPLITTERS)}）")
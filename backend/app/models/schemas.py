@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class HealthResponse(BaseModel):
@@ -15,21 +15,50 @@ class IngestRequest(BaseModel):
     """入库请求：指定知识库并决定是否重建索引。"""
     kb: str = Field(min_length=1, description="知识库名称")
     rebuild: bool = True
+    dimension: Optional[int] = Field(default=None, description="嵌入维度（如 256/512/1024），不指定时沿用知识库已有维度")
 
 
 class IngestResponse(BaseModel):
-    """入库（ingest）结果：文件数、切片数与索引目录。"""
+    """入库（ingest）结果：文件数、切片数、索引目录与近重复切片占比。"""
     ok: bool = True
     files: int = Field(ge=0)
     chunks: int = Field(ge=0)
     index_dir: str
+    dedup_ratio: float = Field(default=0.0, ge=0, le=1)
+
+
+class SearchFilters(BaseModel):
+    """检索过滤条件：限定来源文件（任一匹配）与页码闭区间，两者同时给出时需同时满足。"""
+    sources: Optional[List[str]] = Field(default=None, min_length=1, max_length=100, description="来源文件名")
+    page_from: Optional[int] = Field(default=None, ge=0, description="起始页码（含）")
+    page_to: Optional[int] = Field(default=None, ge=0, description="结束页码（含）")
+
+    @model_validator(mode="after")
+    def _check_range(self) -> "SearchFilters":
+        if self.page_from is not None and self.page_to is not None and self.page_from > self.page_to:
+            raise ValueError("page_from 不能大于 page_to")
+        return self
+
+    def as_dict(self) -> Optional[dict]:
+        """规范化为检索层使用的字典（来源去重排序，便于作为缓存/合并键）；无任何条件时为 None。"""
+        data = self.model_dump(exclude_none=True)
+        if "sources" in data:
+            data["sources"] = sorted(set(data["sources"]))
+        return data or None
 
 
 class AskRequest(BaseModel):
-    """问答请求：包含知识库、中文问题与可选 Top‑K。"""
+    """问答请求：包含知识库、中文问题、可选 Top‑K、可选会话 ID 与检索过滤条件。"""
     kb: str = Field(min_length=1, description="知识库名称")
     question: str = Field(min_length=2, description="中文问题")
     top_k: Optional[int] = Field(default=None, ge=1, le=20)
+    session_id: Optional[str] = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        description="会话 ID：同一会话的追问复用已召回的上下文与历史问答",
+    )
+    filters: Optional[SearchFilters] = Field(default=None, description="检索过滤条件")
 
 
 class ContextChunk(BaseModel):
@@ -40,18 +69,80 @@ class ContextChunk(BaseModel):
     text: str
 
 
+class UsageInfo(BaseModel):
+    """生成模型 token 用量：cache_hit_tokens 为命中供应商前缀缓存的提示 token 数；
+    compression_ratio 为上下文压缩后与压缩前的字符数之比（未启用压缩时为空）。"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hit_tokens: int = 0
+    cache_miss_tokens: int = 0
+    compression_ratio: Optional[float] = None
+
+
 class AskResponse(BaseModel):
-    """问答响应：中文答案、引用片段与耗时（毫秒）。"""
+    """问答响应：中文答案、引用片段、耗时（毫秒）、会话 ID 与 token 用量。"""
     answer: str
     contexts: List[ContextChunk]
     latency_ms: int
+    session_id: Optional[str] = None
+    usage: Optional[UsageInfo] = None
+
+
+class RetrieveRequest(BaseModel):
+    """检索请求：只返回排序后的片段，不调用生成模型；cursor 为上一页返回的 next_cursor。"""
+    kb: str = Field(min_length=1, description="知识库名称")
+    query: str = Field(min_length=1, description="检索查询")
+    top_k: Optional[int] = Field(default=None, ge=1, le=50, description="每页条数")
+    cursor: Optional[str] = Field(default=None, description="翻页游标")
+    filters: Optional[SearchFilters] = Field(default=None, description="检索过滤条件")
+
+
+class RetrieveBatchRequest(BaseModel):
+    """批量检索请求：同一知识库上的多个查询（各自返回第一页）。"""
+    kb: str = Field(min_length=1, description="知识库名称")
+    queries: List[str] = Field(min_length=1, max_length=32, description="检索查询列表")
+    top_k: Optional[int] = Field(default=None, ge=1, le=50, description="每个查询返回的条数")
+    filters: Optional[SearchFilters] = Field(default=None, description="检索过滤条件（对全部查询生效）")
+
+
+class RetrievedChunk(BaseModel):
+    """检索命中：排名、节点 ID、相似度（余弦，越大越相关）、L2 距离、来源与元数据。"""
+    rank: int
+    node_id: Optional[str] = None
+    score: float
+    distance: float
+    source: str
+    page: Optional[str] = None
+    text: str
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class RetrieveResponse(BaseModel):
+    """检索响应：当前页命中与下一页游标（没有更多结果时为空）。"""
+    query: str
+    items: List[RetrievedChunk]
+    next_cursor: Optional[str] = None
+    latency_ms: Optional[int] = None
+
+
+class RetrieveBatchResponse(BaseModel):
+    """批量检索响应：与请求中 queries 顺序一致。"""
+    kb: str
+    results: List[RetrieveResponse]
+    latency_ms: int
 
 
 class KnowledgeBaseInfo(BaseModel):
-    """知识库信息：ID（目录名）、展示名称与文档数量。"""
+    """知识库信息：ID（目录名）、展示名称、文档数量，以及知识库目录中记录的
+    文件总字节数、切片数、索引版本戳、FAISS 索引大小与最近入库时间（Unix 时间戳）。"""
     id: str
     name: str
     files: int = 0
+    bytes: int = 0
+    chunks: int = 0
+    index_version: Optional[str] = None
+    index_bytes: int = 0
+    last_ingest: Optional[float] = None
 
 
 class KnowledgeBaseListResponse(BaseModel):
@@ -80,3 +171,31 @@ class KnowledgeBaseFilesResponse(BaseModel):
 class KnowledgeBaseDeleteFilesRequest(BaseModel):
     """删除知识库中文件的请求。"""
     names: List[str] = Field(min_length=1, description="要删除的文件名列表（相对于知识库根目录）")
+
+
+class KnowledgeBaseImportResponse(BaseModel):
+    """知识库归档导入结果：分片数、切片数与归档记录的嵌入模型/维度。"""
+    ok: bool = True
+    kb: str
+    shards: int = Field(ge=0)
+    chunks: int = Field(ge=0)
+    embed_model: str
+    embed_dimension: int
+
+
+class LoadedKnowledgeBase(BaseModel):
+    """已加载到内存的知识库索引。"""
+    kb: str
+    version: str
+    shards: int = Field(ge=0)
+    resident_bytes: int = Field(ge=0, description="索引文件总大小（常驻内存的估算上限）")
+    idle_seconds: float = Field(ge=0)
+
+
+class StatusResponse(BaseModel):
+    """进程资源状态：常驻内存、内存预算与已加载的知识库（供桌面端外壳展示）。"""
+    rss_bytes: Optional[int] = None
+    rss_source: Optional[str] = None
+    memory_budget_bytes: int = 0
+    idle_unload_seconds: int = 0
+    loaded: List[LoadedKnowledgeBase] = []
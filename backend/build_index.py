@@ -1,16 +1,46 @@
-"""命令行工具：使用本地 RAW_DIR 构建/重建索引。"""
+"""命令行工具：使用本地 RAW_DIR 构建/重建索引，或导出/导入知识库归档。
+
+    python build_index.py --kb my_kb --rebuild              # 构建索引（默认）
+    python build_index.py --kb my_kb --dimension 512        # 以 512 维嵌入构建
+    python build_index.py eval --kb my_kb --dimensions 256 512 1024 --top-k 10
+    python build_index.py export --kb my_kb --out my_kb.easyrag [--float16]
+    python build_index.py import --kb my_kb --archive my_kb.easyrag
+"""
 
 from __future__ import annotations
 
 import argparse
 import logging
+import sqlite3
 import sys
 from pathlib import Path
 
+from app.core.archive import export_kb, import_kb
+from app.core.catalog import get_catalog
+from app.core.embed_eval import evaluate_dimensions
 from app.core.rag import ingest_corpus
 from app.core.settings import get_settings
 
 
+def _add_kb_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--kb",
+        type=str,
+        default="default",
+        help="知识库名称（对应 RAW_DIR/kb 和 INDEX_DIR/kb，默认 default）",
+    )
+
+
+def _update_catalog(cfg, kb: str, name: str | None = None) -> None:
+    """与 API 相同：登记知识库并刷新目录统计（文件、切片、版本），/kb 列表立即可见；目录写入失败只记录告警。"""
+    try:
+        catalog = get_catalog(cfg)
+        catalog.ensure(kb, name)
+        catalog.refresh(kb, ingested=True)
+    except sqlite3.Error as exc:
+        logging.getLogger(__name__).warning("更新知识库目录失败：kb=%s（%s）", kb, exc)
+
+
 def main() -> None:
     logs_dir = Path("logs")
     logs_dir.mkdir(exist_ok=True)
@@ -24,23 +54,84 @@ def main() -> None:
         force=True,
     )
     parser = argparse.ArgumentParser(description="构建 EasyRAG 本地索引")
-    parser.add_argument(
-        "--kb",
-        type=str,
-        default="default",
-        help="知识库名称（对应 RAW_DIR/kb 和 INDEX_DIR/kb，默认 default）",
-    )
+    _add_kb_argument(parser)
     parser.add_argument(
         "--rebuild",
         action=argparse.BooleanOptionalAction,
         default=True,
         help="是否全量重建索引（默认开启，可用 --no-rebuild 关闭）",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--dimension",
+        type=int,
+        default=None,
+        help="嵌入维度（如 256/512/1024），不指定时沿用知识库已有维度或 EMBED_DIMENSION",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    export_parser = subparsers.add_parser("export", help="导出知识库为单文件归档")
+    _add_kb_argument(export_parser)
+    export_parser.add_argument("--out", type=Path, default=None, help="归档输出路径（默认 <kb>.easyrag）")
+    export_parser.add_argument("--float16", action="store_true", help="向量以 float16 存储")
+
+    import_parser = subparsers.add_parser("import", help="从归档导入知识库（无需重新嵌入）")
+    _add_kb_argument(import_parser)
+    import_parser.add_argument("--archive", type=Path, required=True, help="归档文件路径")
 
+    eval_parser = subparsers.add_parser("eval", help="对比不同嵌入维度的索引大小、检索延迟与 recall@k")
+    _add_kb_argument(eval_parser)
+    eval_parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024], help="待评估维度，最大者为基准")
+    eval_parser.add_argument("--top-k", type=int, default=10, help="recall@k 的 k（默认 10）")
+    eval_parser.add_argument("--questions", type=Path, default=None, help="问题文件（每行一个），缺省时从切片中抽样")
+    eval_parser.add_argument("--queries", type=int, default=50, help="抽样问题数（默认 50）")
+    eval_parser.add_argument("--limit", type=int, default=None, help="最多使用的切片数（每个维度都需重新嵌入）")
+
+    args = parser.parse_args()
     cfg = get_settings()
-    files, chunks = ingest_corpus(kb=args.kb, rebuild=args.rebuild, settings=cfg)
-    print(f"索引构建完成：知识库 {args.kb}，文件 {files} 个，切片 {chunks} 个，目录 {cfg.index_dir / args.kb}")
+    index_dir = (cfg.index_dir / args.kb).resolve()
+
+    if args.command == "export":
+        out_path = args.out or Path(f"{args.kb}.easyrag")
+        manifest = export_kb(index_dir, out_path, cfg, float16=args.float16)
+        size_mb = out_path.stat().st_size / (1 << 20)
+        print(f"导出完成：知识库 {args.kb}，分片 {len(manifest['shards'])} 个，归档 {out_path}（{size_mb:.1f} MB）")
+        return
+    if args.command == "import":
+        manifest = import_kb(index_dir, args.archive, cfg)
+        (cfg.raw_dir / args.kb).mkdir(parents=True, exist_ok=True)
+        _update_catalog(cfg, args.kb, manifest.get("kb") or args.kb)
+        print(f"导入完成：知识库 {args.kb}，切片 {manifest['chunks']} 个，目录 {index_dir}")
+        return
+
+    if args.command == "eval":
+        questions = None
+        if args.questions:
+            questions = [line.strip() for line in args.questions.read_text(encoding="utf-8").splitlines() if line.strip()]
+        rows = evaluate_dimensions(
+            index_dir,
+            args.dimensions,
+            cfg,
+            top_k=args.top_k,
+            questions=questions,
+            num_queries=args.queries,
+            limit=args.limit,
+        )
+        print(f"{'维度':>6} {'向量数':>8} {'向量存储':>10} {'平均检索':>10} {'P95':>9} {'recall@' + str(args.top_k):>10}")
+        for row in rows:
+            print(
+                f"{row['dimension']:>8} {row['vectors']:>10} {row['index_bytes'] / (1 << 20):>10.2f}MB "
+                f"{row['search_ms_avg']:>9.3f}ms {row['search_ms_p95']:>8.3f}ms {row['recall_at_k']:>11.3f}"
+            )
+        return
+
+    files, chunks, dedup_ratio = ingest_corpus(
+        kb=args.kb, rebuild=args.rebuild, settings=cfg, dimension=args.dimension
+    )
+    _update_catalog(cfg, args.kb)
+    print(
+        f"索引构建完成：知识库 {args.kb}，文件 {files} 个，切片 {chunks} 个，"
+        f"近重复占比 {dedup_ratio:.1%}，目录 {cfg.index_dir / args.kb}"
+    )
 
 
 if __name__ == "__main__":
@@ -4,9 +4,20 @@ from __future__ import annotations
 
 import os
 
-import uvicorn
-
-from main import create_app
+# 低资源桌面模式：索引以 mmap 打开，空闲知识库 5 分钟后卸载，常驻内存超过预算时卸载最久未用的知识库。
+# 以默认值形式注入，用户的环境变量或 .env 仍可覆盖；必须在导入 main（创建应用、读取配置）之前设置。
+DESKTOP_DEFAULTS = {
+    "INDEX_MMAP": "true",
+    "KB_IDLE_UNLOAD_SECONDS": "300",
+    "MEMORY_BUDGET_MB": "768",
+    "SHARD_SEARCH_WORKERS": "2",
+}
+for _key, _value in DESKTOP_DEFAULTS.items():
+    os.environ.setdefault(_key, _value)
+
+import uvicorn  # noqa: E402
+
+from main import create_app  # noqa: E402
 
 
 def main() -> None:
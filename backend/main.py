@@ -3,11 +3,16 @@ import os
 import sys
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
-from app.api import ask, health, ingest, kb
+from app.api import ask, health, ingest, kb, metrics, retrieve, status
+from app.core.profiling import install_profiling
+from app.core.resources import install_resource_reaper
+from app.core.scheduler import Overloaded
 from app.core.settings import get_settings
+from app.core.shards import snapshot_cache
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
@@ -54,10 +59,25 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    # 阶段耗时、按需采样分析与慢请求日志（logs/profiles/、logs/slow_requests.log）
+    install_profiling(app, cfg, LOG_DIR)
+    # 空闲知识库卸载与内存预算（KB_IDLE_UNLOAD_SECONDS / MEMORY_BUDGET_MB，桌面端默认开启）
+    install_resource_reaper(app, cfg, snapshot_cache)
+
+    @app.exception_handler(Overloaded)
+    async def _overloaded_handler(request: Request, exc: Overloaded) -> JSONResponse:
+        # 准入调度拒绝：429 + Retry-After，客户端按提示退避重试
+        return JSONResponse(
+            status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)}
+        )
+
     app.include_router(health.router)
     app.include_router(kb.router)
     app.include_router(ingest.router)
     app.include_router(ask.router)
+    app.include_router(retrieve.router)
+    app.include_router(metrics.router)
+    app.include_router(status.router)
 
     return app
 
@@ -0,0 +1,31 @@
+"""多进程服务入口：以多个 uvicorn worker 运行 EasyRAG API。
+
+各 worker 以只读 mmap 打开 faiss.index 与 nodes.bin，索引页由操作系统页缓存共享，
+增加 worker 基本不增加常驻内存；任一 worker（或 build_index.py）重建知识库后会写入新的
+VERSION 版本戳，其余 worker 在下一次请求时比对版本戳并自动加载新快照，无需重启。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+
+import uvicorn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以多进程模式启动 EasyRAG API")
+    parser.add_argument("--host", type=str, default=os.getenv("EASYRAG_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("EASYRAG_PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("EASYRAG_WORKERS", str(os.cpu_count() or 1))),
+        help="worker 进程数（默认 CPU 核数，可用 EASYRAG_WORKERS 覆盖）",
+    )
+    args = parser.parse_args()
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=max(1, args.workers), reload=False)
+
+
+if __name__ == "__main__":
+    main()
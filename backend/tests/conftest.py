@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 测试直接导入 app 包（与 uvicorn main:app 相同，以 backend 为根目录）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app.core.scheduler import BATCH, INGEST, INTERACTIVE, Overloaded, Scheduler
+
+
+def _scheduler(capacity=1, reserved=0, ingest_limit=1, queue=8, timeout=5.0) -> Scheduler:
+    return Scheduler(
+        capacity=capacity,
+        reserved=reserved,
+        ingest_limit=ingest_limit,
+        queue_limits={INTERACTIVE: queue, BATCH: queue, INGEST: queue},
+        queue_timeout=timeout,
+    )
+
+
+def _running(scheduler: Scheduler) -> int:
+    stats = scheduler.stats()
+    return sum(stats[name]["running"] for name in (INTERACTIVE, BATCH, INGEST))
+
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_strict_priority_order():
+    async def scenario():
+        scheduler = _scheduler(capacity=1)
+        order = []
+        holder = await scheduler.acquire(INTERACTIVE)
+
+        async def worker(priority):
+            acquired = await scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release(priority, acquired)
+
+        # 按从低到高的优先级排队，空出的槽位应先分给高优先级
+        tasks = []
+        for priority in (INGEST, BATCH, INTERACTIVE):
+            tasks.append(asyncio.create_task(worker(priority)))
+            await _settle()
+        scheduler.release(INTERACTIVE, holder)
+        await asyncio.gather(*tasks)
+        return order, _running(scheduler)
+
+    order, running = asyncio.run(scenario())
+    assert order == [INTERACTIVE, BATCH, INGEST]
+    assert running == 0
+
+
+def test_new_arrivals_do_not_jump_the_queue():
+    async def scenario():
+        scheduler = _scheduler(capacity=1)
+        holder = await scheduler.acquire(BATCH)
+        queued = asyncio.create_task(scheduler.acquire(BATCH))
+        await _settle()
+        scheduler.release(BATCH, holder)
+        # 槽位已在唤醒前分给排队者，同级新请求只能排在后面
+        late = asyncio.create_task(scheduler.acquire(BATCH))
+        await _settle()
+        first = await queued
+        assert not late.done()
+        scheduler.release(BATCH, first)
+        scheduler.release(BATCH, await late)
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_reserved_slots_only_serve_interactive():
+    async def scenario():
+        scheduler = _scheduler(capacity=2, reserved=1)
+        batch = await scheduler.acquire(BATCH)
+        waiting = asyncio.create_task(scheduler.acquire(BATCH))
+        await _settle()
+        assert not waiting.done()
+        # 预留槽位仍可立即分给交互请求
+        interactive = await asyncio.wait_for(scheduler.acquire(INTERACTIVE), 1)
+        scheduler.release(INTERACTIVE, interactive)
+        scheduler.release(BATCH, batch)
+        scheduler.release(BATCH, await waiting)
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_ingest_limit():
+    async def scenario():
+        scheduler = _scheduler(capacity=4, ingest_limit=1)
+        first = await scheduler.acquire(INGEST)
+        second = asyncio.create_task(scheduler.acquire(INGEST))
+        await _settle()
+        assert not second.done()
+        scheduler.release(INGEST, first)
+        scheduler.release(INGEST, await second)
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_is_rejected_with_retry_after():
+    async def scenario():
+        scheduler = _scheduler(capacity=1, queue=1)
+        holder = await scheduler.acquire(BATCH)
+        queued = asyncio.create_task(scheduler.acquire(BATCH))
+        await _settle()
+        with pytest.raises(Overloaded) as info:
+            await scheduler.acquire(BATCH)
+        assert info.value.retry_after >= 1
+        assert scheduler.stats()[BATCH]["rejected"] == 1
+        scheduler.release(BATCH, holder)
+        scheduler.release(BATCH, await queued)
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_rejected():
+    async def scenario():
+        scheduler = _scheduler(capacity=1, timeout=0.05)
+        holder = await scheduler.acquire(INTERACTIVE)
+        with pytest.raises(Overloaded):
+            await scheduler.acquire(INTERACTIVE)
+        stats = scheduler.stats()[INTERACTIVE]
+        assert stats["timeouts"] == 1 and stats["queued"] == 0
+        scheduler.release(INTERACTIVE, holder)
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = _scheduler(capacity=1)
+        holder = await scheduler.acquire(INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(INTERACTIVE))
+        await _settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()[INTERACTIVE]["queued"] == 0
+        scheduler.release(INTERACTIVE, holder)
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_slot_granted_then_cancelled_is_returned():
+    async def scenario():
+        scheduler = _scheduler(capacity=1)
+        holder = await scheduler.acquire(INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(INTERACTIVE))
+        await _settle()
+        # 槽位已分配给排队者，但它在被唤醒前就被取消（客户端断开）：槽位必须归还
+        scheduler.release(INTERACTIVE, holder)
+        waiter.cancel()
+        try:
+            acquired = await waiter
+        except asyncio.CancelledError:
+            pass
+        else:
+            # Python 3.11 的 wait_for 在内部 future 已完成时吞掉取消并返回结果：槽位归调用方，由其正常释放
+            scheduler.release(INTERACTIVE, acquired)
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_slot_context_releases_on_error():
+    async def scenario():
+        scheduler = _scheduler(capacity=1)
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot(BATCH):
+                raise RuntimeError("boom")
+        return _running(scheduler)
+
+    assert asyncio.run(scenario()) == 0
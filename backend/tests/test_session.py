@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from app.core.session import ChatSession, merge_session_contexts
+
+
+def _refs(contexts: list[dict]) -> list[tuple[str, int]]:
+    return [(ctx["text"][0], ctx["ref"]) for ctx in contexts]
+
+
+def test_refs_are_appended_and_stable():
+    session = ChatSession("s", "kb")
+    assert _refs(merge_session_contexts(session, [{"text": "a" * 10}, {"text": "b" * 10}], 100)) == [("a", 1), ("b", 2)]
+    merged = merge_session_contexts(session, [{"text": "b" * 10}, {"text": "c" * 10}], 100)
+    assert _refs(merged) == [("a", 1), ("b", 2), ("c", 3)]
+
+
+def test_budget_reset_keeps_existing_refs():
+    session = ChatSession("s", "kb")
+    merge_session_contexts(session, [{"text": "a" * 10}, {"text": "b" * 10}], 100)
+    # 超出预算后以本轮召回重置：保留的片段沿用原编号，新片段不复用已分配的编号
+    merged = merge_session_contexts(session, [{"text": "d" * 90}, {"text": "b" * 10}], 100)
+    assert _refs(merged) == [("d", 3), ("b", 2)]
+    assert _refs(merge_session_contexts(session, [{"text": "a" * 10}], 1000)) == [("d", 3), ("b", 2), ("a", 1)]
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from app.core.scheduler import BATCH, INGEST, INTERACTIVE, Overloaded, Scheduler
+from app.core.singleflight import SingleFlight
+
+
+def _scheduler(capacity: int) -> Scheduler:
+    # 不允许排队：超出执行槽的请求立即被拒绝
+    return Scheduler(
+        capacity=capacity,
+        reserved=0,
+        ingest_limit=1,
+        queue_limits={INTERACTIVE: 0, BATCH: 0, INGEST: 0},
+        queue_timeout=1.0,
+    )
+
+
+def test_coalesced_followers_do_not_take_slots():
+    async def main():
+        scheduler = _scheduler(capacity=1)
+        flight = SingleFlight()
+        calls = 0
+
+        async def answer():
+            nonlocal calls
+            async with scheduler.slot(INTERACTIVE):
+                calls += 1
+                await asyncio.sleep(0.05)
+                return "answer"
+
+        results = await asyncio.gather(*(flight.do("q", answer) for _ in range(8)))
+        assert [value for value, _ in results] == ["answer"] * 8
+        assert sum(shared for _, shared in results) == 7
+        assert calls == 1
+
+    asyncio.run(main())
+
+
+def test_coalesced_stream_followers_do_not_take_slots():
+    def produce():
+        for i in range(3):
+            time.sleep(0.02)
+            yield {"i": i}
+
+    async def consume(flight: SingleFlight, scheduler: Scheduler):
+        events, _ = await flight.stream("q", produce, lambda: scheduler.slot(INTERACTIVE))
+        return [event["i"] async for event in events]
+
+    async def main():
+        scheduler = _scheduler(capacity=1)
+        flight = SingleFlight()
+        results = await asyncio.gather(*(consume(flight, scheduler) for _ in range(8)))
+        assert results == [[0, 1, 2]] * 8
+        assert flight.stats()["executed"] == 1
+        assert scheduler.stats()[INTERACTIVE]["running"] == 0
+
+    asyncio.run(main())
+
+
+def test_stream_admission_failure_reaches_every_caller():
+    async def main():
+        scheduler = _scheduler(capacity=1)
+        flight = SingleFlight()
+        await scheduler.acquire(INTERACTIVE)  # 唯一的执行槽已被占用
+        outcomes = await asyncio.gather(
+            *(flight.stream("q", lambda: iter(()), lambda: scheduler.slot(INTERACTIVE)) for _ in range(3)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(outcome, Overloaded) for outcome in outcomes)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from app.core.shards import SnapshotCache
+
+
+def test_evict_matches_path_components_only(tmp_path: Path):
+    cache = SnapshotCache()
+    for name in ("kb1", "kb10", "kb1/shard-000"):
+        cache._entries[str(tmp_path / name)] = object()
+
+    cache.evict(tmp_path / "kb1")
+
+    assert sorted(cache._entries) == [str(tmp_path / "kb10")]
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import faiss
+import numpy as np
+
+from app.core.shards import subset_search
+
+
+class _CountingIndex:
+    """记录取回（即参与距离计算）的向量数；调用全量 search 视为失败。"""
+
+    def __init__(self, index):
+        self.index = index
+        self.ntotal = index.ntotal
+        self.reconstructed = 0
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        self.reconstructed += count
+        return self.index.reconstruct_n(start, count)
+
+    def search(self, *args, **kwargs):  # pragma: no cover - 不应被调用
+        raise AssertionError("subset_search 不应扫描全部位置")
+
+
+def test_subset_search_scores_only_routed_documents():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((5000, 32)).astype("float32")
+    index = faiss.IndexFlatL2(32)
+    index.add(vectors)
+    # 两个“文档”的切片区间，加一条别处的合并切片
+    positions = np.concatenate([np.arange(100, 140), np.arange(3000, 3025), [4321]]).astype("int64")
+    query = rng.standard_normal(32).astype("float32")
+
+    counting = _CountingIndex(index)
+    distances, found = subset_search(counting, query, positions, 5)
+
+    assert counting.reconstructed == len(positions)
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+    expected_d, expected_p = index.search(query[None, :], 5, params=params)
+    assert found.tolist() == expected_p[0].tolist()
+    np.testing.assert_allclose(distances, expected_d[0], rtol=1e-4)